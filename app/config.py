@@ -0,0 +1,188 @@
+# app/config.py - typed settings, read once from the environment
+import os
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+# Load .env before anything reads the environment, so it reaches settings
+# built at import time too
+try:
+    from dotenv import load_dotenv
+    DOTENV_AVAILABLE = True
+    load_dotenv()
+except ImportError:
+    DOTENV_AVAILABLE = False
+
+
+def _read(name, default, cast, kind):
+    raw = os.getenv(name)
+    if raw is None or raw.strip() == "":
+        return default
+    try:
+        return cast(raw.strip())
+    except ValueError:
+        raise ValueError(f"{name}={raw!r} is not a valid {kind}") from None
+
+
+def _str(name, default=None):
+    return field(default_factory=lambda: _read(name, default, str, "string"))
+
+
+def _int(name, default):
+    return field(default_factory=lambda: _read(name, default, int, "integer"))
+
+
+def _float(name, default):
+    return field(default_factory=lambda: _read(name, default, float, "number"))
+
+
+def _bool(name, default):
+    return field(default_factory=lambda: _read(name, default, lambda raw: raw.lower() not in ("0", "false", "no", "off"), "flag"))
+
+
+def _list(name):
+    return field(default_factory=lambda: _read(name, [], lambda raw: [item.strip() for item in raw.split(",") if item.strip()], "list"))
+
+
+def _data_path(name, filename):
+    """A state file's path: name if set, else filename inside DATA_DIR (./data)"""
+    return field(default_factory=lambda: _read(name, os.path.join(_read("DATA_DIR", "data", str, "string"), filename), str, "string"))
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Every environment variable the app reads, with its type and default.
+
+    Built once at import; a malformed value fails startup with the variable's
+    name instead of surfacing later inside a request.
+    """
+
+    # Server (run.py)
+    host: str = _str("HOST", "0.0.0.0")
+    port: int = _int("PORT", 8000)
+    workers: int = _int("WEB_CONCURRENCY", 1)
+    reload: bool = _bool("RELOAD", False)
+    keep_alive_seconds: int = _int("SERVER_KEEP_ALIVE", 5)
+    backlog: int = _int("SERVER_BACKLOG", 2048)
+    graceful_shutdown_seconds: int = _int("SERVER_GRACEFUL_SHUTDOWN", 30)
+    max_requests_per_worker: int = _int("SERVER_MAX_REQUESTS", 0)
+    forwarded_allow_ips: str = _str("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+    # Request deadlines (app/middleware/deadline.py); X-Request-Timeout overrides the default
+    request_timeout: float = _float("REQUEST_TIMEOUT", 60.0)
+    stream_request_timeout: float = _float("STREAM_REQUEST_TIMEOUT", 300.0)
+    upload_request_timeout: float = _float("UPLOAD_REQUEST_TIMEOUT", 300.0)
+    request_timeout_max: float = _float("REQUEST_TIMEOUT_MAX", 600.0)
+    deadline_fallback_margin: float = _float("DEADLINE_FALLBACK_MARGIN", 1.0)
+
+    # Admission control (app/middleware/admission.py); limits per generation route adapt to latency
+    admission_control: bool = _bool("ADMISSION_CONTROL", True)
+    admission_initial_limit: int = _int("ADMISSION_INITIAL_LIMIT", 20)
+    admission_min_limit: int = _int("ADMISSION_MIN_LIMIT", 4)
+    admission_max_limit: int = _int("ADMISSION_MAX_LIMIT", 200)
+    # Requests waiting for a slot per route, and how long they wait before a 503
+    admission_queue_size: int = _int("ADMISSION_QUEUE_SIZE", 50)
+    admission_queue_timeout: float = _float("ADMISSION_QUEUE_TIMEOUT", 5.0)
+    # Generations one tenant (see tenant_for) may have running or queued at once;
+    # requests that join an identical in-flight generation don't count
+    admission_client_limit: int = _int("ADMISSION_CLIENT_LIMIT", 8)
+    # Latency may grow this far over its long-run average before the limit shrinks
+    admission_latency_tolerance: float = _float("ADMISSION_LATENCY_TOLERANCE", 1.5)
+
+    # Logging
+    log_level: str = _str("LOG_LEVEL", "INFO")
+    log_format: str = _str("LOG_FORMAT", "text")
+
+    # OpenRouter
+    openrouter_api_key: Optional[str] = _str("OPENROUTER_API_KEY")
+    openrouter_base_url: str = _str("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+    openrouter_models: List[str] = _list("OPENROUTER_MODELS")
+    dispatch_strategy: str = _str("OPENROUTER_DISPATCH_STRATEGY", "hedged")
+    hedge_delay: float = _float("OPENROUTER_HEDGE_DELAY", 8.0)
+    hedge_min_delay: float = _float("OPENROUTER_HEDGE_MIN_DELAY", 1.0)
+    race_width: int = _int("OPENROUTER_RACE_WIDTH", 2)
+    max_connections: int = _int("OPENROUTER_MAX_CONNECTIONS", 100)
+    max_keepalive_connections: int = _int("OPENROUTER_MAX_KEEPALIVE", 20)
+    keepalive_expiry: float = _float("OPENROUTER_KEEPALIVE_EXPIRY", 30.0)
+    http2: bool = _bool("OPENROUTER_HTTP2", True)
+    warm_connections: int = _int("OPENROUTER_WARM_CONNECTIONS", 2)
+
+    # Client-side rate limiting
+    rate_limit_db: Optional[str] = _str("RATE_LIMIT_DB")
+    rpm: int = _int("OPENROUTER_RPM", 20)
+    daily_quota: int = _int("OPENROUTER_DAILY_QUOTA", 50)
+    model_rpm: int = _int("OPENROUTER_MODEL_RPM", 0)
+    rate_limit_max_wait: float = _float("RATE_LIMIT_MAX_WAIT", 10.0)
+    rate_limit_max_wait_background: float = _float("RATE_LIMIT_MAX_WAIT_BACKGROUND", 300.0)
+    rate_limit_default_backoff: float = _float("RATE_LIMIT_DEFAULT_BACKOFF", 10.0)
+
+    # Model health
+    ewma_alpha: float = _float("MODEL_HEALTH_EWMA_ALPHA", 0.3)
+    circuit_failure_threshold: int = _int("CIRCUIT_FAILURE_THRESHOLD", 3)
+    circuit_open_seconds: float = _float("CIRCUIT_OPEN_SECONDS", 60.0)
+    circuit_max_open_seconds: float = _float("CIRCUIT_MAX_OPEN_SECONDS", 900.0)
+
+    # Model catalog
+    model_catalog_path: str = _data_path("MODEL_CATALOG_PATH", "model_catalog.json")
+    model_catalog_refresh_seconds: float = _float("MODEL_CATALOG_REFRESH_SECONDS", 3600.0)
+
+    # Response cache
+    response_cache_ttl: float = _float("RESPONSE_CACHE_TTL", 86400.0)
+    response_cache_max_entries: int = _int("RESPONSE_CACHE_MAX_ENTRIES", 1000)
+    response_cache_max_bytes: int = _int("RESPONSE_CACHE_MAX_BYTES", 50_000_000)
+    response_cache_db: Optional[str] = _str("RESPONSE_CACHE_DB")
+    response_cache_warm_entries: int = _int("RESPONSE_CACHE_WARM_ENTRIES", 200)
+    # Estimated Jaccard similarity of word 3-grams; 0 turns near-duplicate matching off
+    near_duplicate_threshold: float = _float("NEAR_DUPLICATE_THRESHOLD", 0.9)
+    near_duplicate_max_entries: int = _int("NEAR_DUPLICATE_MAX_ENTRIES", 100_000)
+
+    # Generation tasks
+    # tiktoken encoding for token counts, if tiktoken is installed; "none" estimates from length
+    tokenizer_encoding: str = _str("TOKENIZER_ENCODING", "cl100k_base")
+    quiz_max_input_tokens: int = _int("QUIZ_MAX_INPUT_TOKENS", 6000)
+    flashcards_max_input_tokens: int = _int("FLASHCARDS_MAX_INPUT_TOKENS", 6000)
+    quiz_max_count: int = _int("QUIZ_MAX_COUNT", 50)
+    flashcards_max_count: int = _int("FLASHCARDS_MAX_COUNT", 100)
+    # Shards of one large quiz or deck generated at once
+    deck_shard_concurrency: int = _int("DECK_SHARD_CONCURRENCY", 4)
+    summary_max_chunk_tokens: int = _int("SUMMARY_MAX_CHUNK_TOKENS", 3000)
+    summary_max_parallel_chunks: int = _int("SUMMARY_MAX_PARALLEL_CHUNKS", 4)
+    # LLM summaries mode=auto may have running in the background; past this it only answers extractively
+    summary_max_background: int = _int("SUMMARY_MAX_BACKGROUND", 8)
+
+    # Batch endpoint
+    batch_max_items: int = _int("BATCH_MAX_ITEMS", 100)
+    batch_concurrency: int = _int("BATCH_CONCURRENCY", 4)
+
+    # Background jobs
+    job_store: str = _str("JOB_STORE", "memory")
+    job_store_path: str = _data_path("JOB_STORE_PATH", "jobs.db")
+    job_retention_seconds: float = _float("JOB_RETENTION_SECONDS", 3600.0)
+    job_workers: int = _int("JOB_WORKERS", 4)
+    job_tenant_concurrency: int = _int("JOB_TENANT_CONCURRENCY", 2)
+    # Addresses of gateways that authenticate callers and set X-Tenant-ID for them.
+    # From anyone else the header is ignored and the client address is the tenant.
+    trusted_tenant_proxies: List[str] = _list("TRUSTED_TENANT_PROXIES")
+    job_max_pending: int = _int("JOB_MAX_PENDING", 1000)
+    # Job webhooks: POSTed with their own short timeout. With an allowlist only those
+    # hosts are called; without one, hosts resolving to private/loopback/link-local are refused.
+    job_callback_timeout: float = _float("JOB_CALLBACK_TIMEOUT", 5.0)
+    job_callback_allowed_hosts: List[str] = _list("JOB_CALLBACK_ALLOWED_HOSTS")
+
+    # PDF uploads
+    pdf_workers: int = _int("PDF_WORKERS", min(4, os.cpu_count() or 1))
+    pdf_max_upload_bytes: int = _int("PDF_MAX_UPLOAD_BYTES", 25 * 1024 * 1024)
+    pdf_max_pages: int = _int("PDF_MAX_PAGES", 300)
+
+    def shared_state_problems(self):
+        """Settings that are only correct with a single worker process"""
+        if self.workers <= 1:
+            return []
+        problems = []
+        if self.job_store != "sqlite":
+            problems.append("JOB_STORE=memory: a job polled on another worker is not found")
+        if not self.rate_limit_db:
+            problems.append("RATE_LIMIT_DB unset: each worker spends the full OpenRouter quota")
+        return problems
+
+
+settings = Settings()
@@ -0,0 +1,97 @@
+# app/middleware/admission.py - shed generation load before it piles onto the worker
+import asyncio
+import logging
+import time
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from app.config import settings
+from app.services.admission import admission, admission_ticket, Shed, Ticket
+from app.services.deadline import remaining
+from app.utils.tenants import tenant_for
+
+logger = logging.getLogger(__name__)
+
+# Routes that start generations, each with its own limit. Jobs are left out:
+# their queue already bounds how much runs at once.
+GATED_ROUTES = (
+    "/api/summarize", "/api/summarize/stream", "/api/summarize-alt",
+    "/api/generate-quiz", "/api/generate-quiz/stream",
+    "/api/generate-flashcards", "/api/generate-flashcards/stream",
+    "/api/study-pack", "/api/upload-pdf",
+)
+BATCH_PREFIX = "/api/batch/"
+
+
+def gated_route(scope):
+    """The route label requests to this path are limited under, or None if it is not gated"""
+    if scope["method"] != "POST":
+        return None
+    path = scope["path"]
+    if path.startswith(BATCH_PREFIX):
+        return BATCH_PREFIX + "{kind}"
+    return path if path in GATED_ROUTES else None
+
+
+def busy_response(status_code, retry_after):
+    detail = "Too many requests from this client in progress" if status_code == 429 else "Server is busy, please retry shortly"
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": detail, "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+class AdmissionMiddleware:
+    """Caps concurrent generations per route and per client, shedding the rest fast.
+
+    A request over its route's limit waits in a short FIFO queue; when the
+    queue is full, or the wait outlasts ADMISSION_QUEUE_TIMEOUT or the
+    request's own deadline, it gets a 503 with Retry-After instead of
+    adding to the latency of everything already running. A client (see
+    tenant_for) over ADMISSION_CLIENT_LIMIT gets a 429; requests merged by
+    single-flight stop counting once they join. Route limits adapt to observed
+    latency (see GradientLimit). Sits inside CORSMiddleware so browsers
+    can read the rejection.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route = gated_route(scope) if scope["type"] == "http" and settings.admission_control else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        ticket = Ticket(tenant_for(Request(scope)))
+        try:
+            gate = await admission.admit(route, ticket, timeout=remaining())
+        except Shed as e:
+            logger.info("Shed %s %s from %s: %s", scope["method"], scope["path"], ticket.client, e.reason)
+            await busy_response(429 if e.reason == "client_limit" else 503, e.retry_after)(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = admission_ticket.set(ticket)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except asyncio.CancelledError:
+            # Client left; how long that took says nothing about our capacity
+            gate.release()
+            raise
+        except BaseException:
+            gate.release(time.monotonic() - started, dropped=True)
+            raise
+        else:
+            gate.release(time.monotonic() - started, dropped=status is None or status >= 500)
+        finally:
+            admission_ticket.reset(token)
+            admission.leave(ticket)
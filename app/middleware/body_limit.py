@@ -0,0 +1,68 @@
+# app/middleware/body_limit.py - refuse oversized request bodies while they arrive
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from app.config import settings
+
+# Room for the multipart boundaries, part headers and small form fields around the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# (path, largest body in bytes) - requests to other paths are not limited here
+BODY_LIMITS = (
+    ("/api/upload-pdf", settings.pdf_max_upload_bytes + MULTIPART_OVERHEAD_BYTES),
+)
+
+
+def body_limit(path):
+    for prefix, limit in BODY_LIMITS:
+        if path == prefix:
+            return limit
+    return None
+
+
+def too_large_detail(limit):
+    return f"Request body is larger than {limit // (1024 * 1024)} MB"
+
+
+class BodyLimitMiddleware:
+    """Rejects a request body over its route's limit before it is all received.
+
+    Starlette spools a multipart upload to a temporary file before the
+    handler runs, so a size check in the handler only happens after the
+    whole upload has arrived. Here a Content-Length over the limit gets a
+    413 straight away, and a chunked body is counted as it is read; the
+    HTTPException raised from receive() reaches FastAPI's handler, which
+    answers 413 instead of parsing on.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = body_limit(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    break
+                if declared > limit:
+                    response = JSONResponse(status_code=413, content={"detail": too_large_detail(limit)})
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def receive_wrapper():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=too_large_detail(limit))
+            return message
+
+        await self.app(scope, receive_wrapper, send)
@@ -0,0 +1,106 @@
+# app/middleware/deadline.py - per-request deadlines and cancellation on disconnect
+import asyncio
+import logging
+import time
+from app.config import settings
+from app.services.deadline import request_deadline
+from app.services.metrics import CLIENT_DISCONNECTS
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_HEADER = b"x-request-timeout"
+# (path prefix, default budget in seconds) - first match wins, None is no deadline.
+# Batch items run for as long as the NDJSON stream does; each is bounded by its
+# own upstream timeouts instead.
+ROUTE_BUDGETS = (
+    ("/api/batch/", None),
+    ("/api/upload-pdf", settings.upload_request_timeout),
+    ("/debug/", None),
+)
+
+
+def default_budget(path):
+    for prefix, budget in ROUTE_BUDGETS:
+        if path.startswith(prefix):
+            return budget
+    if path.endswith("/stream"):
+        return settings.stream_request_timeout
+    return settings.request_timeout
+
+
+def request_budget(scope):
+    """Seconds this request may take: X-Request-Timeout if valid, else the route's default"""
+    for name, value in scope.get("headers", ()):
+        if name == TIMEOUT_HEADER:
+            try:
+                budget = float(value)
+            except ValueError:
+                break
+            if budget > 0:
+                return min(budget, settings.request_timeout_max)
+            break
+    return default_budget(scope["path"])
+
+
+class DeadlineMiddleware:
+    """Gives each HTTP request a deadline and stops its work if the client leaves.
+
+    The deadline (time.monotonic()) goes in the request_deadline context
+    variable, where generation and the upstream client read it; this
+    middleware never cuts a response off itself. Once the request body has
+    been read, a watcher waits for http.disconnect and cancels the handler,
+    so abandoned requests stop spending upstream calls.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget = request_budget(scope)
+        token = request_deadline.set(time.monotonic() + budget if budget is not None else None)
+        try:
+            await self._run(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
+
+    async def _run(self, scope, receive, send):
+        body_read = asyncio.Event()
+        disconnected = asyncio.Event()
+
+        async def receive_wrapper():
+            if body_read.is_set():
+                # Only a disconnect can follow the body, and the watcher owns receive() now
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        handler = asyncio.create_task(self.app(scope, receive_wrapper, send))
+
+        async def watch():
+            await body_read.wait()
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+            if not handler.done():
+                scope["client_disconnected"] = True
+                CLIENT_DISCONNECTS.inc()
+                logger.info("Client left %s %s, cancelling", scope["method"], scope["path"])
+                handler.cancel()
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not scope.get("client_disconnected"):
+                raise
+        finally:
+            watcher.cancel()
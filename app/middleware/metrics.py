@@ -0,0 +1,55 @@
+# app/middleware/metrics.py - end-to-end route latency
+import time
+from app.services.metrics import HTTP_REQUEST_SECONDS
+
+
+def _route_label(scope):
+    """The route template, or "unmatched" for 404s"""
+    route = scope.get("route")
+    path_regex = getattr(route, "path_regex", None)
+    if path_regex is None:
+        return "unmatched"
+    # Newer FastAPI mounts included routers, leaving route.path relative to
+    # the prefix (e.g. /jobs/{job_id} under /api), so put the prefix back
+    path = scope["path"]
+    for i, char in enumerate(path):
+        if char == "/" and path_regex.match(path[i:]):
+            return path[:i] + route.path
+    return route.path
+
+
+class MetricsMiddleware:
+    """Times each HTTP request until its last body chunk is sent.
+
+    Plain ASGI rather than @app.middleware("http") so streamed responses
+    (SSE, NDJSON) are timed to the end of the stream, not to the headers.
+    Requests are labelled by route template, e.g. /api/jobs/{job_id}.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_SECONDS.observe(
+                time.monotonic() - started,
+                method=scope["method"],
+                route=_route_label(scope),
+                # 499 as nginx logs it: the client left before a response (see DeadlineMiddleware)
+                status=status or (499 if scope.get("client_disconnected") else 500)
+            )
@@ -0,0 +1,57 @@
+import json
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import StreamingResponse
+from app.config import settings
+from app.services.batch import generate_batch, BATCH_KINDS
+
+router = APIRouter()
+
+def _parse_items(entries):
+    """(id, notes) for each usable entry and an error line for each unusable one.
+
+    An entry is a notes string (its id is its position) or {"id": ..., "notes": ...}.
+    """
+    items, invalid = [], []
+    for index, entry in enumerate(entries):
+        item_id, notes = index, entry
+        if isinstance(entry, dict):
+            item_id, notes = entry.get("id", index), entry.get("notes")
+        if not isinstance(notes, str) or notes.strip() == "":
+            invalid.append({"id": item_id, "status": "invalid", "error": "Notes are required"})
+        else:
+            items.append((item_id, notes))
+    return items, invalid
+
+@router.post("/batch/{kind}")
+async def batch(kind: str, request: Request):
+    """Generate one kind of artifact for many sets of notes.
+
+    Streams one NDJSON line per item as it completes, with its id and
+    status, then a final {"done": true, ...} line with the totals.
+    """
+    if kind not in BATCH_KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown batch type. Use one of: {', '.join(BATCH_KINDS)}")
+
+    data = await request.json()
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail='Body must be a JSON object: {"notes": [...]}')
+    entries = data.get("notes")
+
+    if not isinstance(entries, list) or not entries:
+        raise HTTPException(status_code=400, detail="notes must be a non-empty list")
+    if len(entries) > settings.batch_max_items:
+        raise HTTPException(status_code=413, detail=f"At most {settings.batch_max_items} notes per batch")
+
+    items, invalid = _parse_items(entries)
+
+    async def ndjson():
+        statuses = {}
+        for line in invalid:
+            statuses[line["status"]] = statuses.get(line["status"], 0) + 1
+            yield json.dumps(line) + "\n"
+        async for line in generate_batch(kind, items):
+            statuses[line["status"]] = statuses.get(line["status"], 0) + 1
+            yield json.dumps(line) + "\n"
+        yield json.dumps({"done": True, "total": len(entries), "statuses": statuses}) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import JSONResponse
+from app.services.job_queue import job_queue, validate_callback_url, JOB_KINDS, QueueFull
+from app.utils.tenants import tenant_for
+
+router = APIRouter()
+
+@router.post("/jobs/{kind}")
+async def create_job(kind: str, request: Request):
+    """Queue a generation and return its job id straight away"""
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown job type. Use one of: {', '.join(JOB_KINDS)}")
+
+    data = await request.json()
+    notes = data.get("notes")
+    callback_url = data.get("callback_url")
+
+    if not notes or notes.strip() == "":
+        raise HTTPException(status_code=400, detail="Notes are required")
+    if callback_url:
+        try:
+            await validate_callback_url(str(callback_url))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        job = await job_queue.submit(kind, notes, tenant_for(request), callback_url)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full, try again later", headers={"Retry-After": "30"})
+
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job["id"], "status": job["status"], "status_url": f"/api/jobs/{job['id']}"}
+    )
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -1,7 +1,12 @@
+import logging
 from fastapi import APIRouter, Request, HTTPException
-from app.services.quiz_generator import generate_quiz_using_openrouter
+from app.services.decks import deck_options
+from app.services.rate_limiter import RateLimitExceeded
+from app.services.quiz_generator import DEFAULT_COUNT, MAX_COUNT, generate_quiz_using_openrouter, stream_quiz_using_openrouter
+from app.utils.sse import sse_response
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 @router.post("/generate-quiz")
 async def generate_quiz(request: Request):
@@ -11,16 +16,36 @@ async def generate_quiz(request: Request):
         
         if not notes or notes.strip() == "":
             raise HTTPException(status_code=400, detail="Notes are required")
+        try:
+            count, difficulty = deck_options(data, DEFAULT_COUNT, MAX_COUNT)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-        quiz_json = generate_quiz_using_openrouter(notes)
+        meta = {}
+        quiz_json = await generate_quiz_using_openrouter(notes, meta, count, difficulty)
         
         if not quiz_json:
             raise HTTPException(status_code=500, detail="Failed to generate quiz")
             
-        return {"quiz": quiz_json}
+        response = {"quiz": quiz_json, "cache": meta.get("cache", "miss"), "tokens_saved": meta.get("tokens_saved", 0)}
+        if meta.get("shortfall"):
+            # Fewer items than asked for, even after a top-up
+            response["shortfall"] = meta["shortfall"]
+        return response
         
-    except HTTPException:
+    except (HTTPException, RateLimitExceeded):
         raise
-    except Exception as e:
-        print(f"Quiz generation error: {e}")
+    except Exception:
+        logger.exception("Quiz generation error")
         raise HTTPException(status_code=500, detail="Internal server error")
+
+# Streams each question as Server-Sent Events as soon as the model finishes it
+@router.post("/generate-quiz/stream")
+async def stream_quiz(request: Request):
+    data = await request.json()
+    notes = data.get("notes")
+
+    if not notes or notes.strip() == "":
+        raise HTTPException(status_code=400, detail="Notes are required")
+
+    return sse_response(stream_quiz_using_openrouter(notes))
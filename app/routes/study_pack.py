@@ -0,0 +1,32 @@
+import json
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import StreamingResponse
+from app.services.study_pack import generate_study_pack
+
+router = APIRouter()
+
+@router.post("/study-pack")
+async def study_pack(request: Request, stream: bool = True):
+    """Summary, quiz and flashcards in one call.
+
+    Streams one NDJSON line per part as it completes; pass ?stream=false to
+    get a single JSON object once all three are ready.
+    """
+    data = await request.json()
+    notes = data.get("notes")
+
+    if not notes or notes.strip() == "":
+        raise HTTPException(status_code=400, detail="Notes are required")
+
+    if not stream:
+        pack = {}
+        async for part in generate_study_pack(notes):
+            pack[part.pop("part")] = part
+        return pack
+
+    async def ndjson():
+        async for part in generate_study_pack(notes):
+            yield json.dumps(part) + "\n"
+        yield json.dumps({"done": True}) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
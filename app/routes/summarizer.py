@@ -1,33 +1,66 @@
+import logging
+from typing import Literal
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
-from app.services.summarize import generate_summary_using_openrouter
+from app.services.rate_limiter import RateLimitExceeded
+from app.services.summarize import summarize, stream_summary_using_openrouter
+from app.utils.sse import sse_response
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class NotesRequest(BaseModel):
     notes: str
 
+# ?mode=fast answers locally in milliseconds, ?mode=auto gives the model
+# summary when it's cached and the fast one (while it's generated) otherwise
+SummaryMode = Literal["fast", "llm", "auto"]
+
+def _summary_response(summary, meta):
+    response = {
+        "summary": summary,
+        "cache": meta.get("cache", "miss"),
+        "mode": meta["mode"],
+        "fallback": meta.get("fallback", False),
+        "tokens_saved": meta.get("tokens_saved", 0)
+    }
+    if meta.get("llm_pending"):
+        response["llm_pending"] = True
+    return response
+
 @router.post("/summarize")
-async def summarize_notes(data: NotesRequest):
+async def summarize_notes(data: NotesRequest, mode: SummaryMode = "llm"):
     notes = data.notes
     if not notes or notes.strip() == "":
         raise HTTPException(status_code=400, detail="Notes are required.")
     
     try:
         # Use the actual summarization service
-        summary = generate_summary_using_openrouter(notes)
+        meta = {}
+        summary = await summarize(notes, mode, meta)
         
         if summary == "Summary failed.":
             raise HTTPException(status_code=500, detail="Failed to generate summary")
             
-        return {"summary": summary}
-    except Exception as e:
-        print(f"Summarization error: {e}")
+        return _summary_response(summary, meta)
+    except (HTTPException, RateLimitExceeded):
+        raise
+    except Exception:
+        logger.exception("Summarization error")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+# Streams the summary token by token as Server-Sent Events
+@router.post("/summarize/stream")
+async def summarize_notes_stream(data: NotesRequest, mode: SummaryMode = "llm"):
+    notes = data.notes
+    if not notes or notes.strip() == "":
+        raise HTTPException(status_code=400, detail="Notes are required.")
+
+    return sse_response(stream_summary_using_openrouter(notes, mode))
+
 # Alternative endpoint that accepts JSON in request body (for Postman)
 @router.post("/summarize-alt")
-async def summarize_notes_alt(request: Request):
+async def summarize_notes_alt(request: Request, mode: SummaryMode = "llm"):
     try:
         data = await request.json()
         notes = data.get("notes")
@@ -35,12 +68,15 @@ async def summarize_notes_alt(request: Request):
         if not notes or notes.strip() == "":
             raise HTTPException(status_code=400, detail="Notes are required.")
         
-        summary = generate_summary_using_openrouter(notes)
+        meta = {}
+        summary = await summarize(notes, mode, meta)
         
         if summary == "Summary failed.":
             raise HTTPException(status_code=500, detail="Failed to generate summary")
             
-        return {"summary": summary}
-    except Exception as e:
-        print(f"Summarization error: {e}")
+        return _summary_response(summary, meta)
+    except (HTTPException, RateLimitExceeded):
+        raise
+    except Exception:
+        logger.exception("Summarization error")
         raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
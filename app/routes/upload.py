@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from fastapi import APIRouter, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse
+from app.config import settings
+from app.services.job_queue import job_queue, JOB_KINDS, QueueFull
+from app.services.response_cache import response_cache
+from app.utils.file_handler import extract_text_from_pdf_path, PdfError, PdfTooLarge
+from app.utils.preprocess import PAGE_BREAK
+from app.utils.tenants import tenant_for
+
+router = APIRouter()
+
+MAX_UPLOAD_BYTES = settings.pdf_max_upload_bytes
+MAX_PAGES = settings.pdf_max_pages
+READ_CHUNK_BYTES = 1024 * 1024
+EXTRACTOR_VERSION = "v2"
+
+async def _spool_to_disk(upload, path):
+    """Copy the upload to path in chunks, returning its SHA-256 and enforcing the size cap"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as out:
+        while chunk := await upload.read(READ_CHUNK_BYTES):
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"PDF is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+    return digest.hexdigest()
+
+@router.post("/upload-pdf")
+async def upload_pdf(
+    request: Request,
+    file: UploadFile = File(...),
+    generate: str = Form("summary"),
+    background: bool = Form(False)
+):
+    """Extract a PDF's text and feed it to summary / quiz / flashcards / study-pack.
+
+    generate=none returns just the text. background=true queues the
+    generation as a job and returns its id instead of waiting.
+    """
+    if generate != "none" and generate not in JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"generate must be none or one of: {', '.join(JOB_KINDS)}")
+    # BodyLimitMiddleware bounds the whole request; this is the cap on the file itself
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"PDF is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        file_hash = await _spool_to_disk(file, path)
+
+        # Same file uploaded again - skip extraction entirely
+        extracted = await response_cache.get("pdf-text", file_hash, EXTRACTOR_VERSION)
+        text_cache = "hit" if extracted is not None else "miss"
+        if extracted is None:
+            try:
+                text, pages = await extract_text_from_pdf_path(path, MAX_PAGES)
+            except PdfTooLarge as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            except PdfError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            extracted = {"text": text, "pages": pages}
+            await response_cache.set("pdf-text", file_hash, EXTRACTOR_VERSION, extracted)
+    finally:
+        os.remove(path)
+
+    text = extracted["text"]
+    if not text:
+        raise HTTPException(status_code=422, detail="No extractable text found in PDF (scanned images are not supported)")
+
+    response = {
+        "filename": file.filename,
+        "pages": extracted["pages"],
+        "characters": len(text),
+        "text_cache": text_cache
+    }
+
+    if generate == "none":
+        response["text"] = text.replace(PAGE_BREAK, "\n\n")
+        return response
+
+    if background:
+        try:
+            job = await job_queue.submit(generate, text, tenant_for(request))
+        except QueueFull:
+            raise HTTPException(status_code=503, detail="Job queue is full, try again later", headers={"Retry-After": "30"})
+        response.update({"job_id": job["id"], "status_url": f"/api/jobs/{job['id']}"})
+        return JSONResponse(status_code=202, content=response)
+
+    response.update(await JOB_KINDS[generate](text))
+    return response
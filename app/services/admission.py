@@ -0,0 +1,244 @@
+# app/services/admission.py - adaptive concurrency limits for generation routes
+import asyncio
+import contextvars
+import math
+import time
+from collections import Counter, deque
+from app.config import settings
+from app.services.metrics import (
+    metrics, ADMISSION_IN_FLIGHT, ADMISSION_LIMIT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_SECONDS, ADMISSION_SHED
+)
+
+# Weight of each new sample in the short-run latency average
+SHORT_SMOOTHING = 0.3
+# Samples the long-run (baseline) latency average spans
+LONG_WINDOW = 500
+# How far a new limit moves towards the gradient's target per sample
+LIMIT_SMOOTHING = 0.2
+# Lowest gradient, i.e. the most a single sample can cut the limit by
+MIN_GRADIENT = 0.5
+MAX_RETRY_AFTER = 60
+
+
+class Shed(Exception):
+    """The request is turned away; reason is a metrics label"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Request shed ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """An admitted request's place in its tenant's count"""
+
+    def __init__(self, client):
+        self.client = client
+        self.counted = False
+
+
+# Ticket of the request being served, set by AdmissionMiddleware
+admission_ticket = contextvars.ContextVar("admission_ticket", default=None)
+
+
+class GradientLimit:
+    """Concurrency limit that follows latency, after Netflix's gradient2.
+
+    The limit is scaled by long-run latency over short-run latency, so it
+    shrinks when requests start taking longer than usual (work is queueing
+    somewhere: the rate limiter, OpenRouter, the event loop) and grows by
+    sqrt(limit) while latency holds. Samples taken while fewer than half
+    the slots are in use say nothing about capacity and are ignored for
+    growth; a failed request (5xx) always counts as overload.
+    """
+
+    def __init__(self, initial, min_limit, max_limit, tolerance):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.value = float(min(max(initial, min_limit), max_limit))
+        self.short_latency = None
+        self.long_latency = None
+
+    @property
+    def slots(self):
+        return int(self.value)
+
+    def update(self, latency, in_flight, dropped=False):
+        if self.short_latency is None:
+            self.short_latency = self.long_latency = latency
+        self.short_latency += (latency - self.short_latency) * SHORT_SMOOTHING
+        self.long_latency += (latency - self.long_latency) / LONG_WINDOW
+        # After an overload the baseline is inflated; let it come back down
+        # instead of waiting LONG_WINDOW samples for it to decay
+        if self.long_latency > 2 * self.short_latency:
+            self.long_latency *= 0.95
+
+        if dropped:
+            gradient = MIN_GRADIENT
+        elif in_flight < self.value / 2:
+            return
+        else:
+            gradient = max(MIN_GRADIENT, min(1.0, self.tolerance * self.long_latency / self.short_latency))
+        target = self.value * gradient + math.sqrt(self.value)
+        value = self.value * (1 - LIMIT_SMOOTHING) + target * LIMIT_SMOOTHING
+        self.value = min(max(value, self.min_limit), self.max_limit)
+
+
+class RouteGate:
+    """In-flight cap for one route, with a bounded FIFO of requests waiting for a slot"""
+
+    def __init__(self, route, limit, queue_size, queue_timeout):
+        self.route = route
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """Seconds until a slot is likely free: typical latency times the queue ahead, per slot"""
+        latency = self.limit.short_latency or 1.0
+        estimate = latency * (self.queued + 1) / max(1, self.limit.slots)
+        return min(MAX_RETRY_AFTER, max(1, math.ceil(estimate)))
+
+    async def acquire(self, timeout=None):
+        """Take a slot, waiting in line at most timeout (default queue_timeout); raises Shed"""
+        if self.in_flight < self.limit.slots and not self._waiters:
+            self.in_flight += 1
+            return
+        if self.queued >= self.queue_size:
+            raise Shed("queue_full", self.retry_after())
+
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait((waiter,), timeout=max(0.0, timeout))
+        except asyncio.CancelledError:
+            if waiter.done():
+                # Granted a slot in the same tick the caller went away
+                self._free()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+        if not waiter.done():
+            waiter.cancel()
+            self._waiters.remove(waiter)
+            raise Shed("queue_timeout", self.retry_after())
+        ADMISSION_QUEUE_SECONDS.observe(time.monotonic() - started, route=self.route)
+
+    def release(self, latency=None, dropped=False):
+        """Give the slot back; latency is None when the request was cut short (e.g. disconnect)"""
+        if latency is not None:
+            self.limit.update(latency, self.in_flight, dropped)
+        self._free()
+
+    def _free(self):
+        self.in_flight -= 1
+        # Slots are handed over directly so a new arrival can't overtake the queue
+        while self._waiters and self.in_flight < self.limit.slots:
+            self.in_flight += 1
+            self._waiters.popleft().set_result(None)
+
+
+class AdmissionController:
+    """Per-route gates plus a cap on what one client may have running or queued.
+
+    State is per worker process, like the metrics; with several uvicorn
+    workers each one sheds on its own load.
+    """
+
+    def __init__(self, initial_limit, min_limit, max_limit, tolerance, queue_size, queue_timeout, client_limit):
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.client_limit = client_limit
+        self._gates = {}
+        self._clients = Counter()
+        self.shed = 0
+
+    def gate(self, route):
+        gate = self._gates.get(route)
+        if gate is None:
+            limit = GradientLimit(self.initial_limit, self.min_limit, self.max_limit, self.tolerance)
+            gate = self._gates[route] = RouteGate(route, limit, self.queue_size, self.queue_timeout)
+        return gate
+
+    async def admit(self, route, ticket, timeout=None):
+        """Wait for a slot on route for ticket's client; returns the gate to release(). Raises Shed."""
+        gate = self.gate(route)
+        try:
+            if self._clients[ticket.client] >= self.client_limit:
+                raise Shed("client_limit", gate.retry_after())
+            self._clients[ticket.client] += 1
+            ticket.counted = True
+            try:
+                await gate.acquire(timeout)
+            except BaseException:
+                self.leave(ticket)
+                raise
+        except Shed as e:
+            self.shed += 1
+            ADMISSION_SHED.inc(route=route, reason=e.reason)
+            raise
+        return gate
+
+    def leave(self, ticket):
+        """Stop counting ticket against its client; safe to call more than once"""
+        if not ticket.counted:
+            return
+        ticket.counted = False
+        self._clients[ticket.client] -= 1
+        if self._clients[ticket.client] <= 0:
+            del self._clients[ticket.client]
+
+    def coalesced(self):
+        """The current request joined an identical in-flight generation.
+
+        It costs no upstream work of its own, so it stops counting against
+        its client: a class behind one NAT asking for the same notes isn't
+        turned away before single-flight can merge them.
+        """
+        ticket = admission_ticket.get()
+        if ticket is not None:
+            self.leave(ticket)
+
+    def stats(self):
+        return {
+            "shed": self.shed,
+            "routes": {
+                route: {"in_flight": gate.in_flight, "queued": gate.queued, "limit": gate.limit.slots}
+                for route, gate in self._gates.items()
+            }
+        }
+
+
+admission = AdmissionController(
+    initial_limit=settings.admission_initial_limit,
+    min_limit=settings.admission_min_limit,
+    max_limit=settings.admission_max_limit,
+    tolerance=settings.admission_latency_tolerance,
+    queue_size=settings.admission_queue_size,
+    queue_timeout=settings.admission_queue_timeout,
+    client_limit=settings.admission_client_limit
+)
+
+
+def _collect_admission():
+    for route, gate in admission._gates.items():
+        ADMISSION_IN_FLIGHT.set(gate.in_flight, route=route)
+        ADMISSION_QUEUE_DEPTH.set(gate.queued, route=route)
+        ADMISSION_LIMIT.set(gate.limit.slots, route=route)
+
+
+metrics.add_collector(_collect_admission)
@@ -0,0 +1,68 @@
+# app/services/batch.py - one kind of artifact for many sets of notes
+import asyncio
+import logging
+from app.config import settings
+from app.services.summarize import generate_summary_using_openrouter
+from app.services.quiz_generator import generate_quiz_using_openrouter
+from app.services.flashcard_generator import generate_flashcards_using_openrouter
+from app.services.rate_limiter import RateLimitExceeded, request_priority, BACKGROUND
+from app.services.response_cache import normalize_content
+
+logger = logging.getLogger(__name__)
+
+# kind -> (generator, result key)
+BATCH_KINDS = {
+    "summarize": (generate_summary_using_openrouter, "summary"),
+    "quiz": (generate_quiz_using_openrouter, "quiz"),
+    "flashcards": (generate_flashcards_using_openrouter, "flashcards"),
+}
+
+
+async def _generate_item(kind, content, semaphore):
+    generate, key = BATCH_KINDS[kind]
+    # Runs in its own task; single requests from other users go ahead of bulk work
+    request_priority.set(BACKGROUND)
+    meta = {}
+    async with semaphore:
+        try:
+            result = await generate(content, meta)
+        except RateLimitExceeded as e:
+            return {"status": "rate_limited", "error": str(e), "retry_after": round(e.retry_after)}
+        except Exception as e:
+            logger.exception("Batch %s item error", kind)
+            return {"status": "error", "error": str(e)}
+    if meta.get("error"):
+        return {"status": "error", "error": meta["error"]}
+    return {"status": "ok", key: result, "cache": meta.get("cache", "miss"), "fallback": meta.get("fallback", False)}
+
+
+async def generate_batch(kind, items, concurrency=None):
+    """Yield one result per (id, notes) item, in completion order.
+
+    At most `concurrency` items generate at once, all through the shared
+    rate limiter. Notes that are identical once whitespace is normalised are
+    generated once and reported under every id that sent them, the later
+    ones with duplicate_of.
+    """
+    semaphore = asyncio.Semaphore(concurrency or settings.batch_concurrency)
+    ids_by_content = {}
+    for item_id, content in items:
+        ids_by_content.setdefault(normalize_content(content), (content.strip(), []))[1].append(item_id)
+
+    tasks = {
+        asyncio.create_task(_generate_item(kind, content, semaphore)): ids
+        for content, ids in ids_by_content.values()
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                first, *duplicates = tasks[task]
+                yield {"id": first, **task.result()}
+                for item_id in duplicates:
+                    yield {"id": item_id, "duplicate_of": first, **task.result()}
+    finally:
+        # Client went away mid-stream - stop paying for the remaining items
+        for task in pending:
+            task.cancel()
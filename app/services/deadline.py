@@ -0,0 +1,40 @@
+# app/services/deadline.py - the current request's time budget, visible to every layer
+import contextvars
+import time
+from app.config import settings
+
+# Generation stops this long before the deadline, leaving time to send the fallback
+FALLBACK_MARGIN = settings.deadline_fallback_margin
+# Shortest upstream timeout handed out, so a nearly spent budget still gets a real try
+MIN_ATTEMPT_TIMEOUT = 1.0
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline won't leave time for this step; serve the fallback"""
+
+
+# time.monotonic() by which the current request must be answered; None for no limit.
+# Set per request by DeadlineMiddleware and inherited by tasks it starts.
+request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+def remaining():
+    """Seconds left before the current request's deadline, or None if it has none"""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def generation_budget():
+    """Seconds generation may run before the fallback has to be served, or None"""
+    left = remaining()
+    return None if left is None else max(0.0, left - FALLBACK_MARGIN)
+
+
+def attempt_timeout(timeout):
+    """timeout for one upstream call, cut to what the request has left"""
+    budget = generation_budget()
+    return timeout if budget is None else max(MIN_ATTEMPT_TIMEOUT, min(timeout, budget))
+
+
+def expired():
+    """True once generation should stop and serve the fallback instead"""
+    return generation_budget() == 0.0
@@ -0,0 +1,157 @@
+# app/services/decks.py - quizzes and flashcard decks of any size, generated in shards
+import asyncio
+import logging
+import math
+import re
+from app.config import settings
+from app.services.extractive import STOPWORDS
+from app.services.generation import engine
+from app.utils.chunking import split_into_chunks
+from app.utils.tokens import count_tokens, off_loop
+
+logger = logging.getLogger(__name__)
+
+DIFFICULTIES = ("mixed", "easy", "medium", "hard")
+# Added to the prompt; "mixed" leaves it as it always was
+DIFFICULTY_GUIDANCE = {
+    "easy": "Keep them easy: recall of key facts, terms and definitions.",
+    "medium": "Make them medium difficulty: understanding and applying the concepts.",
+    "hard": "Make them hard: analysis, comparison and multi-step reasoning about the material.",
+}
+# Sections smaller than this don't have enough in them to ask about separately
+MIN_SECTION_TOKENS = 300
+# Questions sharing this much of their content words are the same question
+DUPLICATE_WORD_OVERLAP = 0.8
+
+_WORD = re.compile(r"\w+")
+
+
+def deck_options(data, default_count, max_count):
+    """(count, difficulty) from a request body; ValueError with a message for the client"""
+    count = data.get("count", default_count)
+    if isinstance(count, bool) or not isinstance(count, int) or not 1 <= count <= max_count:
+        raise ValueError(f"count must be a whole number from 1 to {max_count}")
+    difficulty = data.get("difficulty", "mixed")
+    if difficulty not in DIFFICULTIES:
+        raise ValueError(f"difficulty must be one of: {', '.join(DIFFICULTIES)}")
+    return count, difficulty
+
+
+def prompt_guidance(difficulty, part, parts):
+    """Extra instructions for one shard's prompt, "" for a plain single request"""
+    guidance = []
+    if difficulty in DIFFICULTY_GUIDANCE:
+        guidance.append(DIFFICULTY_GUIDANCE[difficulty])
+    if parts > 1:
+        guidance.append(f"This is set {part} of {parts} drawn from the same notes; cover details the other sets are unlikely to.")
+    return "".join(f" {line}" for line in guidance)
+
+
+def _split(total, parts):
+    """total spread over parts as evenly as possible"""
+    return [total // parts + (i < total % parts) for i in range(parts)]
+
+
+def plan_shards(content, count, items_per_shard):
+    """[(section, items, part, parts), ...] covering count items.
+
+    Long notes are cut into consecutive sections, one per shard, so each
+    shard asks about its own material. Notes too short for that many
+    sections give several shards the same section, told apart by part.
+    """
+    shards = math.ceil(count / items_per_shard)
+    tokens = count_tokens(content)
+    sections = max(1, min(shards, tokens // MIN_SECTION_TOKENS))
+    chunks = split_into_chunks(content, math.ceil(tokens / sections)) or [content]
+    # Greedy packing can leave a small extra chunk; fold chunks back into `sections` groups
+    groups = _split(len(chunks), min(sections, len(chunks)))
+    texts, start = [], 0
+    for size in groups:
+        texts.append("\n\n".join(chunks[start:start + size]))
+        start += size
+
+    plan = []
+    for text, items in zip(texts, _split(count, len(texts))):
+        parts = math.ceil(items / items_per_shard)
+        for part, share in enumerate(_split(items, parts), 1):
+            plan.append((text, share, part, parts))
+    return plan
+
+
+def _words(item):
+    # Without stopwords, "the function of the ribosome" isn't 80% "the function of the nucleus"
+    return {word for word in _WORD.findall(item["question"].casefold()) if word not in STOPWORDS}
+
+
+def dedupe_items(items):
+    """items without repeats of an earlier item's question, worded the same or nearly so"""
+    kept, seen = [], []
+    for item in items:
+        words = _words(item)
+        if any(len(words & other) >= DUPLICATE_WORD_OVERLAP * max(len(words), len(other), 1) for other in seen):
+            continue
+        kept.append(item)
+        seen.append(words)
+    return kept
+
+
+async def generate_deck(task_for, content, count, difficulty, items_per_shard, meta=None):
+    """count items for content, generated in concurrent shards and merged.
+
+    task_for(count, difficulty, part, parts) returns the TaskDefinition for
+    one shard, whose max_tokens scales with its count. Shards go through
+    the engine one by one, so each is cached and single-flighted on its
+    own. Shards that fell back to canned items are left out of the deck;
+    only if all of them did is the fallback served. A deck left short by
+    duplicates or thin shards gets one top-up shard for the difference;
+    whatever is still missing after that is reported as meta["shortfall"].
+    """
+    meta = meta if meta is not None else {}
+    if count <= items_per_shard:
+        artifact = await engine.run(task_for(count, difficulty, 1, 1), content, meta)
+        if meta.get("fallback") or not artifact:
+            return artifact
+        return await _top_up(task_for, content, dedupe_items(artifact), count, difficulty, 1, meta)
+    # Cleaned once up front so sections are cut from the text the model will see
+    content = await engine.preprocess(task_for(count, difficulty, 1, 1), content, meta)
+    plan = await off_loop(plan_shards, content, count, items_per_shard)
+
+    semaphore = asyncio.Semaphore(settings.deck_shard_concurrency)
+
+    async def run_shard(section, items, part, parts):
+        shard_meta = {}
+        async with semaphore:
+            artifact = await engine.run(task_for(items, difficulty, part, parts), section, shard_meta)
+        return artifact, shard_meta
+
+    logger.info("Generating %d items in %d shards", count, len(plan))
+    results = await asyncio.gather(*[run_shard(*shard) for shard in plan])
+
+    generated = [(artifact or [], shard_meta) for artifact, shard_meta in results if not shard_meta.get("fallback")]
+    if not generated:
+        artifact, shard_meta = results[0]
+        meta.update({key: shard_meta[key] for key in ("cache", "fallback", "error") if key in shard_meta})
+        return artifact
+    caches = {shard_meta.get("cache", "miss") for _, shard_meta in generated}
+    meta["cache"] = caches.pop() if len(caches) == 1 else "partial"
+    meta["shards"] = len(plan)
+    if len(generated) < len(plan):
+        meta["failed_shards"] = len(plan) - len(generated)
+    items = dedupe_items([item for artifact, _ in generated for item in artifact])
+    return await _top_up(task_for, content, items, count, difficulty, len(plan), meta)
+
+
+async def _top_up(task_for, content, items, count, difficulty, parts, meta):
+    """items filled up to count with one extra shard over the whole of content"""
+    missing = count - len(items)
+    if missing > 0:
+        logger.info("Deck %d items short, requesting a top-up shard", missing)
+        shard_meta = {}
+        # Numbered after the planned shards so it is its own cache entry and asks for other material
+        artifact = await engine.run(task_for(missing, difficulty, parts + 1, parts + 1), content, shard_meta)
+        if artifact and not shard_meta.get("fallback"):
+            items = dedupe_items(items + artifact)
+        missing = count - len(items)
+        if missing > 0:
+            meta["shortfall"] = missing
+    return items[:count]
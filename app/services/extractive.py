@@ -0,0 +1,100 @@
+# app/services/extractive.py - TextRank summaries computed locally, in milliseconds
+import re
+from collections import Counter
+import numpy as np
+from app.utils.chunking import split_sentences
+
+DAMPING = 0.85
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-6
+# TextRank's similarity matrix is n x n; past this many sentences they are
+# scored against the document's centroid instead, which is linear in n
+MAX_TEXTRANK_SENTENCES = 600
+MAX_FEATURES = 2000
+# Headings and fragments make poor summary sentences
+MIN_SENTENCE_WORDS = 4
+
+_WORD = re.compile(r"[^\W\d_]{2,}")
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have having
+he her here hers him his how i if in into is it its itself just me more most my no nor not now of off on
+once only or other our out over own same she should so some such than that the their them then there
+these they this those through to too under until up very was we were what when where which while who
+whom why will with would you your
+""".split())
+
+
+def _tfidf(sentences):
+    """L2-normalised TF-IDF row per sentence, over the most common terms"""
+    tokens = [[word for word in _WORD.findall(sentence.lower()) if word not in STOPWORDS] for sentence in sentences]
+    document_frequency = Counter(word for words in tokens for word in set(words))
+    vocabulary = {word: column for column, (word, _) in enumerate(document_frequency.most_common(MAX_FEATURES))}
+
+    rows, columns = [], []
+    for row, words in enumerate(tokens):
+        for word in words:
+            column = vocabulary.get(word)
+            if column is not None:
+                rows.append(row)
+                columns.append(column)
+    matrix = np.zeros((len(sentences), len(vocabulary)), dtype=np.float32)
+    np.add.at(matrix, (rows, columns), 1.0)
+
+    df = np.array([document_frequency[word] for word in vocabulary], dtype=np.float32)
+    matrix *= np.log((1 + len(sentences)) / (1 + df)) + 1
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def _textrank(vectors):
+    """PageRank over the cosine-similarity graph of sentences"""
+    n = len(vectors)
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, 0)
+    totals = similarity.sum(axis=1, keepdims=True)
+    # A sentence sharing no terms with any other links to all of them equally
+    transition = np.where(totals > 0, similarity / np.where(totals > 0, totals, 1), 1.0 / n)
+
+    scores = np.full(n, 1.0 / n, dtype=np.float32)
+    for _ in range(MAX_ITERATIONS):
+        updated = (1 - DAMPING) / n + DAMPING * (transition.T @ scores)
+        if np.abs(updated - scores).sum() < TOLERANCE:
+            return updated
+        scores = updated
+    return scores
+
+
+def _centroid_scores(vectors):
+    centroid = vectors.sum(axis=0)
+    norm = np.linalg.norm(centroid)
+    return vectors @ (centroid / norm) if norm else np.zeros(len(vectors), dtype=np.float32)
+
+
+def extractive_summary(text, max_sentences=5, max_words=150):
+    """The most central sentences of text, in their original order.
+
+    "" if text has no sentences. Deterministic, no network, and fast enough
+    to call inline for typical notes.
+    """
+    sentences = split_sentences(text)
+    if not sentences:
+        return ""
+    candidates = [i for i, sentence in enumerate(sentences) if len(sentence.split()) >= MIN_SENTENCE_WORDS] \
+        or list(range(len(sentences)))
+    if len(candidates) <= max_sentences:
+        chosen = candidates
+    else:
+        vectors = _tfidf([sentences[i] for i in candidates])
+        scores = _textrank(vectors) if len(candidates) <= MAX_TEXTRANK_SENTENCES else _centroid_scores(vectors)
+        chosen, words = [], 0
+        for rank in np.argsort(-scores, kind="stable"):
+            if len(chosen) >= max_sentences:
+                break
+            length = len(sentences[candidates[rank]].split())
+            if chosen and words + length > max_words:
+                continue
+            chosen.append(candidates[rank])
+            words += length
+    return " ".join(sentences[i] for i in sorted(chosen))
@@ -1,31 +1,25 @@
-import requests
-import os
-import json
-import re
+from functools import lru_cache
+from app.config import settings
+from app.services.decks import generate_deck, prompt_guidance
+from app.services.generation import TaskDefinition, engine
+from app.services.schemas import Flashcard
+from app.utils.preprocess import clean_notes
 
-def generate_flashcards_using_openrouter(content):
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    
-    if not api_key:
-        return []
+# Cache key version for the flashcard prompt below
+PROMPT_VERSION = "v1"
 
-    models_to_try = [
-        "deepseek/deepseek-r1:free",
-        "deepseek/deepseek-v3:free",
-        "mistralai/mistral-7b-instruct:free",
-        "meta-llama/llama-3.2-3b-instruct:free",
-        "microsoft/phi-3-mini-128k-instruct:free",
-        "google/gemma-2-2b-it:free"
-    ]
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:8000",
-        "X-Title": "StudyBuddy App"
-    }
+MAX_TOKENS = 1200
+DEFAULT_COUNT = 4
+# Larger decks are split into shards of at most this many cards
+CARDS_PER_SHARD = 12
+# Output budget per card once a shard asks for more than MAX_TOKENS covers
+TOKENS_PER_CARD = 150
+MAX_COUNT = settings.flashcards_max_count
+# Longest notes (in tokens) pasted into the flashcard prompt
+MAX_INPUT_TOKENS = settings.flashcards_max_input_tokens
 
-    prompt = f"""Create exactly 4 flashcards from this content. Return ONLY valid JSON format with no extra text:
+def build_prompt(content, count=DEFAULT_COUNT, guidance=""):
+    return f"""Create exactly {count} flashcards from this content.{guidance} Return ONLY valid JSON format with no extra text:
 
 {content}
 
@@ -35,65 +29,8 @@ Format:
     {{"question": "What is Y?", "answer": "Y is..."}}
 ]"""
 
-    for model in models_to_try:
-        payload = {
-            "model": model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.2,
-            "max_tokens": 1200
-        }
-
-        try:
-            print(f"🧪 Trying flashcard model: {model}")
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions", 
-                json=payload, 
-                headers=headers,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if "choices" in data and data["choices"]:
-                    content_response = data["choices"][0]["message"]["content"]
-                    
-                    # Extract JSON from response
-                    try:
-                        # Remove markdown code blocks and extra text
-                        content_response = re.sub(r'```json\s*', '', content_response)
-                        content_response = re.sub(r'```\s*$', '', content_response)
-                        content_response = content_response.strip()
-                        
-                        # Find JSON array
-                        json_match = re.search(r'\[.*\]', content_response, re.DOTALL)
-                        if json_match:
-                            flashcards = json.loads(json_match.group())
-                            if isinstance(flashcards, list) and len(flashcards) > 0:
-                                print(f"✅ Flashcards success with model: {model}")
-                                return flashcards
-                        
-                        # Try parsing entire response as JSON
-                        flashcards = json.loads(content_response)
-                        if isinstance(flashcards, list) and len(flashcards) > 0:
-                            print(f"✅ Flashcards success with model: {model}")
-                            return flashcards
-                            
-                    except json.JSONDecodeError as je:
-                        print(f"❌ JSON parse failed for model: {model} - {je}")
-                        print(f"Raw response: {content_response[:200]}")
-                        continue
-            elif response.status_code == 429:
-                print(f"⚠️ Rate limit hit for model: {model}")
-                continue
-            else:
-                print(f"❌ Flashcard model {model} failed: {response.status_code}")
-                continue
-                
-        except Exception as e:
-            print(f"❌ Flashcard model {model} error: {e}")
-            continue
-    
-    # Enhanced fallback flashcards
+def create_fallback_flashcards(content):
+    """Canned flashcards served when every model fails"""
     return [
         {
             "question": "What is the main topic discussed in the content?",
@@ -107,4 +44,28 @@ Format:
             "question": "Why is this topic important?",
             "answer": "This topic is significant for understanding the subject matter and building knowledge."
         }
-    ]
\ No newline at end of file
+    ]
+
+@lru_cache(maxsize=256)
+def flashcards_task(count=DEFAULT_COUNT, difficulty="mixed", part=1, parts=1):
+    """The flashcards task for one request or shard; the default one is FLASHCARDS_TASK"""
+    guidance = prompt_guidance(difficulty, part, parts)
+    version = PROMPT_VERSION if (count, guidance) == (DEFAULT_COUNT, "") else f"{PROMPT_VERSION}-{count}-{difficulty}-{part}of{parts}"
+    return TaskDefinition(
+        "flashcards", lambda content: build_prompt(content, count, guidance), max(MAX_TOKENS, count * TOKENS_PER_CARD),
+        prompt_version=version, max_input_tokens=MAX_INPUT_TOKENS,
+        fallback=create_fallback_flashcards, schema=Flashcard, schema_key="flashcards", stream_event="card",
+        near_duplicates=True, preprocess=clean_notes
+    )
+
+FLASHCARDS_TASK = flashcards_task()
+
+async def generate_flashcards_using_openrouter(content, meta=None, count=DEFAULT_COUNT, difficulty="mixed"):
+    """Generate flashcards; meta, if given, is filled with cache/fallback info"""
+    if not settings.openrouter_api_key:
+        return []
+    return await generate_deck(flashcards_task, content, count, difficulty, CARDS_PER_SHARD, meta)
+
+def stream_flashcards_using_openrouter(content):
+    """Yield (event, data) pairs, one "card" event per item as soon as it is complete"""
+    return engine.stream(FLASHCARDS_TASK, content)
@@ -0,0 +1,477 @@
+# app/services/generation.py - one pipeline for every LLM-generated artifact
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from contextlib import aclosing
+import httpx
+from app.config import settings
+from app.services.admission import admission
+from app.services.deadline import DeadlineExceeded, expired, generation_budget, request_deadline
+from app.services.llm_client import post_chat_completion, InvalidApiKey
+from app.services.metrics import DEADLINES_EXCEEDED, FALLBACKS, INPUT_TOKENS_SAVED, PARSE_SECONDS, observe_usage
+from app.services.model_catalog import catalog
+from app.services.model_dispatch import candidate_models, dispatch, input_budget
+from app.services.model_health import registry
+from app.services.rate_limiter import ModelRateLimited, RateLimitExceeded
+from app.services.response_cache import response_cache, cache_key
+from app.services.schemas import response_format, validate_item, validate_items
+from app.services.single_flight import single_flight
+from app.services.streaming import stream_with_fallback
+from app.utils.chunking import fit_to_budget
+from app.utils.json_stream import JsonArrayStream, extract_json_objects
+from app.utils.tokens import INLINE_TOKENIZE_CHARS, count_tokens, off_loop
+
+logger = logging.getLogger(__name__)
+
+INVALID_API_KEY_MESSAGE = "Invalid API key - please check your OPENROUTER_API_KEY"
+
+
+class TaskDefinition:
+    """Everything that differs between one kind of generated artifact and another.
+
+    prompt(content) builds the prompt from notes already cut to the input
+    budget. Tasks with a schema (the pydantic model of one item) return a
+    JSON array of validated items; tasks without one return plain text.
+    fallback(content), if given, is served when every model fails.
+    condense, if given, is an async (content, api_key) -> (text, complete)
+    hook that shrinks long notes first; complete=False keeps the result
+    out of the cache. near_duplicates lets notes nearly identical to ones
+    already generated for (see response_cache) reuse that artifact.
+    preprocess, if given, cleans content (e.g. preprocess.clean_notes)
+    before anything else sees it, the cache key included; the input
+    budget is max_input_tokens, lowered further to fit the models' context.
+    """
+
+    def __init__(self, name, prompt, max_tokens, prompt_version="v1", temperature=0.2,
+                 max_input_tokens=6000, fallback=None, schema=None, schema_key=None,
+                 stream_event="token", result_key=None, condense=None, near_duplicates=False, preprocess=None):
+        self.name = name
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.prompt_version = prompt_version
+        self.temperature = temperature
+        self.max_input_tokens = max_input_tokens
+        self.fallback = fallback
+        self.schema = schema
+        self.stream_event = stream_event
+        self.result_key = result_key or name
+        self.condense = condense
+        self.near_duplicates = near_duplicates
+        self.preprocess = preprocess
+        self.response_format = response_format(name, schema_key, schema) if schema is not None else None
+
+    def build_payload(self, model, prompt):
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens
+        }
+        # Constrained decoding where the model supports it; the rest rely on the prompt
+        if self.response_format is not None and catalog.supports(model, "structured_outputs"):
+            payload["response_format"] = self.response_format
+        return payload
+
+    def events(self, artifact):
+        """Stream events that replay a finished artifact"""
+        if self.schema is None:
+            return [(self.stream_event, {"text": artifact})]
+        return [(self.stream_event, item) for item in artifact]
+
+
+class GenerationRequest:
+    def __init__(self, task, content, api_key, meta):
+        self.task = task
+        self.content = content
+        self.api_key = api_key
+        self.meta = meta
+
+
+class GenerationStats:
+    """Per-task counters, kept by the outermost middleware"""
+
+    def __init__(self):
+        self._tasks = defaultdict(lambda: {"requests": 0, "cache_hits": 0, "coalesced": 0, "fallbacks": 0, "errors": 0, "seconds": 0.0, "tokens_saved": 0})
+
+    async def middleware(self, request, call_next):
+        stats = self._tasks[request.task.name]
+        stats["requests"] += 1
+        started = time.monotonic()
+        try:
+            outcome = await call_next(request)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            stats["seconds"] += time.monotonic() - started
+        stats["cache_hits"] += request.meta.get("cache") in ("hit", "near_hit")
+        stats["coalesced"] += bool(request.meta.get("coalesced"))
+        stats["fallbacks"] += outcome[1]
+        stats["tokens_saved"] += request.meta.get("tokens_saved", 0)
+        return outcome
+
+    def snapshot(self):
+        return {
+            name: {**stats, "seconds": round(stats["seconds"], 3)}
+            for name, stats in self._tasks.items()
+        }
+
+
+async def cache_middleware(request, call_next):
+    task = request.task
+    cached, result = await response_cache.lookup(task.name, request.content, task.prompt_version, task.near_duplicates)
+    request.meta["cache"] = result
+    if cached is not None:
+        logger.debug("%s cache %s", task.name, result)
+        return cached, False, False
+
+    artifact, is_fallback, cacheable = await call_next(request)
+    if cacheable and not is_fallback and artifact is not None:
+        await response_cache.set(task.name, request.content, task.prompt_version, artifact, task.near_duplicates)
+    return artifact, is_fallback, cacheable
+
+
+async def _shared(call_next, request):
+    # The shared task starts in the leader's context; its deadline must not bind
+    # the followers. Each caller's own wait_for in generate() enforces theirs.
+    request_deadline.set(None)
+    return await call_next(request)
+
+
+async def single_flight_middleware(request, call_next):
+    # Identical requests already being generated share that upstream work
+    key = cache_key(request.task.name, request.content, request.task.prompt_version)
+    leader = not single_flight.in_flight(key)
+    if not leader:
+        logger.info("Joining in-flight %s", request.task.name)
+        request.meta["coalesced"] = True
+        admission.coalesced()
+    artifact, is_fallback, cacheable = await single_flight.do(key, lambda: _shared(call_next, request))
+    # The caller whose request actually ran is the one that stores it
+    return artifact, is_fallback, cacheable and leader
+
+
+def _preprocess(task, content):
+    """(cleaned content, tokens before, tokens after)"""
+    cleaned = task.preprocess(content)
+    return cleaned, count_tokens(content), count_tokens(cleaned)
+
+
+class GenerationEngine:
+    """Runs a TaskDefinition through a middleware chain around model dispatch.
+
+    A middleware is an async (request, call_next) -> (artifact, is_fallback,
+    cacheable) callable that can answer on its own (cache hit), share the
+    rest of the chain (single-flight) or observe it (stats). The innermost
+    step dispatches across models, where each attempt's failure moves on to
+    the next model. Rate limiting is applied per upstream call by llm_client,
+    since one request can fan out to several models.
+    """
+
+    def __init__(self, middleware=()):
+        self.middleware = list(middleware)
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def use(self, middleware):
+        self.middleware.append(middleware)
+
+    async def generate(self, task, content, api_key=None, meta=None):
+        """The artifact, or task's fallback; raises InvalidApiKey and RateLimitExceeded.
+
+        Under a request deadline (see deadline.py) the fallback is served
+        just before it, and the generation still running is cancelled.
+        """
+        meta = meta if meta is not None else {}
+        content = await self.preprocess(task, content, meta)
+        request = GenerationRequest(task, content, api_key or settings.openrouter_api_key, meta)
+        self._enter()
+        try:
+            artifact, is_fallback, _ = await asyncio.wait_for(self._call(0, request), generation_budget())
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            logger.warning("%s ran out of request time, serving the fallback", task.name)
+            DEADLINES_EXCEEDED.inc(task=task.name)
+            FALLBACKS.inc(task=task.name)
+            meta["deadline_exceeded"] = True
+            artifact, is_fallback = (task.fallback(content) if task.fallback else None), True
+        finally:
+            self._exit()
+        if is_fallback:
+            meta["fallback"] = True
+        return artifact
+
+    async def preprocess(self, task, content, meta=None):
+        """content after task's preprocess step; meta gets input_tokens and tokens_saved"""
+        if task.preprocess is None:
+            return content
+        if len(content) > INLINE_TOKENIZE_CHARS:
+            cleaned, before, after = await asyncio.to_thread(_preprocess, task, content)
+        else:
+            cleaned, before, after = _preprocess(task, content)
+        if not cleaned:
+            # Nothing but noise; let the model make what it can of the original
+            return content
+        INPUT_TOKENS_SAVED.inc(before - after, task=task.name)
+        logger.debug("%s input %d tokens, %d saved by preprocessing", task.name, after, before - after)
+        if meta is not None:
+            meta.update(input_tokens=after, tokens_saved=before - after)
+        return cleaned
+
+    async def cached(self, task, content):
+        """(artifact, "hit" or "near_hit") from the cache for content, else (None, "miss").
+
+        content must already have been through preprocess().
+        """
+        return await response_cache.lookup(task.name, content, task.prompt_version, task.near_duplicates)
+
+    async def run(self, task, content, meta=None):
+        """generate(), answering a rejected key with the fallback instead of raising"""
+        meta = meta if meta is not None else {}
+        try:
+            return await self.generate(task, content, meta=meta)
+        except InvalidApiKey:
+            logger.error(INVALID_API_KEY_MESSAGE)
+            FALLBACKS.inc(task=task.name)
+            meta["fallback"] = True
+            meta["error"] = INVALID_API_KEY_MESSAGE
+            return task.fallback(content) if task.fallback else None
+
+    def _enter(self):
+        self.in_flight += 1
+        self._idle.clear()
+
+    def _exit(self):
+        self.in_flight -= 1
+        if not self.in_flight:
+            self._idle.set()
+
+    async def drain(self, timeout=None):
+        """Wait for in-flight generations, e.g. on shutdown; False if timeout hit first"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _call(self, index, request):
+        if index == len(self.middleware):
+            return await self._dispatch(request)
+        return await self.middleware[index](request, lambda next_request: self._call(index + 1, next_request))
+
+    async def _prepare(self, request):
+        """(models, prompt, complete) for a request"""
+        task = request.task
+        models = candidate_models()
+        text, complete = request.content, True
+        if task.condense is not None:
+            text, complete = await task.condense(request.content, request.api_key)
+            if text is None:
+                # Nothing condensed; the start of the notes is better than no answer
+                text, complete = request.content, False
+        budget = input_budget(models, task.max_tokens, cap=task.max_input_tokens)
+        return models, task.prompt(await off_loop(fit_to_budget, text, budget)), complete
+
+    async def _dispatch(self, request):
+        task = request.task
+        models, prompt, complete = await self._prepare(request)
+        artifact = await dispatch(models, lambda model: self._attempt(task, model, prompt, request.api_key))
+        if artifact is not None:
+            return artifact, False, complete
+
+        logger.warning("All models failed for %s", task.name)
+        FALLBACKS.inc(task=task.name)
+        return (task.fallback(request.content) if task.fallback else None), True, False
+
+    async def _attempt(self, task, model, prompt, api_key):
+        try:
+            logger.debug("Trying %s model: %s", task.name, model)
+            response = await post_chat_completion(task.build_payload(model, prompt), api_key, timeout=30)
+        except RateLimitExceeded:
+            raise
+        except ModelRateLimited as e:
+            logger.info("Skipping %s", e)
+            return None
+        except httpx.TimeoutException:
+            logger.warning("Timeout for %s", model)
+            return None
+        except httpx.HTTPError as e:
+            logger.warning("Connection error for %s: %s", model, e)
+            return None
+
+        if response.status_code == 200:
+            return self._parse(task, model, response)
+        if response.status_code == 401:
+            # A model OpenRouter still lists can't be the problem, so it's the key
+            if catalog.is_unlisted(model):
+                logger.warning("%s is no longer listed - model might not be available", model)
+                return None
+            raise InvalidApiKey()
+        if response.status_code == 429:
+            # llm_client has already backed this model off per Retry-After
+            logger.info("Rate limited (429) for %s - moving on", model)
+        else:
+            logger.warning("%s model %s failed: %s %s", task.name, model, response.status_code, response.text[:300])
+        return None
+
+    def _parse(self, task, model, response):
+        started = time.monotonic()
+        try:
+            data = response.json()
+            text = data["choices"][0]["message"]["content"] or ""
+        except (ValueError, KeyError, IndexError, TypeError):
+            registry.record_parse_result(model, False)
+            logger.warning("Malformed response from %s", model)
+            return None
+
+        if task.schema is None:
+            artifact = text.strip() or None
+        else:
+            objects = extract_json_objects(text)
+            artifact = validate_items(objects, task.schema) or None
+            if artifact and len(artifact) < len(objects):
+                logger.info("Kept %d of %d %s items from %s", len(artifact), len(objects), task.name, model)
+        PARSE_SECONDS.observe(time.monotonic() - started, task=task.name)
+
+        observe_usage(model, data.get("usage"))
+        registry.record_parse_result(model, artifact is not None, (data.get("usage") or {}).get("total_tokens"))
+        if artifact is None:
+            logger.warning("Unusable %s output from %s: %s", task.name, model, text[:200])
+        else:
+            logger.info("%s success with model: %s", task.name, model)
+        return artifact
+
+    async def stream(self, task, content, api_key=None):
+        """Yield (event, data) pairs: task.stream_event per token or item, then "done".
+
+        "restart" means a model failed part-way and the client should drop
+        what it has shown; the next model starts over.
+        """
+        self._enter()
+        try:
+            async for event in self._stream(task, content, api_key):
+                yield event
+        finally:
+            self._exit()
+
+    async def _stream(self, task, content, api_key):
+        api_key = api_key or settings.openrouter_api_key
+        if not api_key:
+            yield "error", {"detail": "API key not configured"}
+            return
+
+        meta = {}
+        content = await self.preprocess(task, content, meta)
+        saved = meta.get("tokens_saved", 0)
+        cached, result = await response_cache.lookup(task.name, content, task.prompt_version, task.near_duplicates)
+        if cached is not None:
+            for event in task.events(cached):
+                yield event
+            yield "done", {task.result_key: cached, "cache": result, "fallback": False, "tokens_saved": saved}
+            return
+
+        try:
+            models, prompt, complete = await self._prepare(GenerationRequest(task, content, api_key, meta))
+        except InvalidApiKey:
+            yield "error", {"detail": INVALID_API_KEY_MESSAGE}
+            return
+
+        output = _TextOutput() if task.schema is None else _ItemOutput(task.schema)
+        timed_out = False
+        try:
+            async with aclosing(stream_with_fallback(
+                models,
+                lambda model: task.build_payload(model, prompt),
+                api_key,
+                output.is_complete
+            )) as deltas:
+                async for model, delta in deltas:
+                    if expired():
+                        timed_out = True
+                        break
+                    if delta is None:
+                        output.reset()
+                        yield "restart", {"model": model}
+                        continue
+                    for data in output.feed(delta):
+                        yield task.stream_event, data
+        except InvalidApiKey:
+            yield "error", {"detail": INVALID_API_KEY_MESSAGE}
+            return
+        for data in output.recovered:
+            yield task.stream_event, data
+
+        artifact = output.result()
+        if timed_out or expired():
+            logger.warning("%s stream ran out of request time", task.name)
+            DEADLINES_EXCEEDED.inc(task=task.name)
+            if timed_out and artifact:
+                # Items already sent are each complete and valid; half a summary isn't
+                if task.schema is not None:
+                    yield "done", {task.result_key: artifact, "cache": "miss", "fallback": False, "partial": True, "tokens_saved": saved}
+                    return
+                yield "restart", {"model": None}
+            artifact = None
+        if artifact:
+            if complete:
+                await response_cache.set(task.name, content, task.prompt_version, artifact, task.near_duplicates)
+            yield "done", {task.result_key: artifact, "cache": "miss", "fallback": False, "tokens_saved": saved}
+            return
+
+        FALLBACKS.inc(task=task.name)
+        artifact = task.fallback(content) if task.fallback else None
+        if artifact:
+            for event in task.events(artifact):
+                yield event
+        yield "done", {task.result_key: artifact, "cache": "miss", "fallback": True, "tokens_saved": saved}
+
+
+class _TextOutput:
+    def __init__(self):
+        self.parts = []
+        self.recovered = []
+
+    def feed(self, delta):
+        self.parts.append(delta)
+        return [{"text": delta}]
+
+    def is_complete(self):
+        return self.result() != ""
+
+    def reset(self):
+        self.parts = []
+
+    def result(self):
+        return "".join(self.parts).strip()
+
+
+class _ItemOutput:
+    def __init__(self, schema):
+        self.schema = schema
+        self.reset()
+
+    def feed(self, delta):
+        items = [item for item in (validate_item(obj, self.schema) for obj in self.parser.feed(delta)) if item is not None]
+        self.items.extend(items)
+        return items
+
+    def is_complete(self):
+        # The model has stopped; keep an item max_tokens cut off if it still validates
+        item = validate_item(self.parser.close(), self.schema)
+        if item is not None:
+            self.items.append(item)
+            self.recovered.append(item)
+        return len(self.items) > 0
+
+    def reset(self):
+        self.parser = JsonArrayStream()
+        self.items = []
+        self.recovered = []
+
+    def result(self):
+        return self.items
+
+
+generation_stats = GenerationStats()
+engine = GenerationEngine([generation_stats.middleware, cache_middleware, single_flight_middleware])
@@ -0,0 +1,276 @@
+# app/services/job_queue.py - background jobs for long-running generations
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlsplit
+import httpx
+from app.config import settings
+from app.services.summarize import generate_summary_using_openrouter
+from app.services.quiz_generator import generate_quiz_using_openrouter
+from app.services.flashcard_generator import generate_flashcards_using_openrouter
+from app.services.study_pack import generate_study_pack
+from app.services.deadline import request_deadline
+from app.services.rate_limiter import request_priority, BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+async def _run_single(generate, key, notes):
+    meta = {}
+    result = await generate(notes, meta)
+    return {key: result, "cache": meta.get("cache", "miss"), "fallback": meta.get("fallback", False)}
+
+
+async def _run_study_pack(notes):
+    pack = {}
+    async for part in generate_study_pack(notes):
+        pack[part.pop("part")] = part
+    return pack
+
+
+JOB_KINDS = {
+    "summary": lambda notes: _run_single(generate_summary_using_openrouter, "summary", notes),
+    "quiz": lambda notes: _run_single(generate_quiz_using_openrouter, "quiz", notes),
+    "flashcards": lambda notes: _run_single(generate_flashcards_using_openrouter, "flashcards", notes),
+    "study-pack": _run_study_pack,
+}
+
+
+class InMemoryJobStore:
+    """Default store; jobs live in this worker process only"""
+
+    def __init__(self, retention_seconds=3600):
+        self.retention_seconds = retention_seconds
+        self._jobs = {}
+
+    async def create(self, job):
+        self._prune()
+        self._jobs[job["id"]] = dict(job)
+
+    async def update(self, job_id, **fields):
+        if job_id in self._jobs:
+            self._jobs[job_id].update(fields)
+
+    async def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [j["id"] for j in self._jobs.values() if (j.get("finished_at") or time.time()) < cutoff]:
+            del self._jobs[job_id]
+
+
+class SqliteJobStore:
+    """Shared store so any worker process can answer GET /jobs/{id}"""
+
+    def __init__(self, path, retention_seconds=3600):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+
+    def _execute(self, sql, params=()):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def _update(self, job_id, fields):
+        row = self._execute("SELECT data FROM jobs WHERE id = ?", (job_id,))
+        if row is None:
+            return
+        job = json.loads(row[0])
+        job.update(fields)
+        self._execute("UPDATE jobs SET data = ? WHERE id = ?", (json.dumps(job), job_id))
+
+    def _create(self, job):
+        self._prune()
+        self._execute("INSERT INTO jobs (id, data) VALUES (?, ?)", (job["id"], json.dumps(job)))
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        self._execute("DELETE FROM jobs WHERE json_extract(data, '$.finished_at') < ?", (cutoff,))
+
+    async def create(self, job):
+        await asyncio.to_thread(self._create, job)
+
+    async def update(self, job_id, **fields):
+        await asyncio.to_thread(self._update, job_id, fields)
+
+    async def get(self, job_id):
+        row = await asyncio.to_thread(self._execute, "SELECT data FROM jobs WHERE id = ?", (job_id,))
+        return json.loads(row[0]) if row else None
+
+
+async def validate_callback_url(url):
+    """Raise ValueError unless url is an http(s) webhook we are willing to POST to.
+
+    Without JOB_CALLBACK_ALLOWED_HOSTS, every address the host resolves to
+    must be public, so a callback can't be aimed at this server, the cloud
+    metadata endpoint (169.254.169.254) or anything else on the private
+    network.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("callback_url must be an http(s) URL")
+    host = parts.hostname.lower()
+    if settings.job_callback_allowed_hosts:
+        if host not in settings.job_callback_allowed_hosts:
+            raise ValueError("callback_url host is not allowed")
+        return
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, parts.port or 443, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise ValueError("callback_url host does not resolve")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise ValueError("callback_url must point to a public address")
+
+
+def create_store():
+    if settings.job_store == "sqlite":
+        return SqliteJobStore(settings.job_store_path, settings.job_retention_seconds)
+    return InMemoryJobStore(settings.job_retention_seconds)
+
+
+class JobQueue:
+    """Runs jobs in the background with global and per-tenant concurrency caps.
+
+    A job waits for its tenant's slot before taking a worker slot, so one
+    tenant with a big backlog can't starve everyone else's jobs.
+    """
+
+    def __init__(self, store, workers=4, tenant_concurrency=2, max_pending=1000):
+        self.store = store
+        self.max_pending = max_pending
+        self.tenant_concurrency = tenant_concurrency
+        self._workers = asyncio.Semaphore(workers)
+        # Per-tenant slots, kept only while the tenant has jobs queued or running
+        self._tenants = {}
+        self._tenant_jobs = Counter()
+        self._tasks = set()
+        self._callback_client = None
+
+    @property
+    def pending(self):
+        return len(self._tasks)
+
+    async def submit(self, kind, notes, tenant, callback_url=None):
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self.pending >= self.max_pending:
+            raise QueueFull()
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": QUEUED,
+            "tenant": tenant,
+            "callback_url": callback_url,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None
+        }
+        await self.store.create(job)
+        task = asyncio.create_task(self._run(job, notes))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job, notes):
+        # Runs in its own task, so these only affect this job's upstream calls:
+        # lower priority, and no deadline from the request that submitted it
+        request_priority.set(BACKGROUND)
+        request_deadline.set(None)
+        tenant = job["tenant"]
+        if tenant not in self._tenants:
+            self._tenants[tenant] = asyncio.Semaphore(self.tenant_concurrency)
+        self._tenant_jobs[tenant] += 1
+        try:
+            async with self._tenants[tenant], self._workers:
+                await self.store.update(job["id"], status=RUNNING, started_at=time.time())
+                logger.info("Job %s (%s) started", job["id"], job["kind"])
+                try:
+                    result = await JOB_KINDS[job["kind"]](notes)
+                    fields = {"status": SUCCEEDED, "result": result}
+                except Exception as e:
+                    logger.exception("Job %s failed", job["id"])
+                    fields = {"status": FAILED, "error": str(e)}
+                fields["finished_at"] = time.time()
+                await self.store.update(job["id"], **fields)
+        finally:
+            self._tenant_jobs[tenant] -= 1
+            if self._tenant_jobs[tenant] <= 0:
+                del self._tenant_jobs[tenant]
+                del self._tenants[tenant]
+
+        if job["callback_url"]:
+            await self._notify(job["callback_url"], await self.store.get(job["id"]))
+
+    async def _notify(self, url, job, attempts=3):
+        """POST the finished job to the caller's webhook, retrying with back-off"""
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(2 ** (attempt - 1))
+            try:
+                # Checked again at send time: what the host resolves to may have changed
+                await validate_callback_url(url)
+            except ValueError as e:
+                logger.warning("Job callback to %s refused: %s", url, e)
+                return
+            try:
+                response = await self._client().post(url, json=job)
+                if response.status_code < 500:
+                    return
+            except httpx.HTTPError as e:
+                logger.warning("Job callback to %s failed: %s", url, e)
+
+    def _client(self):
+        # Webhooks get their own small pool, apart from OpenRouter's, and don't follow redirects
+        if self._callback_client is None or self._callback_client.is_closed:
+            self._callback_client = httpx.AsyncClient(
+                timeout=settings.job_callback_timeout,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=2)
+            )
+        return self._callback_client
+
+    async def drain(self, timeout=None):
+        """Wait for running and queued jobs, e.g. before shutdown"""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    async def close(self):
+        """Release the webhook client's connections"""
+        if self._callback_client is not None:
+            await self._callback_client.aclose()
+            self._callback_client = None
+
+
+job_queue = JobQueue(
+    create_store(),
+    workers=settings.job_workers,
+    tenant_concurrency=settings.job_tenant_concurrency,
+    max_pending=settings.job_max_pending
+)
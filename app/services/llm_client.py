@@ -0,0 +1,236 @@
+# app/services/llm_client.py - shared async OpenRouter client
+import asyncio
+import json
+import logging
+import time
+from email.utils import parsedate_to_datetime
+import httpx
+from app.config import settings
+from app.services.deadline import attempt_timeout
+from app.services.metrics import UPSTREAM_REQUEST_SECONDS, TIME_TO_FIRST_TOKEN_SECONDS, RATE_LIMITED, observe_usage
+from app.services.model_health import registry
+from app.services.rate_limiter import rate_limiter
+
+# Overridable so load tests can point at bench/mock_openrouter.py
+OPENROUTER_BASE_URL = settings.openrouter_base_url.rstrip("/")
+CHAT_COMPLETIONS_URL = f"{OPENROUTER_BASE_URL}/chat/completions"
+MODELS_URL = f"{OPENROUTER_BASE_URL}/models"
+
+# One pooled client per worker process, created lazily on first use
+_client = None
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamError(Exception):
+    """Non-200 response (or in-stream error) from OpenRouter"""
+
+    def __init__(self, status_code, body=""):
+        super().__init__(f"OpenRouter returned {status_code}")
+        self.status_code = status_code
+        self.body = body
+
+
+class InvalidApiKey(Exception):
+    """OpenRouter rejected the key itself, so no other model will do better"""
+
+
+def _pool_limits():
+    """Connection pool limits, tunable through the environment"""
+    return httpx.Limits(
+        max_connections=settings.max_connections,
+        max_keepalive_connections=settings.max_keepalive_connections,
+        keepalive_expiry=settings.keepalive_expiry,
+    )
+
+
+def _http2_enabled():
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])"""
+    if not settings.http2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_client():
+    """Return the shared pooled client, creating it if needed"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=_http2_enabled(),
+            limits=_pool_limits(),
+            timeout=httpx.Timeout(30.0, connect=10.0),
+        )
+    return _client
+
+
+async def close_client():
+    """Close the shared client and release pooled connections"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+async def warm_up(connections=2):
+    """Open pooled connections (DNS, TCP, TLS) before the first request needs them"""
+    client = get_client()
+
+    async def connect():
+        try:
+            # Any response will do; the connection stays in the pool
+            await client.head(MODELS_URL, timeout=5)
+        except httpx.HTTPError as e:
+            logger.warning("Could not warm a connection to %s: %s", OPENROUTER_BASE_URL, e)
+
+    await asyncio.gather(*(connect() for _ in range(connections)))
+
+
+def build_headers(api_key):
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "http://localhost:8000",  # Your app URL
+        "X-Title": "StudyBuddy App"
+    }
+
+
+def _retry_after(response):
+    """Seconds to back off after a 429, and whether the whole key is exhausted"""
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    reset = response.headers.get("X-RateLimit-Reset")
+    if remaining == "0" and reset:
+        try:
+            # OpenRouter sends the reset time in epoch milliseconds
+            return max(1.0, float(reset) / 1000 - time.time()), True
+        except ValueError:
+            pass
+
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(1.0, float(value)), False
+        except ValueError:
+            try:
+                return max(1.0, parsedate_to_datetime(value).timestamp() - time.time()), False
+            except (TypeError, ValueError):
+                pass
+    return settings.rate_limit_default_backoff, False
+
+
+async def _record_rate_limit(response, api_key, model):
+    retry_after, key_wide = _retry_after(response)
+    RATE_LIMITED.inc(model=model, source="upstream")
+    logger.warning("429 for %s, backing off %s for %.0fs", model, "key" if key_wide else "model", retry_after)
+    await rate_limiter.penalize(api_key, model, retry_after, key_wide=key_wide)
+
+
+def _record_response(model, status_code, started):
+    latency = time.monotonic() - started
+    registry.record_response(model, status_code, latency)
+    UPSTREAM_REQUEST_SECONDS.observe(latency, model=model, status=status_code)
+
+
+def _record_error(model, started, error, cut_short=False):
+    # A timeout the request's own deadline shortened says nothing about the model
+    if not (cut_short and isinstance(error, httpx.TimeoutException)):
+        registry.record_error(model)
+    UPSTREAM_REQUEST_SECONDS.observe(time.monotonic() - started, model=model, status="error")
+
+
+async def post_chat_completion(payload, api_key, timeout=30):
+    """POST a chat completion payload over the shared connection pool.
+
+    Waits for a rate-limit token first; raises RateLimitExceeded or
+    ModelRateLimited instead of sending a request that would 429. timeout
+    is cut to what the current request's deadline leaves; a timeout that
+    cut caused is not held against the model.
+    """
+    await rate_limiter.acquire(api_key, payload["model"])
+    started = time.monotonic()
+    limit = attempt_timeout(timeout)
+    try:
+        response = await get_client().post(
+            CHAT_COMPLETIONS_URL,
+            json=payload,
+            headers=build_headers(api_key),
+            timeout=limit
+        )
+    except httpx.TransportError as e:
+        _record_error(payload["model"], started, e, cut_short=limit < timeout)
+        raise
+    _record_response(payload["model"], response.status_code, started)
+    if response.status_code == 429:
+        await _record_rate_limit(response, api_key, payload["model"])
+    return response
+
+
+async def stream_chat_completion(payload, api_key, timeout=30):
+    """Yield content deltas from a streamed (stream: true) chat completion.
+
+    timeout applies to each read, so long generations are fine as long as
+    tokens keep arriving. Raises UpstreamError for non-200 responses.
+    """
+    model = payload["model"]
+    await rate_limiter.acquire(api_key, model)
+    started = time.monotonic()
+    first_token = True
+    limit = attempt_timeout(timeout)
+    try:
+        async with get_client().stream(
+            "POST",
+            CHAT_COMPLETIONS_URL,
+            json={**payload, "stream": True},
+            headers=build_headers(api_key),
+            timeout=limit
+        ) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", errors="replace")
+                _record_response(model, response.status_code, started)
+                if response.status_code == 429:
+                    await _record_rate_limit(response, api_key, model)
+                raise UpstreamError(response.status_code, body)
+
+            async for line in response.aiter_lines():
+                # Skip blank separators and ": OPENROUTER PROCESSING" keep-alives
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                if "error" in chunk:
+                    _record_response(model, chunk["error"].get("code", 500), started)
+                    raise UpstreamError(chunk["error"].get("code", 500), json.dumps(chunk["error"]))
+                # OpenRouter puts usage on the final chunk
+                observe_usage(model, chunk.get("usage"))
+                choices = chunk.get("choices") or []
+                delta = choices[0].get("delta", {}).get("content") if choices else None
+                if delta:
+                    if first_token:
+                        TIME_TO_FIRST_TOKEN_SECONDS.observe(time.monotonic() - started, model=model)
+                        first_token = False
+                    yield delta
+    except httpx.TransportError as e:
+        _record_error(model, started, e, cut_short=limit < timeout)
+        raise
+    _record_response(model, 200, started)
+
+
+async def get_models(api_key=None, timeout=10, etag=None):
+    """GET the OpenRouter model listing over the shared connection pool.
+
+    Pass the ETag of a previous listing to get a 304 if nothing changed.
+    """
+    headers = {}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    if etag:
+        headers["If-None-Match"] = etag
+    return await get_client().get(MODELS_URL, headers=headers, timeout=timeout)
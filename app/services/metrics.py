@@ -0,0 +1,252 @@
+# app/services/metrics.py - Prometheus text-format metrics for /metrics
+import asyncio
+import math
+import time
+
+# Seconds; covers a cache hit through a slow free-tier completion
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+PARSE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry["counts"][i] += 1
+                break
+        entry["sum"] += value
+        entry["count"] += 1
+
+    def _samples(self):
+        lines = []
+        for key, entry in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry["counts"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(entry['sum'])}")
+            lines.append(f"{self.name}_count{labels} {entry['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics for this worker process.
+
+    Recording is a dict update on the event loop, so it is cheap enough for
+    the hot path. Collectors run at scrape time to fill gauges that mirror
+    state kept elsewhere (e.g. circuit breakers). With several uvicorn
+    workers each process serves its own numbers.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    def render(self):
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "studybuddy_http_request_duration_seconds",
+    "End-to-end route latency, until the last body byte is sent",
+    ("method", "route", "status")
+)
+UPSTREAM_REQUEST_SECONDS = metrics.histogram(
+    "studybuddy_upstream_request_duration_seconds",
+    "OpenRouter chat completion latency per model",
+    ("model", "status")
+)
+TIME_TO_FIRST_TOKEN_SECONDS = metrics.histogram(
+    "studybuddy_time_to_first_token_seconds",
+    "Time from sending a streamed completion to its first content token",
+    ("model",)
+)
+UPSTREAM_TOKENS = metrics.histogram(
+    "studybuddy_upstream_tokens",
+    "Prompt (in) and completion (out) tokens per OpenRouter call",
+    ("model", "direction"),
+    buckets=TOKEN_BUCKETS
+)
+PARSE_SECONDS = metrics.histogram(
+    "studybuddy_parse_duration_seconds",
+    "Time spent extracting and validating model output",
+    ("task",),
+    buckets=PARSE_BUCKETS
+)
+FALLBACKS = metrics.counter(
+    "studybuddy_fallbacks_total",
+    "Canned fallback artifacts served because every model failed",
+    ("task",)
+)
+DEADLINES_EXCEEDED = metrics.counter(
+    "studybuddy_deadline_exceeded_total",
+    "Generations that ran out of request time and served the fallback",
+    ("task",)
+)
+CLIENT_DISCONNECTS = metrics.counter(
+    "studybuddy_client_disconnects_total",
+    "Requests cancelled because the client went away before the response"
+)
+INPUT_TOKENS_SAVED = metrics.counter(
+    "studybuddy_input_tokens_saved_total",
+    "Note tokens removed by preprocessing before prompting",
+    ("task",)
+)
+CACHE_REQUESTS = metrics.counter(
+    "studybuddy_cache_requests_total",
+    "Response cache lookups",
+    ("task", "result")
+)
+RATE_LIMITED = metrics.counter(
+    "studybuddy_rate_limited_total",
+    "429s from OpenRouter (upstream) and requests our own limiter refused (local)",
+    ("model", "source")
+)
+CIRCUIT_STATE = metrics.gauge(
+    "studybuddy_circuit_state",
+    "Circuit breaker state per model: 0 closed, 1 half-open, 2 open",
+    ("model",)
+)
+CIRCUIT_OPENED = metrics.counter(
+    "studybuddy_circuit_opened_total",
+    "Times a model's circuit breaker opened",
+    ("model",)
+)
+ADMISSION_IN_FLIGHT = metrics.gauge(
+    "studybuddy_admission_in_flight",
+    "Generation requests admitted and still running, per route",
+    ("route",)
+)
+ADMISSION_LIMIT = metrics.gauge(
+    "studybuddy_admission_limit",
+    "Current adaptive concurrency limit per route",
+    ("route",)
+)
+ADMISSION_QUEUE_DEPTH = metrics.gauge(
+    "studybuddy_admission_queue_depth",
+    "Generation requests waiting for a slot, per route",
+    ("route",)
+)
+ADMISSION_QUEUE_SECONDS = metrics.histogram(
+    "studybuddy_admission_queue_wait_seconds",
+    "Time admitted requests waited for a slot",
+    ("route",)
+)
+ADMISSION_SHED = metrics.counter(
+    "studybuddy_admission_shed_total",
+    "Requests turned away before generating: queue_full, queue_timeout or client_limit",
+    ("route", "reason")
+)
+EVENT_LOOP_LAG_SECONDS = metrics.histogram(
+    "studybuddy_event_loop_lag_seconds",
+    "How late a periodic timer fires; anything blocking the event loop shows up here",
+    buckets=LAG_BUCKETS
+)
+
+
+def observe_usage(model, usage):
+    """Record an OpenRouter usage block ({"prompt_tokens": .., "completion_tokens": ..})"""
+    if not usage:
+        return
+    for direction, field in (("in", "prompt_tokens"), ("out", "completion_tokens")):
+        if usage.get(field) is not None:
+            UPSTREAM_TOKENS.observe(usage[field], model=model, direction=direction)
+
+
+async def watch_event_loop_lag(interval=0.1):
+    """Sleep for interval, forever, recording how late each wakeup is"""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, time.monotonic() - started - interval))
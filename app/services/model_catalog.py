@@ -0,0 +1,167 @@
+# app/services/model_catalog.py - OpenRouter's model listing, cached and kept fresh
+import asyncio
+import json
+import logging
+import os
+import time
+from app.config import settings
+from app.services.llm_client import get_models
+
+CATALOG_PATH = settings.model_catalog_path
+REFRESH_SECONDS = settings.model_catalog_refresh_seconds
+logger = logging.getLogger(__name__)
+
+# How long to wait before retrying a listing fetch that failed
+RETRY_SECONDS = 300
+
+
+def _is_free(model):
+    pricing = model.get("pricing") or {}
+    try:
+        return all(float(pricing.get(kind, 0) or 0) == 0 for kind in ("prompt", "completion"))
+    except (TypeError, ValueError):
+        return False
+
+
+class ModelCatalog:
+    """OpenRouter's /models listing: context windows, pricing and capabilities.
+
+    Loaded from a disk snapshot at startup so a restart doesn't wait on the
+    network, then refreshed in the background with If-None-Match so an
+    unchanged listing costs a 304. Request handlers only ever read memory.
+    An empty catalog is valid: callers fall back to conservative defaults.
+    """
+
+    def __init__(self, path=CATALOG_PATH, refresh_seconds=REFRESH_SECONDS):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self._models = {}
+        self._etag = None
+        self._fetched_at = None  # wall clock, so snapshot age survives restarts
+        self._failed_at = None
+        self._source = None
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    @property
+    def loaded(self):
+        return bool(self._models)
+
+    def _stale(self):
+        return self._fetched_at is None or time.time() - self._fetched_at >= self.refresh_seconds
+
+    def _set(self, models, etag, fetched_at, source):
+        self._models = {model["id"]: model for model in models}
+        self._etag = etag
+        self._fetched_at = fetched_at
+        self._source = source
+
+    def load_snapshot(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self._set(snapshot["models"], snapshot.get("etag"), snapshot.get("fetched_at"), "snapshot")
+            logger.info("Loaded %d models from %s", len(self._models), self.path)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable model snapshot %s: %s", self.path, e)
+
+    def _save_snapshot(self):
+        snapshot = {"etag": self._etag, "fetched_at": self._fetched_at, "models": list(self._models.values())}
+        # Per process, since every worker refreshes and saves the same snapshot
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+
+    async def refresh(self, api_key=None):
+        """Fetch the listing if it changed; returns False if the fetch failed"""
+        async with self._lock:
+            try:
+                response = await get_models(api_key, timeout=10, etag=self._etag if self.loaded else None)
+                if response.status_code == 304:
+                    self._fetched_at = time.time()
+                    self._failed_at = None
+                    return True
+                response.raise_for_status()
+                models = response.json().get("data", [])
+            except Exception as e:
+                self._failed_at = time.monotonic()
+                logger.warning("Could not refresh model listing: %s", e)
+                return False
+
+            self._set(models, response.headers.get("ETag"), time.time(), "network")
+            self._failed_at = None
+            logger.info("Refreshed model listing: %d models", len(self._models))
+            try:
+                await asyncio.to_thread(self._save_snapshot)
+            except OSError as e:
+                logger.warning("Could not write model snapshot %s: %s", self.path, e)
+            return True
+
+    async def ensure_loaded(self, api_key=None):
+        """For scripts that run without the app's startup hook"""
+        if not self.loaded:
+            self.load_snapshot()
+        recently_failed = self._failed_at and time.monotonic() - self._failed_at < RETRY_SECONDS
+        if self._stale() and not recently_failed:
+            await self.refresh(api_key)
+
+    async def _refresh_loop(self, api_key):
+        while True:
+            if self._stale():
+                await self.refresh(api_key)
+            delay = RETRY_SECONDS if self._failed_at else self.refresh_seconds - (time.time() - self._fetched_at)
+            await asyncio.sleep(max(delay, 1))
+
+    def start(self, api_key=None):
+        """Load the snapshot and keep the listing fresh in the background"""
+        if not self.loaded:
+            self.load_snapshot()
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop(api_key))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get(self, model):
+        return self._models.get(model)
+
+    def is_unlisted(self, model):
+        """True only when the listing is loaded and model isn't in it, e.g. retired"""
+        return self.loaded and model not in self._models
+
+    def context_length(self, model):
+        return (self._models.get(model) or {}).get("context_length")
+
+    def pricing(self, model):
+        return (self._models.get(model) or {}).get("pricing")
+
+    def supports(self, model, parameter):
+        """Whether model accepts a request parameter, e.g. "structured_outputs" """
+        return parameter in ((self._models.get(model) or {}).get("supported_parameters") or [])
+
+    def is_free(self, model):
+        return model in self._models and _is_free(self._models[model])
+
+    def free_models(self):
+        """Free model ids, largest context window first"""
+        free = [model for model in self._models.values() if _is_free(model)]
+        free.sort(key=lambda model: model.get("context_length") or 0, reverse=True)
+        return [model["id"] for model in free]
+
+    def stats(self):
+        return {
+            "models": len(self._models),
+            "free_models": len(self.free_models()),
+            "source": self._source,
+            "age_seconds": round(time.time() - self._fetched_at) if self._fetched_at else None
+        }
+
+
+catalog = ModelCatalog()
@@ -0,0 +1,141 @@
+# app/services/model_dispatch.py - sequential / race / hedged model dispatch
+import asyncio
+import logging
+from app.config import settings
+from app.services.deadline import DeadlineExceeded
+from app.services.llm_client import InvalidApiKey
+from app.services.model_catalog import catalog
+from app.services.model_health import registry
+from app.services.rate_limiter import RateLimitExceeded
+
+# Preferred free models, best first; OPENROUTER_MODELS (comma-separated) overrides
+# them. The model catalog drops any that OpenRouter no longer lists as free.
+PREFERRED_MODELS = settings.openrouter_models or [
+    "deepseek/deepseek-r1:free",
+    "deepseek/deepseek-v3:free",
+    "mistralai/mistral-7b-instruct:free",
+    "meta-llama/llama-3.2-3b-instruct:free",
+    "microsoft/phi-3-mini-128k-instruct:free",
+    "google/gemma-2-2b-it:free"
+]
+
+# Assumed for models the catalog doesn't know (yet); small enough for any of them
+DEFAULT_CONTEXT_LENGTH = 8192
+
+# Tokens reserved for prompt instructions around the notes
+PROMPT_OVERHEAD_TOKENS = 200
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("sequential", "race", "hedged")
+
+
+def candidate_models():
+    """Models to try for a request, in preference order.
+
+    Preferred models the catalog still lists as free; if none of them are
+    left, the catalog's free models with the largest context windows stand
+    in. Until the catalog has loaded, the preferred list is used as-is.
+    """
+    if not catalog.loaded:
+        return list(PREFERRED_MODELS)
+    models = [model for model in PREFERRED_MODELS if catalog.is_free(model)]
+    return models or catalog.free_models()[:len(PREFERRED_MODELS)]
+
+
+def context_length(model):
+    return catalog.context_length(model) or DEFAULT_CONTEXT_LENGTH
+
+
+def input_budget(models, output_tokens, cap=None):
+    """Largest input (in tokens) every model in the list can accept.
+
+    Any model may end up serving the request, so the smallest context window
+    wins. cap keeps prompts small even when all models have huge windows.
+    """
+    budget = min(context_length(model) for model in models) - output_tokens - PROMPT_OVERHEAD_TOKENS
+    if cap is not None:
+        budget = min(budget, cap)
+    return max(budget, 256)
+
+
+def get_strategy():
+    strategy = settings.dispatch_strategy.lower()
+    return strategy if strategy in STRATEGIES else "hedged"
+
+
+def hedge_delay(model):
+    """How long to wait on a model before hedging to the next one"""
+    default = settings.hedge_delay
+    p95 = registry.p95_latency(model)
+    if p95 is None:
+        return default
+    return max(settings.hedge_min_delay, p95)
+
+
+async def dispatch(models, attempt, strategy=None):
+    """Run attempt(model) across models and return the first non-None result.
+
+    sequential: one model at a time, in order.
+    race:       keep the top OPENROUTER_RACE_WIDTH models in flight at once.
+    hedged:     start the next model when the current one runs past its p95.
+
+    Models are reordered by the health registry and any whose circuit is
+    open are skipped. Remaining in-flight attempts are cancelled as soon
+    as one succeeds. Returns None when every model fails. RateLimitExceeded
+    and InvalidApiKey from an attempt are re-raised: they concern the whole
+    key, so trying other models would only waste time. So is
+    DeadlineExceeded, since the request has no time left for them.
+    """
+    strategy = strategy or get_strategy()
+    width = 1
+    hedging = strategy == "hedged"
+    if strategy == "race":
+        width = max(1, settings.race_width)
+
+    remaining = iter(registry.order_models(models))
+    pending = {}
+
+    def launch():
+        for model in remaining:
+            if not registry.allow(model):
+                logger.info("Skipping %s - circuit open", model)
+                continue
+            pending[asyncio.create_task(attempt(model))] = model
+            return True
+        return False
+
+    for _ in range(width):
+        launch()
+
+    last_model = None
+    try:
+        while pending:
+            timeout = None
+            if hedging:
+                last_model = list(pending.values())[-1]
+                timeout = hedge_delay(last_model)
+
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                # Slow attempt - hedge to the next model while it keeps running
+                if not launch():
+                    hedging = False
+                else:
+                    logger.info("%s past %.1fs, hedging to next model", last_model, timeout)
+                continue
+
+            for task in done:
+                pending.pop(task)
+                if isinstance(task.exception(), (RateLimitExceeded, InvalidApiKey, DeadlineExceeded)):
+                    raise task.exception()
+                if task.exception() is None and task.result() is not None:
+                    return task.result()
+                launch()
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,199 @@
+# app/services/model_health.py - per-model health tracking and circuit breaker
+import logging
+import time
+from collections import deque
+from app.config import settings
+from app.services.metrics import metrics, CIRCUIT_STATE, CIRCUIT_OPENED
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = settings.ewma_alpha
+FAILURE_THRESHOLD = settings.circuit_failure_threshold
+OPEN_SECONDS = settings.circuit_open_seconds
+MAX_OPEN_SECONDS = settings.circuit_max_open_seconds
+
+# Assumed latency for models we have no samples for yet, so they still get tried
+UNKNOWN_LATENCY = 10.0
+MIN_SAMPLES_FOR_P95 = 5
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _ewma(current, sample):
+    if current is None:
+        return sample
+    return (1 - EWMA_ALPHA) * current + EWMA_ALPHA * sample
+
+
+class ModelHealth:
+    def __init__(self, model):
+        self.model = model
+        self.requests = 0
+        self.latency_ewma = None
+        self.latencies = deque(maxlen=50)
+        self.error_rate = 0.0
+        self.rate_limit_rate = 0.0
+        self.parse_failure_rate = 0.0
+        self.parsed = 0
+        self.parse_failures = 0
+        self.tokens = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_seconds = OPEN_SECONDS
+        self.opened_at = None
+        self.probe_started_at = None
+
+    def p95_latency(self):
+        samples = sorted(self.latencies)
+        if len(samples) < MIN_SAMPLES_FOR_P95:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def tokens_per_success(self):
+        """Tokens billed per usable artifact, counting the attempts that failed to parse"""
+        successes = self.parsed - self.parse_failures
+        return round(self.tokens / successes) if successes else None
+
+    def expected_latency(self):
+        """Latency divided by success probability - lower is better"""
+        latency = self.latency_ewma if self.latency_ewma is not None else UNKNOWN_LATENCY
+        failure = 1 - (1 - self.error_rate) * (1 - self.parse_failure_rate)
+        return latency / max(1 - failure, 0.05)
+
+    def allow(self, now):
+        """Whether a request may be sent; claims the half-open probe slot"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self.probe_started_at = now
+            return True
+        # A probe that never reported back (e.g. cancelled) must not block forever
+        if self.state == HALF_OPEN and now - self.probe_started_at >= self.open_seconds:
+            self.probe_started_at = now
+            return True
+        return False
+
+    def on_success(self):
+        self.consecutive_failures = 0
+        if self.state != CLOSED:
+            logger.info("Circuit closed for %s", self.model)
+        self.state = CLOSED
+        self.open_seconds = OPEN_SECONDS
+
+    def on_failure(self, now):
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self.open_seconds = min(self.open_seconds * 2, MAX_OPEN_SECONDS)
+            self._open(now)
+        elif self.state == CLOSED and self.consecutive_failures >= FAILURE_THRESHOLD:
+            self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        CIRCUIT_OPENED.inc(model=self.model)
+        logger.warning("Circuit open for %s (%.0fs)", self.model, self.open_seconds)
+
+    def snapshot(self, now):
+        retry_in = None
+        if self.state == OPEN:
+            retry_in = round(max(0.0, self.open_seconds - (now - self.opened_at)), 1)
+        p95 = self.p95_latency()
+        return {
+            "state": self.state,
+            "requests": self.requests,
+            "latency_ewma_ms": round(self.latency_ewma * 1000) if self.latency_ewma is not None else None,
+            "latency_p95_ms": round(p95 * 1000) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "rate_limit_rate": round(self.rate_limit_rate, 3),
+            "parse_failure_rate": round(self.parse_failure_rate, 3),
+            "parse_failures": self.parse_failures,
+            "tokens_per_success": self.tokens_per_success(),
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in_seconds": retry_in
+        }
+
+
+class ModelHealthRegistry:
+    """Process-wide view of how each model has been behaving"""
+
+    def __init__(self):
+        self._models = {}
+
+    def get(self, model):
+        if model not in self._models:
+            self._models[model] = ModelHealth(model)
+        return self._models[model]
+
+    def record_response(self, model, status_code, latency):
+        health = self.get(model)
+        health.requests += 1
+        now = time.monotonic()
+        if status_code == 200:
+            health.latencies.append(latency)
+            health.latency_ewma = _ewma(health.latency_ewma, latency)
+            health.error_rate = _ewma(health.error_rate, 0.0)
+            health.rate_limit_rate = _ewma(health.rate_limit_rate, 0.0)
+            # Not a success until record_parse_result() finds a usable artifact in it
+        else:
+            health.error_rate = _ewma(health.error_rate, 1.0)
+            health.rate_limit_rate = _ewma(health.rate_limit_rate, 1.0 if status_code == 429 else 0.0)
+            health.on_failure(now)
+
+    def record_error(self, model):
+        """Timeouts and connection errors"""
+        health = self.get(model)
+        health.requests += 1
+        health.error_rate = _ewma(health.error_rate, 1.0)
+        health.rate_limit_rate = _ewma(health.rate_limit_rate, 0.0)
+        health.on_failure(time.monotonic())
+
+    def record_parse_result(self, model, ok, tokens=None):
+        """Whether a 200 response held a usable artifact; tokens is its usage.total_tokens"""
+        health = self.get(model)
+        health.parsed += 1
+        health.tokens += tokens or 0
+        if not ok:
+            health.parse_failures += 1
+        health.parse_failure_rate = _ewma(health.parse_failure_rate, 0.0 if ok else 1.0)
+        if ok:
+            health.on_success()
+        else:
+            health.on_failure(time.monotonic())
+
+    def allow(self, model):
+        return self.get(model).allow(time.monotonic())
+
+    def p95_latency(self, model):
+        return self.get(model).p95_latency()
+
+    def order_models(self, models):
+        """Order by expected success-latency, keeping the configured order for ties"""
+        ranked = sorted(enumerate(models), key=lambda item: (self.get(item[1]).expected_latency(), item[0]))
+        return [model for _, model in ranked]
+
+    def skipped_models(self):
+        now = time.monotonic()
+        return [
+            model for model, health in self._models.items()
+            if health.state == OPEN and now - health.opened_at < health.open_seconds
+        ]
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {model: health.snapshot(now) for model, health in self._models.items()}
+
+
+registry = ModelHealthRegistry()
+
+
+def _collect_circuit_states():
+    states = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+    for model, health in registry.snapshot().items():
+        CIRCUIT_STATE.set(states[health["state"]], model=model)
+
+
+metrics.add_collector(_collect_circuit_states)
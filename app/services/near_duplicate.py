@@ -0,0 +1,111 @@
+# app/services/near_duplicate.py - MinHash fingerprints and an LSH index over them
+import re
+import zlib
+import numpy as np
+
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+# Below this many shingles one edit moves the similarity too far to judge,
+# so short notes only ever match exactly
+MIN_SHINGLES = 20
+_BLOCK = 8192
+
+_WORD = re.compile(r"\w+")
+
+# Fixed seed: signatures are stored with cached entries and must match across
+# workers and restarts. Multiply-shift hashing needs odd multipliers.
+_rng = np.random.default_rng(0x5EED)
+_A = _rng.integers(1, 2 ** 63, size=(NUM_PERM, 1), dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, size=(NUM_PERM, 1), dtype=np.uint64)
+
+
+def fingerprint(content):
+    """MinHash signature (NUM_PERM uint32) of content's word 3-grams, or None if too short.
+
+    Case, punctuation and whitespace are ignored; a fixed typo changes only
+    the few shingles around it and a moved paragraph only those at its edges.
+    """
+    words = np.array([zlib.crc32(word.encode("utf-8")) for word in _WORD.findall(content.lower())], dtype=np.uint64)
+    if len(words) < SHINGLE_WORDS + MIN_SHINGLES - 1:
+        return None
+    shingles = (words[:-2] * np.uint64(0x9E3779B1)) ^ (words[1:-1] * np.uint64(0x85EBCA77)) ^ words[2:]
+    shingles = np.unique(shingles & np.uint64(0xFFFFFFFF))
+    if len(shingles) < MIN_SHINGLES:
+        return None
+
+    signature = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint64)
+    for start in range(0, len(shingles), _BLOCK):
+        block = shingles[start:start + _BLOCK]
+        # uint64 arithmetic wraps, which is what multiply-shift hashing wants
+        hashed = (_A * block + _B) >> np.uint64(32)
+        np.minimum(signature, hashed.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+class NearDuplicateIndex:
+    """Finds a stored signature at least `threshold` similar to a query.
+
+    Each signature is cut into BANDS bands, and two signatures become
+    candidates when any band matches exactly; at 8 x 8 that catches a 0.9
+    match 99% of the time and a 0.8 match 80%. A lookup is BANDS dict probes
+    plus a compare per candidate, however many entries there are.
+    Signatures live in one array used as a ring, grown on demand up to
+    max_entries, after which the oldest entry is replaced.
+    """
+
+    def __init__(self, threshold=0.9, max_entries=100_000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._signatures = np.zeros((min(1024, max_entries), NUM_PERM), dtype=np.uint32)
+        self._entries = []  # slot -> (scope, key)
+        self._buckets = {}  # hash of (scope, band, band values) -> [slot, ...]
+        self._next = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _bands(self, scope, signature):
+        return [hash((scope, band, signature[band * ROWS:(band + 1) * ROWS].tobytes())) for band in range(BANDS)]
+
+    def add(self, scope, key, signature):
+        slot = self._next % self.max_entries
+        self._next += 1
+        if slot < len(self._entries):
+            old_scope, _ = self._entries[slot]
+            for bucket in self._bands(old_scope, self._signatures[slot]):
+                slots = self._buckets[bucket]
+                slots.remove(slot)
+                if not slots:
+                    del self._buckets[bucket]
+            self._entries[slot] = (scope, key)
+        else:
+            if slot == len(self._signatures):
+                grown = np.zeros((min(2 * slot, self.max_entries), NUM_PERM), dtype=np.uint32)
+                grown[:slot] = self._signatures
+                self._signatures = grown
+            self._entries.append((scope, key))
+        self._signatures[slot] = signature
+        for bucket in self._bands(scope, signature):
+            self._buckets.setdefault(bucket, []).append(slot)
+
+    def query(self, scope, signature):
+        """(key, similarity) of the closest entry in scope at or above threshold, else None"""
+        candidates = set()
+        for bucket in self._bands(scope, signature):
+            candidates.update(self._buckets.get(bucket, ()))
+        best = None
+        for slot in candidates:
+            entry_scope, key = self._entries[slot]
+            if entry_scope != scope:
+                continue
+            score = similarity(self._signatures[slot], signature)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
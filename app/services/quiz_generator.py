@@ -1,31 +1,25 @@
-import requests
-import os
-import json
-import re
+from functools import lru_cache
+from app.config import settings
+from app.services.decks import generate_deck, prompt_guidance
+from app.services.generation import TaskDefinition, engine
+from app.services.schemas import QuizItem
+from app.utils.preprocess import clean_notes
 
-def generate_quiz_using_openrouter(content):
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    
-    if not api_key:
-        return []
+# Cache key version for the quiz prompt below
+PROMPT_VERSION = "v2"
 
-    models_to_try = [
-        "deepseek/deepseek-r1:free",
-        "deepseek/deepseek-v3:free",
-        "mistralai/mistral-7b-instruct:free",
-        "meta-llama/llama-3.2-3b-instruct:free",
-        "microsoft/phi-3-mini-128k-instruct:free",
-        "google/gemma-2-2b-it:free"
-    ]
-        
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:8000",
-        "X-Title": "StudyBuddy App"
-    }
+MAX_TOKENS = 1500
+DEFAULT_COUNT = 3
+# Larger quizzes are split into shards of at most this many questions
+QUESTIONS_PER_SHARD = 10
+# Output budget per question once a shard asks for more than MAX_TOKENS covers
+TOKENS_PER_QUESTION = 150
+MAX_COUNT = settings.quiz_max_count
+# Notes beyond this are cut on a sentence boundary instead of overflowing the context window
+MAX_INPUT_TOKENS = settings.quiz_max_input_tokens
 
-    prompt = f"""Create exactly 3 multiple choice questions from this content. Return ONLY valid JSON format:
+def build_prompt(content, count=DEFAULT_COUNT, guidance=""):
+    return f"""Create exactly {count} multiple choice questions from this content.{guidance} Return ONLY valid JSON format:
 
 {content}
 
@@ -38,67 +32,8 @@ Format:
     }}
 ]"""
 
-    for model in models_to_try:
-        payload = {
-            "model": model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.2,
-            "max_tokens": 1500
-        }
-
-        try:
-            print(f"🧪 Trying quiz model: {model}")
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions", 
-                json=payload, 
-                headers=headers,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if "choices" in data and data["choices"]:
-                    content_response = data["choices"][0]["message"]["content"]
-                    
-                    try:
-                        # Clean response
-                        content_response = re.sub(r'```json\s*', '', content_response)
-                        content_response = re.sub(r'```\s*$', '', content_response)
-                        content_response = content_response.strip()
-                        
-                        # Find JSON array
-                        json_match = re.search(r'\[.*\]', content_response, re.DOTALL)
-                        if json_match:
-                            quiz = json.loads(json_match.group())
-                            if isinstance(quiz, list) and len(quiz) > 0:
-                                # Validate quiz structure
-                                if all('question' in q and 'options' in q and 'answer' in q for q in quiz):
-                                    print(f"✅ Quiz success with model: {model}")
-                                    return quiz
-                        
-                        # Try parsing entire response
-                        quiz = json.loads(content_response)
-                        if isinstance(quiz, list) and len(quiz) > 0:
-                            if all('question' in q and 'options' in q and 'answer' in q for q in quiz):
-                                print(f"✅ Quiz success with model: {model}")
-                                return quiz
-                            
-                    except json.JSONDecodeError as je:
-                        print(f"❌ Quiz JSON parse failed for model: {model} - {je}")
-                        print(f"Raw response: {content_response[:200]}")
-                        continue
-            elif response.status_code == 429:
-                print(f"⚠️ Rate limit hit for model: {model}")
-                continue
-            else:
-                print(f"❌ Quiz model {model} failed: {response.status_code}")
-                continue
-                
-        except Exception as e:
-            print(f"❌ Quiz model {model} error: {e}")
-            continue
-    
-    # Enhanced fallback quiz
+def create_fallback_quiz():
+    """Canned quiz served when every model fails"""
     return [
         {
             "question": "Based on the provided content, what is the main subject being discussed?",
@@ -116,3 +51,27 @@ Format:
             "answer": "Focus on key concepts"
         }
     ]
+
+@lru_cache(maxsize=256)
+def quiz_task(count=DEFAULT_COUNT, difficulty="mixed", part=1, parts=1):
+    """The quiz task for one request or shard; the default one is QUIZ_TASK"""
+    guidance = prompt_guidance(difficulty, part, parts)
+    version = PROMPT_VERSION if (count, guidance) == (DEFAULT_COUNT, "") else f"{PROMPT_VERSION}-{count}-{difficulty}-{part}of{parts}"
+    return TaskDefinition(
+        "quiz", lambda content: build_prompt(content, count, guidance), max(MAX_TOKENS, count * TOKENS_PER_QUESTION),
+        prompt_version=version, max_input_tokens=MAX_INPUT_TOKENS,
+        fallback=lambda content: create_fallback_quiz(), schema=QuizItem, schema_key="questions", stream_event="question",
+        near_duplicates=True, preprocess=clean_notes
+    )
+
+QUIZ_TASK = quiz_task()
+
+async def generate_quiz_using_openrouter(content, meta=None, count=DEFAULT_COUNT, difficulty="mixed"):
+    """Generate a multiple choice quiz; meta, if given, is filled with cache/fallback info"""
+    if not settings.openrouter_api_key:
+        return []
+    return await generate_deck(quiz_task, content, count, difficulty, QUESTIONS_PER_SHARD, meta)
+
+def stream_quiz_using_openrouter(content):
+    """Yield (event, data) pairs, one "question" event per item as soon as it is complete"""
+    return engine.stream(QUIZ_TASK, content)
@@ -0,0 +1,265 @@
+# app/services/rate_limiter.py - client-side OpenRouter rate limiting
+import asyncio
+import contextvars
+import hashlib
+import heapq
+import itertools
+import sqlite3
+import time
+from collections import defaultdict
+from app.config import settings
+from app.services.deadline import DeadlineExceeded, generation_budget
+from app.services.metrics import RATE_LIMITED
+
+# Lower number = served first when requests queue for the same key
+INTERACTIVE = 0
+BACKGROUND = 10
+
+# Set by background work (jobs) so user-facing requests jump ahead of it
+request_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+
+class RateLimitExceeded(Exception):
+    """The API key is out of budget; our own client should get a 429"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class ModelRateLimited(Exception):
+    """Only this model is throttled (e.g. Retry-After on a 429); try another"""
+
+    def __init__(self, model, retry_after):
+        super().__init__(f"{model} rate limited for {retry_after:.0f}s")
+        self.model = model
+        self.retry_after = retry_after
+
+
+def _refill(row, rate, capacity, now):
+    tokens, updated, blocked_until = row
+    if rate > 0:
+        tokens = min(capacity, tokens + (now - updated) * rate)
+    return tokens, now, blocked_until
+
+
+def _wait(row, rate, now):
+    tokens, _, blocked_until = row
+    wait = max(0.0, blocked_until - now)
+    if rate > 0 and tokens < 1:
+        wait = max(wait, (1 - tokens) / rate)
+    return wait
+
+
+class MemoryBucketState:
+    """Bucket state for a single worker process"""
+
+    def __init__(self):
+        self._rows = {}
+
+    def _row(self, name, capacity, now):
+        return self._rows.get(name, (capacity, now, 0.0))
+
+    async def try_take(self, specs, now, take=True):
+        """Take one token from every (name, rate, capacity) bucket, or none.
+
+        Returns 0 on success, otherwise the seconds until all would be ready.
+        """
+        rows = {name: _refill(self._row(name, capacity, now), rate, capacity, now) for name, rate, capacity in specs}
+        wait = max((_wait(rows[name], rate, now) for name, rate, _ in specs), default=0.0)
+        if wait == 0 and take:
+            rates = {name: rate for name, rate, _ in specs}
+            rows = {name: (row[0] - 1 if rates[name] > 0 else row[0], row[1], row[2]) for name, row in rows.items()}
+        self._rows.update(rows)
+        return wait
+
+    async def block(self, name, until, capacity):
+        tokens, updated, blocked_until = self._row(name, capacity, time.time())
+        self._rows[name] = (tokens, updated, max(blocked_until, until))
+
+
+class SqliteBucketState:
+    """Bucket state shared by every worker process through a SQLite file lock"""
+
+    def __init__(self, path):
+        self.path = path
+        self._transaction(lambda conn: conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, blocked_until REAL NOT NULL)"
+        ))
+
+    def _transaction(self, fn):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        try:
+            # IMMEDIATE takes the write lock up front so read-modify-write is atomic across processes
+            conn.execute("BEGIN IMMEDIATE")
+            result = fn(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _load(conn, name, capacity, now):
+        row = conn.execute("SELECT tokens, updated, blocked_until FROM buckets WHERE name = ?", (name,)).fetchone()
+        return row or (capacity, now, 0.0)
+
+    @staticmethod
+    def _save(conn, name, row):
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)",
+            (name, *row)
+        )
+
+    def _try_take(self, conn, specs, now, take):
+        rows = {name: _refill(self._load(conn, name, capacity, now), rate, capacity, now) for name, rate, capacity in specs}
+        wait = max((_wait(rows[name], rate, now) for name, rate, _ in specs), default=0.0)
+        for name, rate, _ in specs:
+            row = rows[name]
+            if wait == 0 and take and rate > 0:
+                row = (row[0] - 1, row[1], row[2])
+            self._save(conn, name, row)
+        return wait
+
+    async def try_take(self, specs, now, take=True):
+        return await asyncio.to_thread(self._transaction, lambda conn: self._try_take(conn, specs, now, take))
+
+    def _block(self, conn, name, until, capacity):
+        tokens, updated, blocked_until = self._load(conn, name, capacity, time.time())
+        self._save(conn, name, (tokens, updated, max(blocked_until, until)))
+
+    async def block(self, name, until, capacity):
+        await asyncio.to_thread(self._transaction, lambda conn: self._block(conn, name, until, capacity))
+
+
+class RateLimiter:
+    """Token buckets per API key (per-minute and per-day) and per key+model.
+
+    Requests for the same key queue in priority order, so interactive calls
+    are granted tokens before background jobs. A request that would have to
+    wait longer than its priority allows is rejected with RateLimitExceeded
+    instead of spending an upstream attempt that is bound to 429; one whose
+    request deadline runs out first gets DeadlineExceeded instead.
+    """
+
+    def __init__(self, state, rpm=20, daily_quota=50, model_rpm=0,
+                 max_wait_interactive=10.0, max_wait_background=300.0):
+        self.state = state
+        self.rpm = rpm
+        self.daily_quota = daily_quota
+        self.model_rpm = model_rpm
+        self.max_wait = {INTERACTIVE: max_wait_interactive, BACKGROUND: max_wait_background}
+        self._queues = defaultdict(list)
+        self._seq = itertools.count()
+        self.rejected = 0
+
+    @staticmethod
+    def _key_id(api_key):
+        # Never persist the raw key
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+    def _key_specs(self, key_id):
+        specs = []
+        if self.rpm > 0:
+            specs.append((f"{key_id}:minute", self.rpm / 60.0, self.rpm))
+        if self.daily_quota > 0:
+            specs.append((f"{key_id}:day", self.daily_quota / 86400.0, self.daily_quota))
+        return specs
+
+    def _model_spec(self, key_id, model):
+        rate = self.model_rpm / 60.0 if self.model_rpm > 0 else 0.0
+        return (f"{key_id}:model:{model}", rate, max(self.model_rpm, 1))
+
+    async def acquire(self, api_key, model):
+        key_id = self._key_id(api_key)
+        model_spec = self._model_spec(key_id, model)
+
+        # A model under Retry-After is skipped rather than waited for
+        model_wait = await self.state.try_take([model_spec], time.time(), take=False)
+        if model_wait > 0:
+            raise ModelRateLimited(model, model_wait)
+
+        priority = request_priority.get()
+        quota_wait = max_wait = self.max_wait.get(priority, self.max_wait[INTERACTIVE])
+        # No point queueing for a token the request won't be around to use;
+        # running out of request time is not the quota's fault, so say which it was
+        budget = generation_budget()
+        deadline_bound = budget is not None and budget < max_wait
+        if deadline_bound:
+            max_wait = budget
+        deadline = time.monotonic() + max_wait
+        specs = self._key_specs(key_id) + [model_spec]
+
+        queue = self._queues[key_id]
+        entry = (priority, next(self._seq), asyncio.Event())
+        heapq.heappush(queue, entry)
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if queue[0] is entry:
+                    wait = await self.state.try_take(specs, time.time())
+                    if wait == 0:
+                        return
+                    if wait > remaining:
+                        if deadline_bound and wait <= quota_wait:
+                            raise DeadlineExceeded()
+                        self.rejected += 1
+                        RATE_LIMITED.inc(model=model, source="local")
+                        raise RateLimitExceeded(wait)
+                    sleep = wait
+                else:
+                    if remaining <= 0:
+                        if deadline_bound:
+                            raise DeadlineExceeded()
+                        self.rejected += 1
+                        RATE_LIMITED.inc(model=model, source="local")
+                        raise RateLimitExceeded(max(1.0, 60.0 / max(self.rpm, 1) * len(queue)))
+                    sleep = remaining
+
+                entry[2].clear()
+                try:
+                    await asyncio.wait_for(entry[2].wait(), timeout=sleep)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            queue.remove(entry)
+            heapq.heapify(queue)
+            if queue:
+                queue[0][2].set()
+
+    async def penalize(self, api_key, model, retry_after, key_wide=False):
+        """Honour a 429: block the model (or the whole key) until retry_after elapses"""
+        key_id = self._key_id(api_key)
+        until = time.time() + retry_after
+        if key_wide:
+            for name, _, capacity in self._key_specs(key_id):
+                await self.state.block(name, until, capacity)
+        else:
+            name, _, capacity = self._model_spec(key_id, model)
+            await self.state.block(name, until, capacity)
+
+    def stats(self):
+        return {
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "rejected": self.rejected,
+            "rpm": self.rpm,
+            "daily_quota": self.daily_quota
+        }
+
+
+def create_rate_limiter():
+    state = SqliteBucketState(settings.rate_limit_db) if settings.rate_limit_db else MemoryBucketState()
+    return RateLimiter(
+        state,
+        rpm=settings.rpm,
+        daily_quota=settings.daily_quota,
+        model_rpm=settings.model_rpm,
+        max_wait_interactive=settings.rate_limit_max_wait,
+        max_wait_background=settings.rate_limit_max_wait_background
+    )
+
+
+rate_limiter = create_rate_limiter()
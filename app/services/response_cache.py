@@ -0,0 +1,259 @@
+# app/services/response_cache.py - content-addressed cache for generated artifacts
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from app.config import settings
+from app.services.metrics import CACHE_REQUESTS
+from app.services.near_duplicate import NearDuplicateIndex, fingerprint
+
+# Fingerprinting is ~1ms per 1000 words; longer notes are done off the event loop
+INLINE_FINGERPRINT_CHARS = 20_000
+
+
+def normalize_content(content):
+    """Collapse whitespace and Unicode variants so trivially different pastes share a key"""
+    return " ".join(unicodedata.normalize("NFC", content).split())
+
+
+def cache_key(task, content, prompt_version):
+    digest = hashlib.sha256(normalize_content(content).encode("utf-8")).hexdigest()
+    return f"{task}:{prompt_version}:{digest}"
+
+
+class LRUCache:
+    """In-memory tier with TTL plus entry-count and byte-size eviction"""
+
+    def __init__(self, max_entries=1000, max_bytes=50_000_000, ttl=86400):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self.bytes_used = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at < time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, size, expires_at=None):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at or time.time() + self.ttl, size, value)
+        self.bytes_used += size
+        while len(self._entries) > self.max_entries or self.bytes_used > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes_used -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCache:
+    """Optional on-disk tier that survives restarts"""
+
+    def __init__(self, path):
+        self.path = path
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, fingerprint BLOB)"
+        )
+        try:
+            self._execute("ALTER TABLE responses ADD COLUMN fingerprint BLOB")
+        except sqlite3.OperationalError:
+            pass  # Already there
+
+    def _execute(self, sql, params=()):
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def get(self, key):
+        row = self._execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,))
+        if row is None:
+            return None
+        if row[1] < time.time():
+            self._execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        return row
+
+    def set(self, key, value, expires_at, fingerprint=None):
+        self._execute(
+            "INSERT OR REPLACE INTO responses (key, value, expires_at, fingerprint) VALUES (?, ?, ?, ?)",
+            (key, value, expires_at, fingerprint)
+        )
+
+    def recent(self, limit):
+        """Up to limit unexpired (key, value, expires_at) rows, newest first"""
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            return conn.execute(
+                "SELECT key, value, expires_at FROM responses WHERE expires_at >= ? ORDER BY expires_at DESC LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def fingerprints(self, limit):
+        """Up to limit unexpired (key, fingerprint) rows that have one, oldest first"""
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            rows = conn.execute(
+                "SELECT key, fingerprint FROM responses WHERE fingerprint IS NOT NULL AND expires_at >= ? "
+                "ORDER BY expires_at DESC LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return rows[::-1]
+
+
+class ResponseCache:
+    """Memory tier, optional disk tier, and an optional near-duplicate index.
+
+    Lookups with similar=True that miss on the exact key fall back to the
+    index: an artifact stored for notes whose fingerprint is at least the
+    index's threshold similar (a fixed typo, other whitespace, a moved
+    paragraph) is served instead of generating a new one.
+    """
+
+    def __init__(self, memory, disk=None, ttl=86400, near=None):
+        self.memory = memory
+        self.disk = disk
+        self.ttl = ttl
+        self.near = near
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls):
+        memory = LRUCache(
+            max_entries=settings.response_cache_max_entries,
+            max_bytes=settings.response_cache_max_bytes,
+            ttl=settings.response_cache_ttl
+        )
+        disk = SqliteCache(settings.response_cache_db) if settings.response_cache_db else None
+        near = None
+        if settings.near_duplicate_threshold > 0 and settings.near_duplicate_max_entries > 0:
+            near = NearDuplicateIndex(settings.near_duplicate_threshold, settings.near_duplicate_max_entries)
+        return cls(memory, disk, settings.response_cache_ttl, near)
+
+    async def warm(self, limit):
+        """Copy the newest disk entries into memory so a fresh worker starts hot.
+
+        The near-duplicate index is rebuilt from every fingerprint on disk it
+        can hold, since an index hit is served from disk if not in memory.
+        """
+        if self.disk is None:
+            return 0
+        if self.near is not None:
+            for key, blob in await asyncio.to_thread(self.disk.fingerprints, self.near.max_entries):
+                self.near.add(_scope(key), key, np.frombuffer(blob, dtype=np.uint32))
+        if limit <= 0:
+            return 0
+        rows = await asyncio.to_thread(self.disk.recent, limit)
+        # Oldest first, so the newest end up least likely to be evicted
+        for key, raw, expires_at in reversed(rows):
+            self.memory.set(key, raw, len(raw), expires_at)
+        return len(rows)
+
+    async def _load(self, key):
+        # Entries are kept as JSON text so callers can't mutate cached artifacts
+        raw = self.memory.get(key)
+        if raw is None and self.disk is not None:
+            row = await asyncio.to_thread(self.disk.get, key)
+            if row is not None:
+                raw, expires_at = row
+                self.memory.set(key, raw, len(raw), expires_at)
+        return raw
+
+    async def _fingerprint(self, content):
+        if len(content) > INLINE_FINGERPRINT_CHARS:
+            return await asyncio.to_thread(fingerprint, content)
+        return fingerprint(content)
+
+    async def lookup(self, task, content, prompt_version, similar=False):
+        """(artifact, "hit"), (artifact, "near_hit") or (None, "miss")"""
+        key = cache_key(task, content, prompt_version)
+        raw = await self._load(key)
+        result = "hit"
+        if raw is None and similar and self.near is not None:
+            signature = await self._fingerprint(content)
+            match = self.near.query(_scope(key), signature) if signature is not None else None
+            if match is not None:
+                raw = await self._load(match[0])
+                if raw is not None:
+                    result = "near_hit"
+                    # Repeats of these exact notes then hit without fingerprinting
+                    self.memory.set(key, raw, len(raw))
+        if raw is None:
+            self.misses += 1
+            CACHE_REQUESTS.inc(task=task, result="miss")
+            return None, "miss"
+        if result == "hit":
+            self.hits += 1
+        else:
+            self.near_hits += 1
+        CACHE_REQUESTS.inc(task=task, result=result)
+        return json.loads(raw), result
+
+    async def get(self, task, content, prompt_version, similar=False):
+        artifact, _ = await self.lookup(task, content, prompt_version, similar)
+        return artifact
+
+    async def set(self, task, content, prompt_version, value, similar=False):
+        """Store a generated artifact - callers must never pass fallback output.
+
+        similar=True also fingerprints content, so later lookups with
+        similar=True can match it.
+        """
+        key = cache_key(task, content, prompt_version)
+        raw = json.dumps(value)
+        expires_at = time.time() + self.ttl
+        self.memory.set(key, raw, len(raw), expires_at)
+        signature = None
+        if similar and self.near is not None:
+            signature = await self._fingerprint(content)
+            if signature is not None:
+                self.near.add(_scope(key), key, signature)
+        if self.disk is not None:
+            blob = signature.tobytes() if signature is not None else None
+            await asyncio.to_thread(self.disk.set, key, raw, expires_at, blob)
+
+    def stats(self):
+        return {
+            "entries": len(self.memory),
+            "bytes": self.memory.bytes_used,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "disk_enabled": self.disk is not None,
+            "near_duplicate_entries": len(self.near) if self.near is not None else None
+        }
+
+
+def _scope(key):
+    """The task:prompt_version part of a cache key; near matches never cross it"""
+    return key.rsplit(":", 1)[0]
+
+
+response_cache = ResponseCache.from_settings()
@@ -0,0 +1,73 @@
+# app/services/schemas.py - shapes of the items models are asked to return
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
+
+
+class QuizItem(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    question: str = Field(min_length=1)
+    options: list[str] = Field(min_length=2)
+    answer: str = Field(min_length=1, description="The correct option, copied exactly from options")
+
+    @model_validator(mode="after")
+    def answer_is_an_option(self):
+        if self.answer in self.options:
+            return self
+        # "paris" for "Paris" is the same answer; take the option's wording
+        for option in self.options:
+            if option.casefold() == self.answer.casefold():
+                self.answer = option
+                return self
+        raise ValueError("answer must be one of options")
+
+
+class Flashcard(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    question: str = Field(min_length=1)
+    answer: str = Field(min_length=1)
+
+
+def validate_item(item, schema):
+    """item as a plain dict if it matches schema, else None"""
+    try:
+        return schema.model_validate(item).model_dump()
+    except ValidationError:
+        return None
+
+
+def validate_items(items, schema):
+    """Keep the items that match schema, so one bad entry doesn't cost the whole response"""
+    valid = (validate_item(item, schema) for item in items)
+    return [item for item in valid if item is not None]
+
+
+def _strict_schema(schema):
+    # Providers' strict mode rejects most validation keywords, so only types and
+    # descriptions are sent; pydantic still checks lengths and answers on the way back in
+    properties = {
+        name: {key: value for key, value in prop.items() if key in ("type", "items", "description")}
+        for name, prop in schema.model_json_schema()["properties"].items()
+    }
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+def response_format(name, key, schema):
+    """OpenRouter json_schema response_format for {key: [schema, ...]}.
+
+    Strict mode needs an object at the top level, so the array is wrapped;
+    JsonArrayStream scans from the first '[' and reads it either way.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {key: {"type": "array", "items": _strict_schema(schema)}},
+                "required": [key],
+                "additionalProperties": False
+            }
+        }
+    }
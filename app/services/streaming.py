@@ -0,0 +1,55 @@
+# app/services/streaming.py - stream a completion, falling back across models
+import logging
+import httpx
+from app.services.deadline import DeadlineExceeded, expired
+from app.services.llm_client import stream_chat_completion, UpstreamError, InvalidApiKey
+from app.services.model_catalog import catalog
+from app.services.model_health import registry
+from app.services.rate_limiter import ModelRateLimited
+
+
+logger = logging.getLogger(__name__)
+
+
+async def stream_with_fallback(models, build_payload, api_key, is_complete):
+    """Yield (model, delta) pairs from the first model that streams a usable answer.
+
+    Models are tried in health-registry order. A model that fails before
+    sending anything is skipped silently. If it fails part-way, or
+    is_complete() says its output was unusable, (model, None) is yielded so
+    the caller can discard what it has shown and the next model is tried.
+    Returns without a complete answer when every model fails, or when the
+    request's deadline leaves no time for another. A 401 for a model
+    OpenRouter still lists raises InvalidApiKey.
+    """
+    for model in registry.order_models(models):
+        if expired():
+            return
+        if not registry.allow(model):
+            continue
+
+        sent_output = False
+        try:
+            logger.info("Streaming from %s", model)
+            async for delta in stream_chat_completion(build_payload(model), api_key):
+                sent_output = True
+                yield model, delta
+        except DeadlineExceeded:
+            return
+        except ModelRateLimited as e:
+            logger.info("Skipping %s", e)
+        except UpstreamError as e:
+            logger.warning("Stream from %s failed: %s", model, e.status_code)
+            if e.status_code == 401 and not catalog.is_unlisted(model):
+                raise InvalidApiKey()
+        except httpx.HTTPError as e:
+            logger.warning("Stream from %s error: %s", model, e)
+        else:
+            complete = is_complete()
+            registry.record_parse_result(model, complete)
+            if complete:
+                return
+            logger.warning("Unusable streamed output from %s", model)
+
+        if sent_output:
+            yield model, None
@@ -0,0 +1,52 @@
+# app/services/study_pack.py - summary, quiz and flashcards for one set of notes
+import asyncio
+import logging
+from app.services.summarize import generate_summary_using_openrouter
+from app.services.quiz_generator import generate_quiz_using_openrouter
+from app.services.flashcard_generator import generate_flashcards_using_openrouter
+from app.services.rate_limiter import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+PARTS = {
+    "summary": generate_summary_using_openrouter,
+    "quiz": generate_quiz_using_openrouter,
+    "flashcards": generate_flashcards_using_openrouter,
+}
+
+
+async def _generate_part(part, content):
+    meta = {}
+    try:
+        result = await PARTS[part](content, meta)
+        return {
+            "part": part,
+            part: result,
+            "cache": meta.get("cache", "miss"),
+            "fallback": meta.get("fallback", False)
+        }
+    except RateLimitExceeded as e:
+        return {"part": part, "error": str(e), "retry_after": round(e.retry_after)}
+    except Exception as e:
+        logger.exception("Study pack %s error", part)
+        return {"part": part, "error": str(e)}
+
+
+async def generate_study_pack(content):
+    """Yield each part's result as soon as it completes.
+
+    The three generators run concurrently on the same cleaned notes, so each
+    part still goes through its own cache and single-flight entry and a later
+    /summarize, /generate-quiz or /generate-flashcards call for the same notes
+    is served from cache.
+    """
+    content = content.strip()
+    tasks = [asyncio.create_task(_generate_part(part, content)) for part in PARTS]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client went away mid-stream - stop paying for the remaining parts
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,182 +1,214 @@
 # app/services/summarize.py - FIXED WITH API KEY DEBUGGING
-import requests
-import os
-import json
-import time
+import asyncio
+import logging
+from app.config import settings
+from app.services.extractive import extractive_summary
+from app.services.generation import TaskDefinition, engine
+from app.services.llm_client import close_client
+from app.services.model_catalog import catalog
+from app.services.model_dispatch import candidate_models, input_budget
+from app.services.deadline import request_deadline
+from app.services.rate_limiter import request_priority, BACKGROUND
+from app.utils.chunking import split_into_chunks, fit_to_budget
+from app.utils.preprocess import clean_notes
+from app.utils.tokens import count_tokens, off_loop
 
-def generate_summary_using_openrouter(content):
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    
-    # Enhanced API key validation
+logger = logging.getLogger(__name__)
+
+# Bump when the prompt changes so cached summaries from the old prompt are ignored
+PROMPT_VERSION = "v2"
+
+SUMMARY_TOKENS = 200  # Shorter for summaries
+CHUNK_SUMMARY_TOKENS = 300
+MAX_CHUNK_TOKENS = settings.summary_max_chunk_tokens
+MAX_PARALLEL_CHUNKS = settings.summary_max_parallel_chunks
+MAX_BACKGROUND = settings.summary_max_background
+
+# fast: local extractive summary; llm: model summary; auto: the model summary
+# if it's cached, else the extractive one now while the model one is made
+SUMMARY_MODES = ("fast", "llm", "auto")
+
+# LLM summaries started in the background by mode=auto
+_background_summaries = set()
+
+def build_prompt(content):
+    # Simple, effective prompt
+    return f"""Please provide a clear 2-3 sentence summary of the following content:
+
+{content}
+
+Focus on the main ideas and key points."""
+
+def build_chunk_prompt(chunk):
+    return f"""Summarize this section of a longer document in 3-5 sentences, keeping key terms, names and numbers:
+
+{chunk}"""
+
+async def _summarize_chunk(chunk, api_key, semaphore):
+    # Cached per chunk, so editing one section only re-summarizes that section
+    async with semaphore:
+        return await engine.generate(CHUNK_TASK, chunk, api_key)
+
+async def _map_reduce(content, api_key):
+    """Condense content until it fits one summary prompt.
+
+    Chunks are summarized concurrently (at most MAX_PARALLEL_CHUNKS at a
+    time) and their summaries joined; that repeats level by level for very
+    long documents. Returns (text, complete) where complete is False if some
+    chunk could not be summarized.
+    """
+    budget = input_budget(candidate_models(), CHUNK_SUMMARY_TOKENS, cap=MAX_CHUNK_TOKENS)
+    text = content
+    complete = True
+    tokens = await off_loop(count_tokens, text)
+    while tokens > budget:
+        chunks = await off_loop(split_into_chunks, text, budget)
+        logger.info("Summarizing %d chunks", len(chunks))
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_CHUNKS)
+        summaries = await asyncio.gather(*[_summarize_chunk(chunk, api_key, semaphore) for chunk in chunks])
+        kept = [summary for summary in summaries if summary]
+        if not kept:
+            return None, False
+        complete = complete and len(kept) == len(summaries)
+        reduced = "\n\n".join(kept)
+        reduced_tokens = await off_loop(count_tokens, reduced)
+        if reduced_tokens >= tokens:
+            # Not shrinking any more - take what fits rather than loop forever
+            return await off_loop(fit_to_budget, reduced, budget), False
+        text, tokens = reduced, reduced_tokens
+    return text, complete
+
+def create_fallback_summary(content):
+    """The notes' most central sentences, for when no model can be reached"""
+    return extractive_summary(content) or content.strip()[:500]
+
+
+CHUNK_TASK = TaskDefinition(
+    "summary-chunk", build_chunk_prompt, CHUNK_SUMMARY_TOKENS,
+    prompt_version=PROMPT_VERSION, temperature=0.3, max_input_tokens=MAX_CHUNK_TOKENS
+)
+
+SUMMARY_TASK = TaskDefinition(
+    "summary", build_prompt, SUMMARY_TOKENS,
+    prompt_version=PROMPT_VERSION, temperature=0.3, max_input_tokens=MAX_CHUNK_TOKENS,
+    fallback=create_fallback_summary, condense=_map_reduce, near_duplicates=True,
+    preprocess=clean_notes
+)
+
+def _key_problem(api_key):
     if not api_key:
-        print("❌ No OPENROUTER_API_KEY found in environment variables")
-        print("💡 Make sure to set: export OPENROUTER_API_KEY='your-key-here'")
+        logger.error("No OPENROUTER_API_KEY found in environment variables - set it with export OPENROUTER_API_KEY='your-key-here'")
         return "API key not configured"
-    
     if not api_key.startswith("sk-or-v1-"):
-        print(f"❌ Invalid API key format. Got: {api_key[:20]}...")
-        print("💡 OpenRouter keys should start with 'sk-or-v1-'")
+        logger.error("Invalid API key format, OpenRouter keys start with 'sk-or-v1-'")
         return "Invalid API key format"
-    
-    print(f"✅ API Key found: {api_key[:15]}...{api_key[-4:]}")
-
-    # Working models list (prioritize the most reliable ones)
-    models_to_try = [
-        "deepseek/deepseek-r1:free",
-        "deepseek/deepseek-v3:free", 
-        "mistralai/mistral-7b-instruct:free",
-        "meta-llama/llama-3.2-3b-instruct:free",
-        "microsoft/phi-3-mini-128k-instruct:free",
-        "google/gemma-2-2b-it:free"
-    ]
-
-    # Correct headers for OpenRouter
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:8000",  # Your app URL
-        "X-Title": "StudyBuddy App"
-    }
+    return None
 
-    # Simple, effective prompt
-    prompt = f"""Please provide a clear 2-3 sentence summary of the following content:
+async def generate_summary_using_openrouter(content, meta=None):
+    """Summarize content; meta, if given, is filled with cache/fallback info"""
+    meta = meta if meta is not None else {}
+    problem = _key_problem(settings.openrouter_api_key)
+    if problem:
+        return problem
+    summary = await engine.run(SUMMARY_TASK, content, meta)
+    return meta.get("error") or summary
 
-{content[:2000]}  
+def _summarize_in_background(content):
+    """Start the LLM summary without waiting for it; False if too many are already running.
 
-Focus on the main ideas and key points."""
+    Admission control never sees these, so a flood of distinct mode=auto
+    requests must not turn into unbounded queued model work.
+    """
+    if len(_background_summaries) >= MAX_BACKGROUND:
+        logger.info("%d background summaries running, not starting another", len(_background_summaries))
+        return False
 
-    for i, model in enumerate(models_to_try):
+    async def run():
+        # Nobody is waiting on this one, so it yields to interactive requests
+        # and isn't bound by the deadline of the request that started it
+        request_priority.set(BACKGROUND)
+        request_deadline.set(None)
         try:
-            payload = {
-                "model": model,
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.3,
-                "max_tokens": 200,  # Shorter for summaries
-                "top_p": 1
-            }
-
-            print(f"\n🧪 Attempt {i+1}/{len(models_to_try)}: Trying {model}")
-            
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions", 
-                json=payload, 
-                headers=headers,
-                timeout=30
-            )
-            
-            print(f"📊 Status: {response.status_code}")
-            
-            # Success case
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    if "choices" in data and len(data["choices"]) > 0:
-                        summary = data["choices"][0]["message"]["content"].strip()
-                        if summary:
-                            print(f"✅ SUCCESS with {model}")
-                            return summary
-                    else:
-                        print(f"❌ Empty response from {model}")
-                except json.JSONDecodeError as e:
-                    print(f"❌ JSON decode error: {e}")
-                    
-            # Error cases with detailed debugging
-            elif response.status_code == 401:
-                print(f"❌ UNAUTHORIZED (401) - API Key Issue")
-                print(f"   Response: {response.text}")
-                print(f"   This means your API key is invalid or expired")
-                
-                # Test API key with a simple request
-                test_response = requests.get(
-                    "https://openrouter.ai/api/v1/models",
-                    headers={"Authorization": f"Bearer {api_key}"}
-                )
-                if test_response.status_code == 401:
-                    print("❌ API key fails basic validation - check your key")
-                    return "Invalid API key - please check your OPENROUTER_API_KEY"
-                else:
-                    print("✅ API key is valid, model might not be available")
-                    
-            elif response.status_code == 429:
-                print(f"⚠️ RATE LIMITED (429) - waiting 2 seconds...")
-                time.sleep(2)
-                continue
-                
-            elif response.status_code == 400:
-                print(f"❌ BAD REQUEST (400)")
-                print(f"   Response: {response.text}")
-                continue
-                
-            elif response.status_code == 503:
-                print(f"⚠️ SERVICE UNAVAILABLE (503) - model overloaded")
-                continue
-                
-            else:
-                print(f"❌ Unexpected error: {response.status_code}")
-                print(f"   Response: {response.text[:300]}")
-                continue
-                
-        except requests.exceptions.Timeout:
-            print(f"⏰ TIMEOUT for {model}")
-            continue
-            
-        except requests.exceptions.ConnectionError:
-            print(f"🔗 CONNECTION ERROR for {model}")
-            continue
-            
+            await engine.generate(SUMMARY_TASK, content)
         except Exception as e:
-            print(f"💥 UNEXPECTED ERROR for {model}: {str(e)}")
-            continue
-    
-    # All models failed
-    print("\n❌ ALL MODELS FAILED")
-    return create_fallback_summary(content)
+            logger.warning("Background summary failed: %s", e)
 
-def create_fallback_summary(content):
-    """Create a simple fallback summary when API fails"""
-    words = content.split()
-    word_count = len(words)
-    
-    # Extract first few sentences as a basic summary
-    sentences = content.split('.')[:3]
-    if len(sentences) > 1:
-        basic_summary = '. '.join(sentences[:2]) + '.'
-        return f"{basic_summary} (Content contains {word_count} words - API unavailable)"
-    
-    return f"This content contains {word_count} words covering important information that requires further review. The main concepts presented need detailed analysis to fully understand the key points discussed."
+    task = asyncio.create_task(run())
+    _background_summaries.add(task)
+    task.add_done_callback(_background_summaries.discard)
+    return True
+
+async def summarize(content, mode="llm", meta=None):
+    """Summarize content by mode (see SUMMARY_MODES); meta gets mode, cache and fallback info"""
+    meta = meta if meta is not None else {}
+    if mode == "llm":
+        meta["mode"] = "llm"
+        return await generate_summary_using_openrouter(content, meta)
 
-# Test function to verify API key
-def test_api_connection():
-    """Test if the API key works"""
-    api_key = os.getenv("OPENROUTER_API_KEY")
+    content = await engine.preprocess(SUMMARY_TASK, content, meta)
+    if mode == "auto" and not _key_problem(settings.openrouter_api_key):
+        cached, result = await engine.cached(SUMMARY_TASK, content)
+        if cached is not None:
+            meta.update(mode="llm", cache=result)
+            return cached
+        # Single-flight joins repeats of this while it runs; the result lands in the cache
+        if _summarize_in_background(content):
+            meta["llm_pending"] = True
+
+    meta["mode"] = "fast"
+    # Long notes take tens of milliseconds, so keep it off the event loop
+    return await asyncio.to_thread(create_fallback_summary, content)
+
+async def stream_summary_using_openrouter(content, mode="llm"):
+    """Yield (event, data) pairs for a Server-Sent Events summary stream.
+
+    mode=fast sends only "done" with the extractive summary; mode=auto sends
+    it first as a "preview" event, then streams the model summary as usual.
+    """
+    if mode != "llm":
+        meta = {}
+        notes = await engine.preprocess(SUMMARY_TASK, content, meta)
+        preview = await asyncio.to_thread(create_fallback_summary, notes)
+        if mode == "fast":
+            yield "done", {"summary": preview, "cache": "miss", "fallback": False, "mode": "fast",
+                           "tokens_saved": meta.get("tokens_saved", 0)}
+            return
+        yield "preview", {"summary": preview}
+
+    problem = _key_problem(settings.openrouter_api_key)
+    if problem:
+        yield "error", {"detail": problem}
+        return
+    # Long notes are condensed first; only the final summary is streamed
+    async for event in engine.stream(SUMMARY_TASK, content):
+        yield event
+
+# Test function to check OpenRouter is reachable
+async def test_api_connection():
+    """Test that OpenRouter is reachable with the configured key"""
+    api_key = settings.openrouter_api_key
     
     if not api_key:
         return False, "No API key found"
     
-    headers = {"Authorization": f"Bearer {api_key}"}
-    
-    try:
-        response = requests.get(
-            "https://openrouter.ai/api/v1/models",
-            headers=headers,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            return True, "API key is valid"
-        else:
-            return False, f"API key invalid: {response.status_code}"
-            
-    except Exception as e:
-        return False, f"Connection failed: {e}"
+    # Served from the catalog snapshot when it is fresh, instead of a listing per call
+    await catalog.ensure_loaded(api_key)
+    if catalog.loaded:
+        return True, f"OpenRouter reachable, {len(catalog.free_models())} free models listed"
+    return False, "Could not load the OpenRouter model listing"
 
-if __name__ == "__main__":
+async def _main():
     # Test the API connection
-    is_valid, message = test_api_connection()
+    is_valid, message = await test_api_connection()
     print(f"API Test: {message}")
     
     if is_valid:
         # Test summarization
         test_content = "This is a test document with multiple sentences. The main goal is to test the summarization functionality."
-        result = generate_summary_using_openrouter(test_content)
-        print(f"\nTest Summary: {result}")
\ No newline at end of file
+        result = await generate_summary_using_openrouter(test_content)
+        print(f"\nTest Summary: {result}")
+    
+    await close_client()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
\ No newline at end of file
@@ -0,0 +1,68 @@
+# app/utils/chunking.py - split notes into prompt-sized pieces on natural boundaries
+import re
+from app.utils.tokens import CHARS_PER_TOKEN, count_tokens
+
+_PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+# A line break followed by a bullet or "1." / "2)" starts a new list item
+_LIST_ITEM_SPLIT = re.compile(r"\n\s*(?=[-*\u2022]\s|\d+[.)]\s)")
+_LIST_MARKER = re.compile(r"^\s*(?:[-*\u2022]|\d+[.)])\s+")
+
+
+def split_sentences(text):
+    """Sentences in reading order; list items count as sentences of their own"""
+    sentences = []
+    for paragraph in _PARAGRAPH_SPLIT.split(text):
+        for item in _LIST_ITEM_SPLIT.split(paragraph):
+            # Hard-wrapped lines inside a sentence are joined back up
+            item = " ".join(_LIST_MARKER.sub("", item).split())
+            sentences.extend(sentence for sentence in _SENTENCE_SPLIT.split(item) if sentence)
+    return sentences
+
+
+def _pieces(text, max_tokens):
+    """Paragraphs, broken into sentences (then words) only when a paragraph is too big"""
+    for paragraph in _PARAGRAPH_SPLIT.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            yield paragraph, "\n\n"
+            continue
+        for sentence in _SENTENCE_SPLIT.split(paragraph):
+            if count_tokens(sentence) <= max_tokens:
+                yield sentence, " "
+                continue
+            max_chars = max_tokens * CHARS_PER_TOKEN
+            words, size = [], 0
+            for word in sentence.split():
+                if words and size + len(word) + 1 > max_chars:
+                    yield " ".join(words), " "
+                    words, size = [], 0
+                words.append(word)
+                size += len(word) + 1
+            if words:
+                yield " ".join(words), " "
+
+
+def split_into_chunks(text, max_tokens):
+    """Greedily pack paragraphs/sentences into chunks of at most max_tokens"""
+    chunks, current, size = [], [], 0
+    for piece, separator in _pieces(text, max_tokens):
+        piece_tokens = count_tokens(piece + separator)
+        if current and size + piece_tokens > max_tokens:
+            chunks.append("".join(current).strip())
+            current, size = [], 0
+        current.append(piece + separator)
+        size += piece_tokens
+    if current:
+        chunks.append("".join(current).strip())
+    return chunks
+
+
+def fit_to_budget(text, max_tokens):
+    """Leading part of text that fits max_tokens, cut on a sentence boundary"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    chunks = split_into_chunks(text, max_tokens)
+    return chunks[0] if chunks else ""
@@ -1,9 +1,72 @@
 # app/utils/file_handler.py
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from PyPDF2 import PdfReader
+from app.config import settings
+from app.utils.preprocess import PAGE_BREAK
+
+PDF_WORKERS = settings.pdf_workers
+
+_executor = None
+
+
+class PdfError(Exception):
+    pass
+
+
+class PdfTooLarge(PdfError):
+    pass
+
 
 def extract_text_from_pdf(file):
     reader = PdfReader(file)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text()
-    return text.strip()
+    return PAGE_BREAK.join(page.extract_text() or "" for page in reader.pages).strip()
+
+
+def _count_pages(path):
+    return len(PdfReader(path).pages)
+
+
+def _extract_page_range(path, start, stop):
+    # Runs in a worker process; each one opens its own reader
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+
+
+async def extract_text_from_pdf_path(path, max_pages):
+    """Extract a PDF on disk across the process pool, returning (text, page_count)"""
+    loop = asyncio.get_running_loop()
+    try:
+        page_count = await loop.run_in_executor(get_executor(), _count_pages, path)
+    except Exception as e:
+        raise PdfError(f"Could not read PDF: {e}")
+    if page_count > max_pages:
+        raise PdfTooLarge(f"PDF has {page_count} pages, limit is {max_pages}")
+
+    # A few batches per worker keeps the pool busy without re-parsing the file per page
+    batch = max(1, -(-page_count // (PDF_WORKERS * 2)))
+    ranges = [(start, min(start + batch, page_count)) for start in range(0, page_count, batch)]
+    try:
+        batches = await asyncio.gather(*[
+            loop.run_in_executor(get_executor(), _extract_page_range, path, start, stop)
+            for start, stop in ranges
+        ])
+    except Exception as e:
+        raise PdfError(f"Could not extract text: {e}")
+    # Pages stay marked so preprocessing can spot their headers and footers
+    text = PAGE_BREAK.join(page for pages in batches for page in pages if page.strip())
+    return text.strip(), page_count
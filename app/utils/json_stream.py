@@ -0,0 +1,107 @@
+# app/utils/json_stream.py - pull JSON objects out of a streamed array
+import json
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+class JsonArrayStream:
+    """Incrementally scan model output for objects inside a JSON array.
+
+    feed() takes arbitrary text chunks and returns every object that closed
+    within them, so callers can emit each quiz question or flashcard as soon
+    as the model finishes writing it. Prose and ``` fences around the array
+    are skipped because scanning only starts at the first '[', and brackets
+    are balanced rather than matched greedily, so a stray ']' in trailing
+    prose can't swallow the answer. close() recovers the object the model
+    was writing when max_tokens cut it off, where that is possible.
+    """
+
+    def __init__(self):
+        self._in_array = False
+        self._stack = []         # open brackets inside the current top-level object
+        self._in_string = False
+        self._escaped = False
+        self._buffer = []        # characters of the object being read
+        self._commas = []        # (buffer length, open brackets) at each comma, for close()
+
+    def feed(self, chunk):
+        objects = []
+        for char in chunk:
+            if not self._stack:
+                if not self._in_array:
+                    if char == "[":
+                        self._in_array = True
+                elif char == "{":
+                    self._stack = ["{"]
+                    self._buffer = [char]
+                    self._commas = []
+                elif char == "]":
+                    self._in_array = False
+                continue
+
+            self._buffer.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append(char)
+            elif char in "}]":
+                self._stack.pop()
+                if not self._stack:
+                    obj = _loads("".join(self._buffer))
+                    if obj is not None:
+                        objects.append(obj)
+                    self._buffer = []
+            elif char == ",":
+                self._commas.append((len(self._buffer) - 1, list(self._stack)))
+        return objects
+
+    def close(self):
+        """Return the truncated object in progress, repaired, or None.
+
+        The object is closed as-is if the cut fell between values; otherwise
+        it is rolled back to the last complete member before closing. A
+        repaired object may be missing fields, so callers must validate it.
+        """
+        if not self._stack:
+            return None
+        candidates = []
+        if not self._in_string:
+            candidates.append((len(self._buffer), self._stack))
+        candidates.extend(reversed(self._commas))
+
+        obj = None
+        for end, stack in candidates:
+            text = "".join(self._buffer[:end]) + "".join(_CLOSERS[c] for c in reversed(stack))
+            obj = _loads(text)
+            if obj is not None:
+                break
+        self._stack = []
+        self._buffer = []
+        self._in_string = self._escaped = False
+        return obj
+
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def extract_json_objects(text):
+    """Every object in the JSON array in a complete (possibly truncated) completion"""
+    parser = JsonArrayStream()
+    objects = parser.feed(text)
+    tail = parser.close()
+    if tail is not None:
+        objects.append(tail)
+    return objects
@@ -0,0 +1,121 @@
+# app/utils/preprocess.py - strip what costs tokens but carries no content from notes
+import re
+import unicodedata
+from collections import Counter
+
+# extract_text_from_pdf separates pages with this, so headers and footers can be found
+PAGE_BREAK = "\f"
+
+# Ligatures and invisible characters PDF extraction leaves behind. NFKC would
+# fold these too, but it also turns x² into x2.
+_TRANSLATE = str.maketrans({
+    "\ufb00": "ff", "\ufb01": "fi", "\ufb02": "fl", "\ufb03": "ffi", "\ufb04": "ffl",
+    "\u00a0": " ", "\u2002": " ", "\u2003": " ", "\u2009": " ", "\u202f": " ",
+    # Soft hyphen, zero-width space / non-joiner / joiner, byte order mark
+    "\u00ad": None, "\u200b": None, "\u200c": None, "\u200d": None, "\ufeff": None,
+})
+_CONTROL = re.compile(r"[\x00-\x08\x0b\x0e-\x1f\x7f]")
+# "exam-\nple" from a line-end hyphenation; "Type-\nA" (capital after) is left alone
+_HYPHENATED = re.compile(r"(\w+)-\n[ \t]*([a-z]\w*)")
+_WORD = re.compile(r"\w+(?:-\w+)*")
+_SPACES = re.compile(r"[ \t\r\v]+")
+_PAGE_NUMBER = re.compile(r"^[-–—\s]*(?:page\s*)?\d{1,4}(?:\s*(?:/|of)\s*\d{1,4})?[-–—\s]*$", re.IGNORECASE)
+_BOILERPLATE = re.compile(
+    r"^(?:©|\(c\)\s|copyright\b|all rights reserved|this page (?:is )?intentionally left blank|"
+    r"downloaded (?:from|by)\b|printed (?:on|from)\b|confidential\b)",
+    re.IGNORECASE
+)
+_DIGITS = re.compile(r"\d+")
+
+# A line must repeat at a page edge on this share of pages to count as a header/footer
+HEADER_FOOTER_SHARE = 0.5
+MIN_PAGES_FOR_HEADERS = 3
+EDGE_LINES = 2
+MAX_BOILERPLATE_WORDS = 15
+# Shorter lines ("Example:", "- Yes") legitimately repeat
+MIN_DUPLICATE_WORDS = 4
+# First halves that make "well-\nknown" a compound broken at its hyphen, not a split word
+COMPOUND_PREFIXES = frozenset({
+    "all", "cross", "ex", "far", "full", "half", "high", "long", "low", "non", "self", "short", "so", "well",
+})
+
+
+def _line_key(line):
+    """Headers differ only by page number, so digits don't count"""
+    return _DIGITS.sub("#", line.casefold())
+
+
+def _header_footer_keys(pages):
+    """Keys of lines repeated at the top or bottom of most pages"""
+    if len(pages) < MIN_PAGES_FOR_HEADERS:
+        return set()
+    counts = Counter()
+    for lines in pages:
+        lines = [line for line in lines if line]
+        counts.update({_line_key(line) for line in lines[:EDGE_LINES] + lines[-EDGE_LINES:]})
+    needed = max(MIN_PAGES_FOR_HEADERS, len(pages) * HEADER_FOOTER_SHARE)
+    return {key for key, count in counts.items() if count >= needed}
+
+
+def _dehyphenate(text, from_pdf):
+    """Rejoin words split across lines, keeping compounds such as well-known.
+
+    The notes themselves are the dictionary: "exam-\nple" is joined when
+    "example" appears elsewhere, and kept hyphenated when "exam-ple" does.
+    Otherwise only extracted PDF text, where line-end hyphens are the
+    layout's doing, is joined; pasted notes are left as they were.
+    """
+    if "-\n" not in text:
+        return text
+    words = {word.casefold() for word in _WORD.findall(text)}
+
+    def join(match):
+        first, second = match.group(1), match.group(2)
+        if f"{first}-{second}".casefold() in words or first.casefold() in COMPOUND_PREFIXES:
+            return f"{first}-{second}" if from_pdf else match.group(0)
+        if (first + second).casefold() in words or from_pdf:
+            return first + second
+        return match.group(0)
+
+    return _HYPHENATED.sub(join, text)
+
+
+def clean_notes(text):
+    """text with formatting noise removed and its wording untouched.
+
+    Normalizes Unicode and whitespace, rejoins words hyphenated across
+    lines, and drops boilerplate lines such as copyright notices and
+    repeated lines. Text from a PDF (pages separated by PAGE_BREAK) also
+    loses repeated page headers/footers and page numbers at page edges;
+    a number on a line of its own elsewhere may be a fact, so it stays.
+    Paragraph breaks are kept for chunking.
+    """
+    text = unicodedata.normalize("NFC", text).translate(_TRANSLATE)
+    text = _CONTROL.sub("", text.replace("\r\n", "\n"))
+    from_pdf = PAGE_BREAK in text
+    text = _dehyphenate(text, from_pdf)
+
+    pages = [[_SPACES.sub(" ", line).strip() for line in page.split("\n")] for page in text.split(PAGE_BREAK)]
+    headers = _header_footer_keys(pages)
+    seen = set()
+    kept = []
+    for lines in pages:
+        content = [i for i, line in enumerate(lines) if line]
+        edges = {content[0], content[-1]} if from_pdf and content else set()
+        for i, line in enumerate(lines):
+            if not line:
+                kept.append("")
+                continue
+            key = _line_key(line)
+            if key in headers or (i in edges and _PAGE_NUMBER.match(line)):
+                continue
+            words = len(line.split())
+            if words <= MAX_BOILERPLATE_WORDS and _BOILERPLATE.match(line):
+                continue
+            if words >= MIN_DUPLICATE_WORDS:
+                if line.casefold() in seen:
+                    continue
+                seen.add(line.casefold())
+            kept.append(line)
+        kept.append("")
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
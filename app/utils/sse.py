@@ -0,0 +1,26 @@
+# app/utils/sse.py - Server-Sent Events helpers
+import json
+from fastapi.responses import StreamingResponse
+from app.services.rate_limiter import RateLimitExceeded
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    """Wrap an async iterator of (event, data) pairs in a text/event-stream response"""
+    async def body():
+        try:
+            async for event, data in events:
+                yield format_sse(event, data)
+        except RateLimitExceeded as e:
+            # Headers are already sent, so report it in-band
+            yield format_sse("error", {"detail": str(e), "retry_after": round(e.retry_after)})
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        # Stop proxies (nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
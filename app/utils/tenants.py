@@ -0,0 +1,17 @@
+# app/utils/tenants.py - who a request is from, for per-tenant fairness and limits
+from app.config import settings
+
+
+def tenant_for(request):
+    """X-Tenant-ID when a trusted gateway set it, else the client address.
+
+    The header is only as trustworthy as whoever sent it, so it counts
+    only from TRUSTED_TENANT_PROXIES; anyone else could dodge their limits
+    by changing it.
+    """
+    host = request.client.host if request.client else None
+    if host is not None and host in settings.trusted_tenant_proxies:
+        tenant = request.headers.get("X-Tenant-ID")
+        if tenant:
+            return tenant
+    return host or "anonymous"
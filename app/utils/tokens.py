@@ -0,0 +1,59 @@
+# app/utils/tokens.py - token counts for input budgets and reporting
+import asyncio
+import logging
+import math
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Rough English average, used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+# Tokenizing takes a couple of milliseconds per 10k characters; past this it runs off the event loop
+INLINE_TOKENIZE_CHARS = 20_000
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Loaded once at startup by load_encoding(); until then counts are estimated
+_encoding = None
+
+
+def load_encoding():
+    """Load the tiktoken encoding named by TOKENIZER_ENCODING; None to estimate from length.
+
+    Blocking - the first load downloads the vocabulary - so the app calls
+    it off the event loop in its lifespan hook.
+    """
+    global _encoding
+    name = settings.tokenizer_encoding
+    if _encoding is not None or name.lower() == "none":
+        return _encoding
+    if tiktoken is None:
+        logger.warning("tiktoken not installed, estimating tokens from length")
+        return None
+    try:
+        _encoding = tiktoken.get_encoding(name)
+    except Exception as e:
+        # e.g. offline with no cached vocabulary
+        logger.warning("Tokenizer %s unavailable, estimating tokens from length: %s", name, e)
+    return _encoding
+
+
+def count_tokens(text):
+    """Tokens in text: exact-ish with tiktoken installed, else len / CHARS_PER_TOKEN.
+
+    OpenRouter's free models each have their own vocabulary, so even the
+    tiktoken count is an approximation; it is just a much closer one.
+    """
+    if _encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(_encoding.encode_ordinary(text))
+
+
+async def off_loop(func, text, *args):
+    """func(text, *args), in a worker thread when text is long enough to stall the event loop"""
+    if len(text) > INLINE_TOKENIZE_CHARS:
+        return await asyncio.to_thread(func, text, *args)
+    return func(text, *args)
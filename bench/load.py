@@ -0,0 +1,354 @@
+# bench/load.py - scripted load scenarios against a running StudyBuddy API
+"""Drives a scenario with N concurrent clients and reports throughput,
+p50/p95/p99 latency per endpoint and the server's event-loop lag.
+
+Against a server you started yourself (pointed at bench/mock_openrouter.py):
+
+    python -m bench.load --base-url http://127.0.0.1:8000 --scenario mixed -c 20 -d 30
+
+Or let it start the mock and the app, run, and stop them again:
+
+    python -m bench.load --spawn --scenario mixed --mock-args "--rate-429 0.05 --rate-malformed 0.1"
+
+--json saves the results; --baseline compares against a saved run, which is
+how to catch a latency regression before deploying. Each worker sends its own
+X-Tenant-ID; a server you start yourself needs TRUSTED_TENANT_PROXIES=127.0.0.1
+for admission control to tell them apart.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+import httpx
+
+LAG_METRIC = "studybuddy_event_loop_lag_seconds"
+FALLBACK_METRIC = "studybuddy_fallbacks_total"
+
+VOCABULARY = (
+    "photosynthesis chlorophyll mitochondria enzyme protein membrane osmosis diffusion "
+    "algorithm recursion complexity database network protocol encryption compiler "
+    "revolution empire treaty parliament economy inflation currency migration "
+    "equation derivative integral matrix vector probability statistics hypothesis"
+).split()
+
+
+class Endpoint:
+    def __init__(self, name, path, stream=False):
+        self.name = name
+        self.path = path
+        self.stream = stream
+
+
+ENDPOINTS = {
+    "summarize": Endpoint("summarize", "/api/summarize"),
+    "quiz": Endpoint("quiz", "/api/generate-quiz"),
+    "flashcards": Endpoint("flashcards", "/api/generate-flashcards"),
+    "study-pack": Endpoint("study-pack", "/api/study-pack?stream=false"),
+    "summarize-stream": Endpoint("summarize-stream", "/api/summarize/stream", stream=True),
+    "quiz-stream": Endpoint("quiz-stream", "/api/generate-quiz/stream", stream=True)
+}
+
+# name: ({endpoint: weight}, fraction of requests that reuse earlier notes)
+SCENARIOS = {
+    "summarize": ({"summarize": 1}, 0.0),
+    "quiz": ({"quiz": 1}, 0.0),
+    "flashcards": ({"flashcards": 1}, 0.0),
+    "stream": ({"summarize-stream": 1, "quiz-stream": 1}, 0.0),
+    "mixed": ({"summarize": 3, "quiz": 2, "flashcards": 2, "summarize-stream": 2, "study-pack": 1}, 0.0),
+    "cache": ({"summarize": 1, "quiz": 1, "flashcards": 1}, 0.9)
+}
+
+
+def make_notes(rng, words=300):
+    sentences = []
+    while sum(len(sentence.split()) for sentence in sentences) < words:
+        sentences.append(" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(8, 16))).capitalize() + ".")
+    return " ".join(sentences)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.first_byte = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def record(self, name, status, latency, first_byte=None):
+        self.statuses[name][status] += 1
+        if status == 200:
+            self.latencies[name].append(latency)
+            if first_byte is not None:
+                self.first_byte[name].append(first_byte)
+
+    def summary(self, elapsed):
+        report = {}
+        for name, statuses in sorted(self.statuses.items()):
+            latencies = self.latencies[name]
+            report[name] = {
+                "requests": sum(statuses.values()),
+                "ok": statuses.get(200, 0),
+                "statuses": {str(status): count for status, count in statuses.items()},
+                "throughput_rps": round(statuses.get(200, 0) / elapsed, 2),
+                **{f"p{q}_ms": _ms(percentile(latencies, q)) for q in (50, 95, 99)},
+                "max_ms": _ms(max(latencies) if latencies else None)
+            }
+            if self.first_byte[name]:
+                report[name]["first_byte_p50_ms"] = _ms(percentile(self.first_byte[name], 50))
+                report[name]["first_byte_p95_ms"] = _ms(percentile(self.first_byte[name], 95))
+        return report
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+async def _request(client, endpoint, notes, results, headers):
+    started = time.monotonic()
+    first_byte = None
+    try:
+        if endpoint.stream:
+            async with client.stream("POST", endpoint.path, json={"notes": notes}, headers=headers) as response:
+                async for _ in response.aiter_bytes():
+                    if first_byte is None:
+                        first_byte = time.monotonic() - started
+                status = response.status_code
+        else:
+            response = await client.post(endpoint.path, json={"notes": notes}, headers=headers)
+            status = response.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    results.record(endpoint.name, status, time.monotonic() - started, first_byte)
+
+
+async def _worker(client, scenario, deadline, remaining, results, rng, seen_notes, tenant):
+    # Each worker is its own client to admission control, as separate users would be;
+    # the server only honours the header from TRUSTED_TENANT_PROXIES (set by --spawn)
+    headers = {"X-Tenant-ID": tenant}
+    weights, repeat_ratio = SCENARIOS[scenario]
+    names, counts = list(weights), list(weights.values())
+    while time.monotonic() < deadline and remaining[0] != 0:
+        remaining[0] -= 1
+        if seen_notes and rng.random() < repeat_ratio:
+            notes = rng.choice(seen_notes)
+        else:
+            notes = make_notes(rng)
+            seen_notes.append(notes)
+        await _request(client, ENDPOINTS[rng.choices(names, counts)[0]], notes, results, headers)
+
+
+def parse_metrics(text):
+    """{(name, labels): value} from Prometheus text output"""
+    samples = {}
+    for line in text.splitlines():
+        match = re.match(r"^([a-zA-Z_:][\w:]*)(\{[^}]*\})?\s+(\S+)$", line)
+        if match:
+            samples[(match.group(1), match.group(2) or "")] = float(match.group(3))
+    return samples
+
+
+def _delta(before, after, name):
+    return {labels: value - before.get((metric, labels), 0.0) for (metric, labels), value in after.items() if metric == name}
+
+
+def lag_summary(before, after):
+    """Event-loop lag over the run, estimated from histogram buckets as upper bounds"""
+    buckets = sorted(
+        (float(re.search(r'le="([^"]+)"', labels).group(1)), count)
+        for labels, count in _delta(before, after, f"{LAG_METRIC}_bucket").items()
+    )
+    total = sum(_delta(before, after, f"{LAG_METRIC}_count").values())
+    if not total:
+        return None
+
+    def upper_bound(q):
+        for bound, cumulative in buckets:
+            if cumulative >= q * total:
+                return bound
+        return float("inf")
+
+    seconds = sum(_delta(before, after, f"{LAG_METRIC}_sum").values())
+    return {
+        "samples": int(total),
+        "mean_ms": _ms(seconds / total),
+        **{f"p{round(q * 100)}_ms_at_most": _ms(upper_bound(q)) for q in (0.5, 0.95, 0.99)}
+    }
+
+
+async def _scrape(client):
+    try:
+        response = await client.get("/metrics")
+        return parse_metrics(response.text) if response.status_code == 200 else {}
+    except httpx.HTTPError:
+        return {}
+
+
+async def run(base_url, scenario, concurrency, duration, total, seed):
+    rng = random.Random(seed)
+    results = Results()
+    remaining = [total or -1]
+    seen_notes = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        before = await _scrape(client)
+        started = time.monotonic()
+        await asyncio.gather(*[
+            _worker(client, scenario, started + duration, remaining, results, random.Random(rng.random()), seen_notes, f"bench-{i}")
+            for i in range(concurrency)
+        ])
+        elapsed = time.monotonic() - started
+        after = await _scrape(client)
+
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 2),
+        "endpoints": results.summary(elapsed),
+        "event_loop_lag": lag_summary(before, after),
+        "fallbacks": {labels: value for labels, value in _delta(before, after, FALLBACK_METRIC).items() if value}
+    }
+
+
+def print_report(report, baseline=None):
+    print(f"\nScenario {report['scenario']}: {report['concurrency']} clients, {report['elapsed_seconds']}s")
+    print(f"{'endpoint':<18}{'ok/total':>10}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  statuses")
+    for name, row in report["endpoints"].items():
+        print(
+            f"{name:<18}{row['ok']:>5}/{row['requests']:<4}{row['throughput_rps']:>8}"
+            f"{_fmt(row['p50_ms']):>9}{_fmt(row['p95_ms']):>9}{_fmt(row['p99_ms']):>9}{_fmt(row['max_ms']):>9}  {row['statuses']}"
+        )
+        if "first_byte_p50_ms" in row:
+            print(f"{'':<18}first byte p50 {_fmt(row['first_byte_p50_ms'])}, p95 {_fmt(row['first_byte_p95_ms'])}")
+        if baseline and name in baseline["endpoints"]:
+            print(f"{'':<18}vs baseline: " + ", ".join(
+                f"{key[:-3]} {_change(baseline['endpoints'][name][key], row[key])}" for key in ("p50_ms", "p95_ms", "p99_ms")
+            ) + f", rps {_change(baseline['endpoints'][name]['throughput_rps'], row['throughput_rps'])}")
+    lag = report["event_loop_lag"]
+    if lag:
+        print(f"Event-loop lag: mean {lag['mean_ms']}ms, p50 <= {lag['p50_ms_at_most']}ms, "
+              f"p95 <= {lag['p95_ms_at_most']}ms, p99 <= {lag['p99_ms_at_most']}ms ({lag['samples']} samples)")
+    else:
+        print("Event-loop lag: not available (is /metrics reachable?)")
+    if report["fallbacks"]:
+        print(f"Fallbacks served: {report['fallbacks']}")
+
+
+def _fmt(ms):
+    return "-" if ms is None else f"{ms:.0f}ms"
+
+
+def _change(old, new):
+    if not old or new is None:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.0f}%"
+
+
+class Spawned:
+    """The mock and the app as subprocesses, wired together, for one run"""
+
+    def __init__(self, app_port, mock_port, mock_args):
+        self.app_url = f"http://127.0.0.1:{app_port}"
+        self.mock_url = f"http://127.0.0.1:{mock_port}"
+        self.workdir = tempfile.mkdtemp(prefix="studybuddy-bench-")
+        env = {
+            **os.environ,
+            "OPENROUTER_BASE_URL": f"{self.mock_url}/api/v1",
+            "OPENROUTER_API_KEY": "sk-or-v1-bench",
+            # The mock has no quota; keep our own limiter out of the measurement
+            "OPENROUTER_RPM": "1000000",
+            "OPENROUTER_DAILY_QUOTA": "1000000000",
+            "MODEL_CATALOG_PATH": os.path.join(self.workdir, "model_catalog.json"),
+            # Every worker connects from 127.0.0.1; trust their X-Tenant-ID so the
+            # per-client admission cap doesn't lump them into one client
+            "TRUSTED_TENANT_PROXIES": "127.0.0.1",
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING")
+        }
+        env.pop("RESPONSE_CACHE_DB", None)
+        env.pop("RATE_LIMIT_DB", None)
+        self.processes = [
+            subprocess.Popen([sys.executable, "-m", "bench.mock_openrouter", "--port", str(mock_port), *mock_args], env=env),
+            subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"], env=env
+            )
+        ]
+
+    async def wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(timeout=2) as client:
+            for url in (f"{self.mock_url}/api/v1/models", f"{self.app_url}/health"):
+                while True:
+                    try:
+                        if (await client.get(url)).status_code == 200:
+                            break
+                    except httpx.HTTPError:
+                        pass
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"{url} did not come up within {timeout}s")
+                    await asyncio.sleep(0.2)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+async def _main(args):
+    spawned = None
+    base_url = args.base_url
+    if args.spawn:
+        spawned = Spawned(args.app_port, args.mock_port, shlex.split(args.mock_args))
+        base_url = spawned.app_url
+    try:
+        if spawned:
+            await spawned.wait_ready()
+        report = await run(base_url, args.scenario, args.concurrency, args.duration, args.requests, args.seed)
+    finally:
+        if spawned:
+            spawned.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the StudyBuddy API")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("-c", "--concurrency", type=int, default=10)
+    parser.add_argument("-d", "--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("-n", "--requests", type=int, help="stop after this many requests")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="start the mock and the app as subprocesses")
+    parser.add_argument("--app-port", type=int, default=8100)
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--mock-args", default="", help="extra bench.mock_openrouter arguments with --spawn")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against results saved with --json")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
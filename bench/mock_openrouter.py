@@ -0,0 +1,215 @@
+# bench/mock_openrouter.py - a local stand-in for OpenRouter's API
+"""Serves /api/v1/models and /api/v1/chat/completions (plain and streamed)
+with configurable latency, 429/503 injection and malformed output, so load
+tests exercise dispatch, hedging, circuit breakers and parsing without
+spending quota.
+
+    python -m bench.mock_openrouter --port 9100 --latency-ms 800 --rate-429 0.05
+    OPENROUTER_BASE_URL=http://127.0.0.1:9100/api/v1 uvicorn main:app
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import uuid
+from collections import Counter
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from app.services.model_dispatch import PREFERRED_MODELS
+
+MODELS_ETAG = '"mock-models-1"'
+
+
+class MockConfig:
+    """Knobs for one mock run; latency is lognormal around latency_ms"""
+
+    def __init__(self, latency_ms=800, latency_sigma=0.5, token_delay_ms=15, rate_429=0.0,
+                 rate_503=0.0, rate_malformed=0.0, structured_outputs=True, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.token_delay_ms = token_delay_ms
+        self.rate_429 = rate_429
+        self.rate_503 = rate_503
+        self.rate_malformed = rate_malformed
+        self.structured_outputs = structured_outputs
+        self.random = random.Random(seed)
+
+    def latency(self):
+        """Seconds before the response (or the first streamed token)"""
+        if self.latency_ms <= 0:
+            return 0.0
+        return self.random.lognormvariate(math.log(self.latency_ms / 1000), self.latency_sigma)
+
+    def outcome(self):
+        """"429", "503", "malformed" or "ok" for one request"""
+        roll = self.random.random()
+        for outcome, rate in (("429", self.rate_429), ("503", self.rate_503), ("malformed", self.rate_malformed)):
+            if roll < rate:
+                return outcome
+            roll -= rate
+        return "ok"
+
+
+config = MockConfig()
+stats = Counter()
+app = FastAPI(title="Mock OpenRouter")
+
+
+def _words(prompt):
+    words = re.findall(r"[A-Za-z]{4,}", prompt)
+    return words or ["topic"]
+
+
+def _task(payload, prompt):
+    schema_name = ((payload.get("response_format") or {}).get("json_schema") or {}).get("name")
+    if schema_name:
+        return schema_name
+    if "multiple choice" in prompt:
+        return "quiz"
+    if "flashcards" in prompt:
+        return "flashcards"
+    return "summary"
+
+
+def _content(payload, prompt):
+    """Plausible output for the prompt: a JSON array for quiz/flashcards, prose otherwise"""
+    words = _words(prompt)
+    pick = config.random.choice
+    task = _task(payload, prompt)
+    if task == "quiz":
+        items = []
+        for _ in range(3):
+            # QuizItem rejects an answer that isn't one of the options
+            options = [pick(words) for _ in range(4)]
+            items.append({"question": f"What is {pick(words)}?", "options": options, "answer": pick(options)})
+        key = "questions"
+    elif task == "flashcards":
+        items = [{"question": f"Define {pick(words)}.", "answer": " ".join(pick(words) for _ in range(8))} for _ in range(4)]
+        key = "flashcards"
+    else:
+        return " ".join(
+            f"{pick(words).capitalize()} relates to {pick(words)} and {pick(words)}." for _ in range(12)
+        )
+    return json.dumps({key: items} if payload.get("response_format") else items)
+
+
+def _malformed(text):
+    """Truncated output half the time (recoverable), chatty non-JSON otherwise"""
+    if config.random.random() < 0.5:
+        return text[:max(1, int(len(text) * config.random.uniform(0.3, 0.9)))]
+    return "Sure! Here is what you asked for, I hope it helps."
+
+
+def _usage(prompt, text):
+    prompt_tokens, completion_tokens = len(prompt) // 4, len(text) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _error(status_code):
+    headers = {"Retry-After": "1"} if status_code == 429 else {}
+    message = "Rate limit exceeded" if status_code == 429 else "Provider returned error"
+    return JSONResponse({"error": {"code": status_code, "message": message}}, status_code=status_code, headers=headers)
+
+
+@app.get("/api/v1/models")
+async def list_models(request: Request):
+    stats["models"] += 1
+    if request.headers.get("If-None-Match") == MODELS_ETAG:
+        return Response(status_code=304, headers={"ETag": MODELS_ETAG})
+    parameters = ["max_tokens", "temperature"] + (["structured_outputs", "response_format"] if config.structured_outputs else [])
+    models = [
+        {
+            "id": model,
+            "context_length": 32768,
+            "pricing": {"prompt": "0", "completion": "0"},
+            "supported_parameters": parameters
+        }
+        for model in PREFERRED_MODELS
+    ]
+    return JSONResponse({"data": models}, headers={"ETag": MODELS_ETAG})
+
+
+@app.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    prompt = "".join(message.get("content") or "" for message in payload.get("messages", []))
+    outcome = config.outcome()
+    stats[outcome] += 1
+
+    await asyncio.sleep(config.latency())
+    if outcome in ("429", "503"):
+        return _error(int(outcome))
+
+    text = _content(payload, prompt)
+    if outcome == "malformed":
+        text = _malformed(text)
+    if payload.get("stream"):
+        return StreamingResponse(_stream(payload["model"], prompt, text), media_type="text/event-stream")
+
+    await asyncio.sleep(config.token_delay_ms / 1000 * len(text) / 4)
+    return {
+        "id": f"gen-{uuid.uuid4().hex}",
+        "model": payload["model"],
+        "created": int(time.time()),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": _usage(prompt, text)
+    }
+
+
+async def _stream(model, prompt, text):
+    generation_id = f"gen-{uuid.uuid4().hex}"
+    # Roughly word-sized deltas, the way providers tend to send them
+    for piece in re.findall(r"\S+\s*|\s+", text):
+        chunk = {"id": generation_id, "model": model, "choices": [{"index": 0, "delta": {"content": piece}}]}
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(config.token_delay_ms / 1000)
+    final = {
+        "id": generation_id,
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        "usage": _usage(prompt, text)
+    }
+    yield f"data: {json.dumps(final)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    """Injected outcomes so far, to check a run did what was asked"""
+    return dict(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenRouter server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=800, help="median time to response or first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal spread; 0 for a fixed latency")
+    parser.add_argument("--token-delay-ms", type=float, default=15, help="delay between streamed tokens")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of completions answered with 429")
+    parser.add_argument("--rate-503", type=float, default=0.0, help="fraction of completions answered with 503")
+    parser.add_argument("--rate-malformed", type=float, default=0.0, help="fraction with truncated or non-JSON output")
+    parser.add_argument("--no-structured-outputs", action="store_true", help="list models without structured_outputs")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    global config
+    config = MockConfig(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        token_delay_ms=args.token_delay_ms,
+        rate_429=args.rate_429,
+        rate_503=args.rate_503,
+        rate_malformed=args.rate_malformed,
+        structured_outputs=not args.no_structured_outputs,
+        seed=args.seed
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
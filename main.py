@@ -1,20 +1,74 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import summarizer, quiz, flashcards
-import os
-import requests
+from app.config import settings, DOTENV_AVAILABLE
+from app.middleware.admission import AdmissionMiddleware
+from app.middleware.body_limit import BodyLimitMiddleware
+from app.middleware.deadline import DeadlineMiddleware
+from app.middleware.metrics import MetricsMiddleware
+from app.routes import summarizer, quiz, flashcards, study_pack, jobs, upload, batch
+from app.services.llm_client import post_chat_completion, close_client, warm_up
+from app.services.generation import engine, generation_stats
+from app.services.model_catalog import catalog
+from app.services.model_dispatch import candidate_models
+from app.services.model_health import registry as model_health
+from app.services.response_cache import response_cache
+from app.services.job_queue import job_queue
+from app.services.metrics import metrics, watch_event_loop_lag
+from app.services.rate_limiter import rate_limiter, RateLimitExceeded
+from app.services.admission import admission
+from app.utils.file_handler import shutdown_executor
+from app.utils.tokens import load_encoding
+from app.utils.logging_config import setup_logging
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+import httpx
 
-# Load environment variables from .env file
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-    print("✅ Loaded .env file")
-except ImportError:
-    print("⚠️  python-dotenv not installed. Install with: pip install python-dotenv")
-    print("⚠️  Or set environment variables manually")
+setup_logging()
+logger = logging.getLogger("studybuddy")
 
-app = FastAPI(title="StudyBuddy API", version="2.0.0")
+if not DOTENV_AVAILABLE:
+    logger.warning("python-dotenv not installed - pip install python-dotenv or set environment variables manually")
 
+
+@asynccontextmanager
+async def lifespan(app):
+    # Pay for the first connection, model listing and cache load before
+    # serving, rather than on the first user's request
+    lag_monitor = asyncio.create_task(watch_event_loop_lag())
+    _, _, warmed, _ = await asyncio.gather(
+        catalog.ensure_loaded(settings.openrouter_api_key),
+        warm_up(settings.warm_connections),
+        response_cache.warm(settings.response_cache_warm_entries),
+        asyncio.to_thread(load_encoding)
+    )
+    catalog.start(settings.openrouter_api_key)
+    if warmed:
+        logger.info("Warmed response cache with %d entries", warmed)
+    for problem in settings.shared_state_problems():
+        logger.warning("WEB_CONCURRENCY=%d but %s", settings.workers, problem)
+
+    yield
+
+    # On SIGTERM uvicorn stops accepting and waits for open requests first;
+    # what's left here is background work that has no request to wait on
+    lag_monitor.cancel()
+    await catalog.stop()
+    await job_queue.drain(timeout=settings.graceful_shutdown_seconds)
+    await job_queue.close()
+    if not await engine.drain(timeout=settings.graceful_shutdown_seconds):
+        logger.warning("Shutting down with %d generations still running", engine.in_flight)
+    await close_client()
+    shutdown_executor()
+
+
+app = FastAPI(title="StudyBuddy API", version="2.0.0", lifespan=lifespan)
+
+# Added first so they run innermost: CORS headers still go on their 503s and 413s,
+# and an oversized upload is refused before it waits for an admission slot
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(BodyLimitMiddleware)
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -23,6 +77,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    # Reject early rather than burning upstream attempts that would 429 anyway
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "OpenRouter quota exhausted, please retry later", "retry_after": round(exc.retry_after)},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))}
+    )
 
 # Debug router
 debug_router = APIRouter()
@@ -30,8 +95,8 @@ debug_router = APIRouter()
 @debug_router.get("/env")
 async def check_environment():
     """Check if environment variables are set"""
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    print(f"API Key from environment: {api_key}")  # This will show in server logs
+    api_key = settings.openrouter_api_key
+    logger.info("OPENROUTER_API_KEY is %s", "set" if api_key else "not set")
     return {
         "api_key_set": api_key is not None,
         "api_key_length": len(api_key) if api_key else 0,
@@ -43,42 +108,31 @@ async def check_environment():
 @debug_router.post("/test-api-quick")
 async def test_openrouter_api_quick():
     """Quick test with current working free models"""
-    api_key = os.getenv("OPENROUTER_API_KEY")
+    api_key = settings.openrouter_api_key
     
     if not api_key:
         return {"error": "API key not found in environment variables."}
     
-    # Test with most reliable free model
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "http://localhost:8000",
-        "X-Title": "StudyBuddy App"
-    }
-
+    # Test with the most preferred free model
+    model = candidate_models()[0]
     payload = {
-        "model": "deepseek/deepseek-r1:free",
+        "model": model,
         "messages": [{"role": "user", "content": "Say 'API test successful!'"}],
         "max_tokens": 20
     }
 
     try:
-        print("📡 Testing with DeepSeek R1 (most reliable free model)...")
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions", 
-            json=payload, 
-            headers=headers,
-            timeout=15
-        )
+        logger.info("Testing with %s", model)
+        response = await post_chat_completion(payload, api_key, timeout=15)
         
-        print(f"📊 Response status: {response.status_code}")
+        logger.info("Response status: %s", response.status_code)
         
         if response.status_code == 200:
             data = response.json()
             return {
                 "status": "✅ SUCCESS",
                 "status_code": response.status_code,
-                "model_used": "deepseek/deepseek-r1:free",
+                "model_used": model,
                 "response": data.get("choices", [{}])[0].get("message", {}).get("content", "No content"),
                 "message": "API is working correctly!"
             }
@@ -102,59 +156,26 @@ async def test_openrouter_api_quick():
 
 @debug_router.get("/list-free-models")
 async def list_current_free_models():
-    """Get current list of free models"""
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    
-    if not api_key:
-        return {"error": "API key not found"}
-    
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
+    """Get current list of free models, from the cached model catalog"""
+    if not catalog.loaded:
+        return {"status": "error", "error": "Model catalog not loaded yet", "catalog": catalog.stats()}
+
+    free_models = [
+        {
+            "id": model_id,
+            "name": catalog.get(model_id).get("name", "Unknown"),
+            "context_length": catalog.context_length(model_id) or "Unknown"
+        }
+        for model_id in catalog.free_models()
+    ]
+    return {
+        "status": "success",
+        "total_models": catalog.stats()["models"],
+        "free_models_count": len(free_models),
+        "recommended_free_models": candidate_models(),
+        "all_free_models": free_models[:20],  # First 20 free models
+        "catalog": catalog.stats()
     }
-    
-    try:
-        response = requests.get(
-            "https://openrouter.ai/api/v1/models",
-            headers=headers,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            models = response.json()
-            # Get free models (pricing.prompt = "0")
-            free_models = []
-            for model in models.get("data", []):
-                pricing = model.get("pricing", {})
-                if pricing.get("prompt") == "0" or pricing.get("prompt") == 0:
-                    free_models.append({
-                        "id": model["id"],
-                        "name": model.get("name", "Unknown"),
-                        "context_length": model.get("context_length", "Unknown")
-                    })
-            
-            return {
-                "status": "success",
-                "total_models": len(models.get("data", [])),
-                "free_models_count": len(free_models),
-                "recommended_free_models": [
-                    "deepseek/deepseek-r1:free",
-                    "deepseek/deepseek-v3:free", 
-                    "mistralai/mistral-7b-instruct:free",
-                    "google/gemma-2-2b-it:free",
-                    "meta-llama/llama-3.2-3b-instruct:free"
-                ],
-                "all_free_models": free_models[:20]  # First 20 free models
-            }
-        else:
-            return {
-                "status": "error",
-                "status_code": response.status_code,
-                "response": response.text[:200]
-            }
-            
-    except Exception as e:
-        return {"status": "error", "error": str(e)}
 
 @debug_router.post("/test-summarize-only")
 async def test_summarize_only():
@@ -162,19 +183,22 @@ async def test_summarize_only():
     test_content = "Machine learning is a subset of artificial intelligence (AI) that focuses on algorithms that can learn and make decisions from data. It includes supervised learning, unsupervised learning, and reinforcement learning."
     
     try:
-        print("🔍 Starting summarize test...")
+        logger.info("Starting summarize test")
         from app.services.summarize import generate_summary_using_openrouter
-        summary = generate_summary_using_openrouter(test_content)
+        meta = {}
+        summary = await generate_summary_using_openrouter(test_content, meta)
+        # The fallback is a real (extractive) summary, so only meta can tell them apart
+        is_fallback = not summary or meta.get("fallback", False) or "error" in meta
         
         return {
-            "status": "✅ SUCCESS" if summary and "Unable to generate AI summary" not in summary and "API key not configured" not in summary else "⚠️ FALLBACK",
+            "status": "⚠️ FALLBACK" if is_fallback else "✅ SUCCESS",
             "test_content": test_content,
             "summary_result": summary,
             "summary_length": len(summary) if summary else 0,
-            "is_fallback": any(phrase in summary for phrase in ["Unable to generate AI summary", "API key not configured", "covers important information"]) if summary else True
+            "is_fallback": is_fallback
         }
     except Exception as e:
-        print(f"❌ Summarize test error: {e}")
+        logger.exception("Summarize test error")
         return {
             "status": "❌ ERROR",
             "error": str(e),
@@ -191,8 +215,9 @@ async def test_all_services():
     # Test Summarization
     try:
         from app.services.summarize import generate_summary_using_openrouter
-        summary = generate_summary_using_openrouter(test_content)
-        is_success = summary and not any(phrase in summary for phrase in ["Unable to generate AI summary", "API key not configured", "covers important information"])
+        meta = {}
+        summary = await generate_summary_using_openrouter(test_content, meta)
+        is_success = bool(summary) and not meta.get("fallback") and "error" not in meta
         results["summarization"] = {
             "status": "✅ SUCCESS" if is_success else "⚠️ FALLBACK",
             "result": summary,
@@ -204,7 +229,7 @@ async def test_all_services():
     # Test Flashcards
     try:
         from app.services.flashcard_generator import generate_flashcards_using_openrouter
-        flashcards = generate_flashcards_using_openrouter(test_content)
+        flashcards = await generate_flashcards_using_openrouter(test_content)
         is_success = flashcards and len(flashcards) > 0 and all('question' in fc and 'answer' in fc for fc in flashcards)
         results["flashcards"] = {
             "status": "✅ SUCCESS" if is_success else "❌ FAILED",
@@ -217,7 +242,7 @@ async def test_all_services():
     # Test Quiz
     try:
         from app.services.quiz_generator import generate_quiz_using_openrouter
-        quiz = generate_quiz_using_openrouter(test_content)
+        quiz = await generate_quiz_using_openrouter(test_content)
         is_success = quiz and len(quiz) > 0 and all('question' in q and 'options' in q and 'answer' in q for q in quiz)
         results["quiz"] = {
             "status": "✅ SUCCESS" if is_success else "❌ FAILED",
@@ -262,69 +287,28 @@ async def test_full_workflow():
     
     workflow_results = {}
     
-    # Test 1: Summarization API
-    try:
-        import requests
-        response = requests.post(
-            "http://localhost:8000/api/summarize",
-            json={"notes": test_notes},
-            headers={"Content-Type": "application/json"},
-            timeout=30
-        )
-        workflow_results["summarize_api"] = {
-            "status_code": response.status_code,
-            "success": response.status_code == 200,
-            "response": response.json() if response.status_code == 200 else response.text[:200],
-            "endpoint": "/api/summarize"
-        }
-    except Exception as e:
-        workflow_results["summarize_api"] = {
-            "success": False,
-            "error": str(e),
-            "endpoint": "/api/summarize"
-        }
-    
-    # Test 2: Flashcards API
-    try:
-        response = requests.post(
-            "http://localhost:8000/api/generate-flashcards",
-            json={"notes": test_notes},
-            headers={"Content-Type": "application/json"},
-            timeout=30
-        )
-        workflow_results["flashcards_api"] = {
-            "status_code": response.status_code,
-            "success": response.status_code == 200,
-            "response": response.json() if response.status_code == 200 else response.text[:200],
-            "endpoint": "/api/generate-flashcards"
-        }
-    except Exception as e:
-        workflow_results["flashcards_api"] = {
-            "success": False,
-            "error": str(e),
-            "endpoint": "/api/generate-flashcards"
-        }
-    
-    # Test 3: Quiz API
-    try:
-        response = requests.post(
-            "http://localhost:8000/api/generate-quiz",
-            json={"notes": test_notes},
-            headers={"Content-Type": "application/json"},
-            timeout=30
-        )
-        workflow_results["quiz_api"] = {
-            "status_code": response.status_code,
-            "success": response.status_code == 200,
-            "response": response.json() if response.status_code == 200 else response.text[:200],
-            "endpoint": "/api/generate-quiz"
-        }
-    except Exception as e:
-        workflow_results["quiz_api"] = {
-            "success": False,
-            "error": str(e),
-            "endpoint": "/api/generate-quiz"
-        }
+    # Requests go through the app in-process, so this works whatever port or
+    # worker count we run with and never ties up a connection to ourselves
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://studybuddy", timeout=60) as client:
+        for name, endpoint in [
+            ("summarize_api", "/api/summarize"),
+            ("flashcards_api", "/api/generate-flashcards"),
+            ("quiz_api", "/api/generate-quiz")
+        ]:
+            try:
+                response = await client.post(endpoint, json={"notes": test_notes})
+                workflow_results[name] = {
+                    "status_code": response.status_code,
+                    "success": response.status_code == 200,
+                    "response": response.json() if response.status_code == 200 else response.text[:200],
+                    "endpoint": endpoint
+                }
+            except Exception as e:
+                workflow_results[name] = {
+                    "success": False,
+                    "error": str(e),
+                    "endpoint": endpoint
+                }
     
     # Summary
     successful_apis = [name for name, result in workflow_results.items() if result.get("success", False)]
@@ -348,10 +332,14 @@ app.include_router(debug_router, prefix="/debug")
 app.include_router(summarizer.router, prefix="/api")
 app.include_router(quiz.router, prefix="/api")
 app.include_router(flashcards.router, prefix="/api")
+app.include_router(study_pack.router, prefix="/api")
+app.include_router(jobs.router, prefix="/api")
+app.include_router(upload.router, prefix="/api")
+app.include_router(batch.router, prefix="/api")
 
 @app.get("/")
 async def root():
-    api_key_set = os.getenv("OPENROUTER_API_KEY") is not None
+    api_key_set = settings.openrouter_api_key is not None
     return {
         "message": "StudyBuddy API is running", 
         "api_key_configured": api_key_set,
@@ -361,6 +349,11 @@ async def root():
             "summarize": "/api/summarize",
             "flashcards": "/api/generate-flashcards", 
             "quiz": "/api/generate-quiz",
+            "study_pack": "/api/study-pack",
+            "jobs": "/api/jobs/{summary|quiz|flashcards|study-pack}",
+            "upload_pdf": "/api/upload-pdf",
+            "batch": "/api/batch/{summarize|quiz|flashcards}",
+            "metrics": "/metrics",
             "debug": "/debug/test-api-quick",
             "full_test": "/debug/test-full-workflow"
         },
@@ -372,19 +365,39 @@ async def root():
                 "POST /debug/test-full-workflow",
                 "POST /api/summarize",
                 "POST /api/generate-flashcards",
-                "POST /api/generate-quiz"
+                "POST /api/generate-quiz",
+                "POST /api/study-pack",
+                "POST /api/summarize/stream",
+                "POST /api/generate-quiz/stream",
+                "POST /api/generate-flashcards/stream",
+                "POST /api/jobs/{kind}",
+                "GET /api/jobs/{job_id}",
+                "POST /api/upload-pdf",
+                "POST /api/batch/{kind}"
             ]
         }
     }
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
-    api_key = os.getenv("OPENROUTER_API_KEY")
+    api_key = settings.openrouter_api_key
     return {
         "status": "healthy", 
         "api_key_set": api_key is not None,
         "api_key_valid_format": api_key.startswith("sk-or-v1-") if api_key else False,
         "timestamp": "2025-07-23",
-        "services": ["summarize", "flashcards", "quiz"],
-        "debug_endpoints": ["/debug/test-api-quick", "/debug/test-full-workflow"]
+        "services": ["summarize", "flashcards", "quiz", "study-pack"],
+        "debug_endpoints": ["/debug/test-api-quick", "/debug/test-full-workflow"],
+        "skipped_models": model_health.skipped_models(),
+        "models": model_health.snapshot(),
+        "cache": response_cache.stats(),
+        "generation": generation_stats.snapshot(),
+        "jobs_pending": job_queue.pending,
+        "rate_limiter": rate_limiter.stats(),
+        "admission": admission.stats(),
+        "model_catalog": catalog.stats()
     }
\ No newline at end of file
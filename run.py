@@ -1,6 +1,33 @@
 # run.py
+import importlib.util
 import uvicorn
+from app.config import settings
+from app.utils.logging_config import setup_logging
 
-if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
+def _installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+if __name__ == "__main__":
+    if settings.reload:
+        # Development: a single process that restarts when code changes
+        uvicorn.run("main:app", host=settings.host, port=settings.port, reload=True)
+    else:
+        setup_logging()
+        uvicorn.run(
+            "main:app",
+            host=settings.host,
+            port=settings.port,
+            workers=settings.workers,
+            # Faster event loop and HTTP parser when present (pip install uvicorn[standard])
+            loop="uvloop" if _installed("uvloop") else "asyncio",
+            http="httptools" if _installed("httptools") else "h11",
+            backlog=settings.backlog,
+            timeout_keep_alive=settings.keep_alive_seconds,
+            timeout_graceful_shutdown=settings.graceful_shutdown_seconds,
+            limit_max_requests=settings.max_requests_per_worker or None,
+            forwarded_allow_ips=settings.forwarded_allow_ips,
+            # Each worker routes logging through app/utils/logging_config.py
+            log_config=None
+        )